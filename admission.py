@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+admission.py - تحكّم تكيّفي بالقبول: التحوّل إلى وضع "KB فقط" تحت الضغط.
+
+لكل عامل gunicorn ثلاث إشارات:
+- inflight   : عدد الطلبات قيد التنفيذ الآن في العامل.
+- queue_wait : زمن انتظار الطلب قبل وصوله للعامل (من ترويسة X-Request-Start إن
+               أضافها الـ proxy)، متوسط متحرك أُسّي (EWMA).
+- llm_ms     : زمن استجابة OpenAI الأخير، EWMA. يضمحل مع الزمن (نصف عمر llm_decay_s)
+               منذ آخر قياس: القياس القديم لا يُبقي العامل في degraded إلى الأبد حين
+               لا تصل مِجَسّات (المِجَسّ لا يُرسل إلا مع سؤال لم تُجبه KB).
+
+الوضع normal → degraded عند تجاوز أي إشارة حدها الأعلى، ويعود إلى normal فقط حين تنزل
+كل الإشارات تحت حدودها الدنيا لمدة min_dwell_s على الأقل (hysteresis) فلا يتذبذب.
+في degraded لا تُستدعى OpenAI لأخطاء KB (فولباك أو إجابة مخزّنة)، إلا طلب "مِجَسّ"
+واحد كل probe_s ثانية لتحديث قياس زمن OpenAI.
+"""
+
+import time, threading
+from collections import OrderedDict
+
+NORMAL = "normal"
+DEGRADED = "degraded"
+
+
+def parse_request_start(raw: str, now: float = None):
+    """X-Request-Start: "t=1700000000.123" أو ms/µs منذ epoch → ثوانٍ انتظار (أو None)."""
+    raw = (raw or "").strip()
+    if raw.startswith("t="):
+        raw = raw[2:]
+    try:
+        ts = float(raw)
+    except ValueError:
+        return None
+    if ts > 1e14:  # ميكروثانية
+        ts /= 1e6
+    elif ts > 1e11:  # ملّي ثانية
+        ts /= 1e3
+    wait = (now or time.time()) - ts
+    return wait if 0 <= wait < 3600 else None
+
+
+class AdmissionController:
+    def __init__(self, high_inflight: int, low_inflight: int,
+                 high_wait_ms: float, low_wait_ms: float,
+                 high_llm_ms: float, low_llm_ms: float,
+                 alpha: float = 0.2, min_dwell_s: float = 30.0, probe_s: float = 10.0,
+                 llm_decay_s: float = 60.0, enabled: bool = True):
+        self.high = {"inflight": high_inflight, "queue_wait_ms": high_wait_ms, "llm_ms": high_llm_ms}
+        self.low = {"inflight": low_inflight, "queue_wait_ms": low_wait_ms, "llm_ms": low_llm_ms}
+        self.alpha = alpha
+        self.min_dwell_s = min_dwell_s
+        self.probe_s = probe_s
+        self.llm_decay_s = llm_decay_s
+        self.enabled = enabled
+
+        self.mode = NORMAL
+        self.reason = None
+        self.inflight = 0
+        self.queue_wait_ms = 0.0
+        self.llm_ms = 0.0
+        self._llm_at = time.monotonic()
+        self.changed_at = time.monotonic()
+        self.transitions = 0
+        self._calm_since = None
+        self._last_probe = 0.0
+        self._lock = threading.Lock()
+
+    # ---------- الإشارات ----------
+    def _ewma(self, old: float, value: float) -> float:
+        return value if old == 0.0 else old + self.alpha * (value - old)
+
+    def enter(self, queue_wait_s: float = None):
+        with self._lock:
+            self.inflight += 1
+            if queue_wait_s is not None:
+                self.queue_wait_ms = self._ewma(self.queue_wait_ms, queue_wait_s * 1000.0)
+            self._evaluate()
+
+    def leave(self):
+        with self._lock:
+            self.inflight = max(0, self.inflight - 1)
+            self._evaluate()
+
+    def observe_llm(self, latency_ms: float):
+        with self._lock:
+            self._decay_llm(time.monotonic())
+            self.llm_ms = self._ewma(self.llm_ms, latency_ms)
+            self._evaluate()
+
+    def _decay_llm(self, now: float):
+        if self.llm_decay_s > 0 and now > self._llm_at:
+            self.llm_ms *= 0.5 ** ((now - self._llm_at) / self.llm_decay_s)
+        self._llm_at = now
+
+    def signals(self) -> dict:
+        return {
+            "inflight": self.inflight,
+            "queue_wait_ms": round(self.queue_wait_ms, 1),
+            "llm_ms": round(self.llm_ms, 1),
+        }
+
+    # ---------- الوضع ----------
+    def _evaluate(self):
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        self._decay_llm(now)
+        sig = self.signals()
+        if self.mode == NORMAL:
+            over = [k for k, v in sig.items() if self.high[k] and v >= self.high[k]]
+            if over:
+                self._switch(DEGRADED, now, over[0], sig)
+            return
+
+        calm = all(not self.low[k] or v <= self.low[k] for k, v in sig.items())
+        if not calm:
+            self._calm_since = None
+        elif self._calm_since is None:
+            self._calm_since = now
+        elif now - self._calm_since >= self.min_dwell_s and now - self.changed_at >= self.min_dwell_s:
+            self._switch(NORMAL, now, None, sig)
+
+    def _switch(self, mode: str, now: float, reason, sig: dict):
+        self.mode = mode
+        self.reason = reason
+        self.changed_at = now
+        self._calm_since = None
+        self._last_probe = now  # أول مِجَسّ بعد probe_s من الدخول، لا فوراً
+        self.transitions += 1
+        if mode == DEGRADED:
+            print(f"⚠️ admission: degraded (KB فقط) بسبب {reason} — {sig}")
+        else:
+            print(f"✅ admission: normal — {sig}")
+
+    def allow_ai(self) -> bool:
+        """هل يُسمح باستدعاء OpenAI الآن؟ في degraded يُسمح بمِجَسّ واحد كل probe_s."""
+        if self.mode == NORMAL:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_probe >= self.probe_s:
+                self._last_probe = now
+                return True
+        return False
+
+    def status(self) -> dict:
+        return {
+            "mode": self.mode,
+            "reason": self.reason,
+            "since_s": round(time.monotonic() - self.changed_at, 1),
+            "transitions": self.transitions,
+            "signals": self.signals(),
+            "high": self.high,
+            "low": self.low,
+        }
+
+
+class AnswerCache:
+    """آخر إجابات OpenAI (LRU محدود لكل عامل) تُخدم في وضع degraded بدل الفولباك."""
+
+    def __init__(self, max_items: int = 512):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            val = self._items.get(key)
+            if val is not None:
+                self._items.move_to_end(key)
+            return val
+
+    def put(self, key, value):
+        if not self.max_items:
+            return
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
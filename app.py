@@ -10,20 +10,73 @@ ZOMRA_PROJECT - Flask Chatbot (Blood Donation Assistant)
 - تحسين فولباك خدمة العملاء والرد الافتراضي.
 """
 
-from openai import OpenAI
-from flask import Flask, request, jsonify, render_template, Response
+import time
+
+_BOOT_T0 = time.perf_counter()
+
+from flask import Flask, request, jsonify, render_template, Response, g
 from flask_cors import CORS
-import os, sqlite3, re, json, csv, unicodedata, smtplib, base64
+from werkzeug.middleware.proxy_fix import ProxyFix
+import os, sqlite3, re, json, csv, base64, hmac, zlib, hashlib, math
+import contextvars, queue
+from concurrent.futures import ThreadPoolExecutor
 from email.message import EmailMessage
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
-from fuzzywuzzy import process, fuzz
+from fuzzywuzzy import fuzz
 from langdetect import detect, LangDetectException
 from io import StringIO
 from typing import Tuple
-import requests
 import urllib.parse as up
 
+from llm_backends import make_backend
+from audio_jobs import AudioJobQueue, UploadTooLarge, make_transcriber, save_upload_stream
+from rate_limit import RateLimited, TokenBucketLimiter, parse_policy
+from urgent_feed import UrgentFeed
+from urgent_index import BLOOD_TYPES, CenterLocator, UrgentIndex, parse_blood_types, parse_need
+from tracing import Tracer, span, traced
+from admission import DEGRADED, AdmissionController, AnswerCache, parse_request_start
+from donor_match import DonorMatcher, donor_location_fields
+from donor_match import migrate as migrate_donor_match
+from mailer import PooledSMTP
+from chat_core import (
+    DB_NAME,
+    INTENT_ROUTER,
+    KB_SIM_THRESHOLD,
+    KB_SUMMARY_LEN,
+    kb_answer_key,
+    kb_state,
+    normalize_arabic,
+    search_kb,
+    search_knowledge_base,
+    search_knowledge_base_many,
+    strip_llm_label,
+    summarize_and_simplify,
+    text_script,
+    translation_prompt,
+)
+from log_store import ResponseStore
+from detail_cache import DetailCache
+from db import Database
+
+# ==============================
+# 0) Startup profile
+# ==============================
+# زمن كل مرحلة من مراحل الإقلاع (ms). يُطبع عند STARTUP_PROFILE=1 ويظهر في /health.
+STARTUP_TIMINGS = []
+_boot_last = _BOOT_T0
+FIRST_RESPONSE_MS = None
+
+
+def _startup_mark(phase: str):
+    global _boot_last
+    now = time.perf_counter()
+    STARTUP_TIMINGS.append((phase, round((now - _boot_last) * 1000.0, 1)))
+    _boot_last = now
+
+
+_startup_mark("imports")
+
 # ==============================
 # 1) ENV / Config
 # ==============================
@@ -39,9 +92,20 @@ FORCE_AI_FALLBACK = (os.getenv("FORCE_AI_FALLBACK") or "false").lower() in {
     "true",
     "yes",
 }
+# خلفية الـ LLM: openai | stub | record | replay | none (انظر llm_backends.py)
+LLM_BACKEND = (os.getenv("LLM_BACKEND") or "openai").strip().lower()
 
 URGENT_SHEET_URL = (os.getenv("URGENT_NEEDS_SHEET_CSV") or "").strip()
 URGENT_JSON_PATH = "static/urgent_needs.json"
+# إعادة جلب مصدر الاحتياج العاجل كل N ثانية (لقطة مشتركة + بث SSE)
+URGENT_REFRESH_S = float(os.getenv("URGENT_REFRESH_S") or "30")
+URGENT_SSE_HEARTBEAT_S = 15.0
+# كل اتصال SSE يشغل خيطاً في عامل gthread؛ ارفع الحد مع GUNICORN_WORKER_CLASS=gevent
+URGENT_SSE_MAX_CLIENTS = int(os.getenv("URGENT_SSE_MAX_CLIENTS") or "2")
+CENTERS_JSON_PATH = "static/centers_jeddah.json"
+# نصف القطر الافتراضي/الأقصى لبحث ?near=lat,lng بالكيلومتر
+URGENT_NEAR_RADIUS_KM = 25.0
+URGENT_NEAR_MAX_RADIUS_KM = 500.0
 CAMPAIGNS_JSON_PATH = "static/campaigns.json"
 
 SMTP_HOST = os.getenv("SMTP_HOST") or ""
@@ -54,104 +118,173 @@ SMTP_TLS = (os.getenv("SMTP_TLS") or "true").lower() in {"1", "true", "yes"}
 SMTP_READY = all([SMTP_HOST, SMTP_PORT, SMTP_FROM]) and (
     bool(SMTP_USER) == bool(SMTP_PASS) or not SMTP_USER
 )
+# اتصال SMTP المفتوح يُغلق بعد هذه المدة من الخمول (أغلب الخوادم تقطعه بعد 60-300 ث)
+SMTP_IDLE_S = float(os.getenv("SMTP_IDLE_S") or "60")
 
 SENDGRID_API_KEY = os.getenv("SENDGRID_API_KEY") or ""
 SENDGRID_FROM = os.getenv("SENDGRID_FROM") or SMTP_FROM or ""
 EMAIL_FROM_NAME = os.getenv("EMAIL_FROM") or "Zomra Project"
 SENDGRID_READY = bool(SENDGRID_API_KEY)
 
-if not OPENAI_API_KEY:
+# تنبيه المتبرعين المشتركين عند ظهور احتياج عاجل متوافق قريب منهم
+DONOR_MATCH_ENABLED = (os.getenv("DONOR_MATCH_ENABLED") or "true").lower() in {"1", "true", "yes"}
+DONOR_MATCH_RADIUS_KM = float(os.getenv("DONOR_MATCH_RADIUS_KM") or "30")
+DONOR_NOTIFY_COOLDOWN_DAYS = int(os.getenv("DONOR_NOTIFY_COOLDOWN_DAYS") or "7")
+DONOR_MATCH_MAX_PER_NEED = int(os.getenv("DONOR_MATCH_MAX_PER_NEED") or "200")
+# بعدها يُعامل الاحتياج لنفس المستشفى والفصيلة كاحتياج جديد (تُحذف تنبيهاته المنتهية)
+DONOR_NEED_TTL_DAYS = int(os.getenv("DONOR_NEED_TTL_DAYS") or "14")
+# جلب دوري للاحتياجات في كل عامل (ثوانٍ) حتى لا تعتمد المطابقة على ورود طلبات؛ 0 = تعطيل
+DONOR_MATCH_POLL_S = float(os.getenv("DONOR_MATCH_POLL_S") or "300")
+
+# /api/chat/batch: أقصى عدد رسائل في الطلب، وعدد استدعاءات OpenAI المتوازية
+CHAT_BATCH_MAX = int(os.getenv("CHAT_BATCH_MAX") or "50")
+CHAT_BATCH_WORKERS = int(os.getenv("CHAT_BATCH_WORKERS") or "4")
+
+# رمز الوصول لواجهات الإدارة (التصدير والبحث في السجلات). فارغ = الواجهات معطّلة.
+ADMIN_API_TOKEN = (os.getenv("ADMIN_API_TOKEN") or "").strip()
+
+# الرسائل الصوتية: stub | openai | none (الافتراضي openai عند توفر المفتاح)
+AUDIO_TRANSCRIBER = (
+    os.getenv("AUDIO_TRANSCRIBER") or ("openai" if OPENAI_API_KEY else "stub")
+).strip().lower()
+AUDIO_UPLOAD_DIR = os.getenv("AUDIO_UPLOAD_DIR") or "uploads"
+AUDIO_MAX_BYTES = int(os.getenv("AUDIO_MAX_BYTES") or str(10 * 1024 * 1024))
+AUDIO_WORKERS = int(os.getenv("AUDIO_WORKERS") or "2")
+AUDIO_MAX_WAIT_S = 10.0
+
+# تحديد المعدل: "N/S" = N طلباً كل S ثانية لكل عميل (IP أو مفتاح API)
+RATE_LIMIT_ENABLED = (os.getenv("RATE_LIMIT_ENABLED") or "true").lower() in {"1", "true", "yes"}
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB") or "ratelimit.db"
+RATE_POLICIES = {
+    "cheap": os.getenv("RATE_LIMIT_CHEAP") or "30/60",
+    "ai": os.getenv("RATE_LIMIT_AI") or "10/60",
+    "cheap_key": os.getenv("RATE_LIMIT_CHEAP_KEY") or "300/60",
+    "ai_key": os.getenv("RATE_LIMIT_AI_KEY") or "60/60",
+}
+# حصة التوكنات اليومية لكل عميل (0 = بدون حد)
+AI_DAILY_TOKEN_QUOTA = int(os.getenv("AI_DAILY_TOKEN_QUOTA") or "20000")
+AI_DAILY_TOKEN_QUOTA_KEY = int(os.getenv("AI_DAILY_TOKEN_QUOTA_KEY") or "200000")
+# مفاتيح API للشركاء (مفصولة بفواصل) — تُعرَّف عبر الترويسة X-API-Key
+API_KEYS = {k.strip() for k in (os.getenv("API_KEYS") or "").split(",") if k.strip()}
+# عدد الوكلاء الموثوقين أمام التطبيق (Render: واحد). IP العميل هو ما أضافه آخرهم إلى
+# X-Forwarded-For؛ ما قبله يكتبه العميل نفسه فلا يُعتمد عليه. 0 = بلا وكيل (remote_addr).
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS") or "1")
+
+# التتبّع: نسبة الطلبات المحفوظة، وكل طلب أبطأ من TRACE_SLOW_MS يُحفظ دائماً
+TRACE_ENABLED = (os.getenv("TRACE_ENABLED") or "true").lower() in {"1", "true", "yes"}
+TRACE_PATH = os.getenv("TRACE_PATH") or "traces.jsonl"
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE") or "0.01")
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS") or "2000")
+
+# التحكّم بالقبول (لكل عامل): فوق الحد الأعلى لأي إشارة تُخدم أخطاء KB بالفولباك أو
+# بإجابة مخزّنة بدل OpenAI، والعودة فقط بعد نزول كل الإشارات تحت الحد الأدنى.
+ADMISSION_ENABLED = (os.getenv("ADMISSION_ENABLED") or "true").lower() in {"1", "true", "yes"}
+# inflight لا يتجاوز عدد خيوط gthread (الزائد ينتظر في طابور gunicorn)، فعامل مشغول
+# بكل خيوطه ليس بالضرورة مُحمّلاً فوق طاقته: الحمل الزائد يظهر في زمن الانتظار
+# (X-Request-Start) وزمن OpenAI. الحد معطّل افتراضياً (0)، ويُفعَّل لعمال بلا حد خيوط.
+ADMISSION_HIGH_INFLIGHT = int(os.getenv("ADMISSION_HIGH_INFLIGHT") or "0")
+ADMISSION_LOW_INFLIGHT = int(os.getenv("ADMISSION_LOW_INFLIGHT") or "0")
+ADMISSION_HIGH_WAIT_MS = float(os.getenv("ADMISSION_HIGH_WAIT_MS") or "1000")
+ADMISSION_LOW_WAIT_MS = float(os.getenv("ADMISSION_LOW_WAIT_MS") or "200")
+ADMISSION_HIGH_LLM_MS = float(os.getenv("ADMISSION_HIGH_LLM_MS") or "8000")
+ADMISSION_LOW_LLM_MS = float(os.getenv("ADMISSION_LOW_LLM_MS") or "3000")
+ADMISSION_MIN_DWELL_S = float(os.getenv("ADMISSION_MIN_DWELL_S") or "30")
+# نصف عمر قياس زمن OpenAI (ث) دون قياسات جديدة
+ADMISSION_LLM_DECAY_S = float(os.getenv("ADMISSION_LLM_DECAY_S") or "60")
+AI_ANSWER_CACHE_SIZE = int(os.getenv("AI_ANSWER_CACHE_SIZE") or "512")
+# النص الكامل للإجابات الملخّصة لطلب "تفاصيل أكثر" (answer_id)
+DETAIL_CACHE_TTL_S = float(os.getenv("DETAIL_CACHE_TTL_S") or "1800")
+DETAIL_CACHE_SIZE = int(os.getenv("DETAIL_CACHE_SIZE") or "2048")
+# اتصالات SQLite لكل خيط (db.py): ذاكرة الصفحات و mmap لكل اتصال
+DB_MMAP_MB = int(os.getenv("DB_MMAP_MB") or "64")
+DB_CACHE_KB = int(os.getenv("DB_CACHE_KB") or "8192")
+
+# هدف زمن أول رد منذ بدء العملية (ms) — يُسجَّل تحذير عند تجاوزه.
+STARTUP_PROFILE = (os.getenv("STARTUP_PROFILE") or "false").lower() in {"1", "true", "yes"}
+STARTUP_TARGET_MS = int(os.getenv("STARTUP_TARGET_MS") or "1500")
+
+if not OPENAI_API_KEY and LLM_BACKEND in ("openai", "record"):
     print("⚠️ لم يتم العثور على OPENAI_API_KEY في .env. سيتم العمل دون ذكاء اصطناعي (وضع KB فقط).")
 
-client = None
-if OPENAI_API_KEY:
-    try:
-        client = OpenAI(api_key=OPENAI_API_KEY)
-    except Exception as e:
-        print(f"⚠️ فشل تهيئة OpenAI: {e}")
-        client = None
-
-# ==============================
-# 2) Arabic / Text utils
-# ==============================
-_ARABIC_DIACRITICS_RE = re.compile(
-    r"[\u0617-\u061A\u064B-\u0652\u0670\u0653-\u065F\u06D6-\u06ED]"
+llm = None
+try:
+    llm = make_backend(LLM_BACKEND, api_key=OPENAI_API_KEY, model=OPENAI_MODEL)
+    if llm and llm.name != "openai":
+        print(f"ℹ️ خلفية LLM: {llm.name}")
+except Exception as e:
+    print(f"⚠️ فشل تهيئة خلفية LLM ({LLM_BACKEND}): {e}")
+    llm = None
+
+ADMISSION = AdmissionController(
+    high_inflight=ADMISSION_HIGH_INFLIGHT,
+    low_inflight=ADMISSION_LOW_INFLIGHT,
+    high_wait_ms=ADMISSION_HIGH_WAIT_MS,
+    low_wait_ms=ADMISSION_LOW_WAIT_MS,
+    high_llm_ms=ADMISSION_HIGH_LLM_MS,
+    low_llm_ms=ADMISSION_LOW_LLM_MS,
+    min_dwell_s=ADMISSION_MIN_DWELL_S,
+    llm_decay_s=ADMISSION_LLM_DECAY_S,
+    enabled=ADMISSION_ENABLED,
 )
+AI_ANSWER_CACHE = AnswerCache(AI_ANSWER_CACHE_SIZE)
 
 
-def normalize_arabic(text: str) -> str:
-    """إزالة التشكيل وتوحيد بعض الحروف لتسهيل البحث بالتقريب."""
-    if not text:
-        return ""
-    t = _ARABIC_DIACRITICS_RE.sub("", text)
-    t = (
-        t.replace("أ", "ا")
-        .replace("إ", "ا")
-        .replace("آ", "ا")
-        .replace("ؤ", "و")
-        .replace("ئ", "ي")
-        .replace("ة", "ه")
-        .replace("ـ", "")
-    )
-    t = unicodedata.normalize("NFKC", t)
-    t = re.sub(r"\s+", " ", t).strip()
-    return t
+def ai_degraded() -> bool:
+    """وضع KB فقط (الحمل مرتفع): الاستدعاءات الثانوية (ترجمة/تصحيح) تُتخطّى."""
+    return ADMISSION.mode == DEGRADED
 
 
-def summarize_and_simplify(text: str, max_length: int = 250, lang: str = "ar") -> str:
-    """
-    تلخيص بسيط مع احترام الجمل (يدعم عربي وإنجليزي).
-    - lang = "ar": يختم بـ "هل ترغب بالتفصيل أكثر؟"
-    - lang = "en": يختم بـ "Would you like more details?"
-    """
-    if not text or len(text) <= max_length:
-        return text
+def llm_complete(messages, max_tokens: int = 256, temperature=None) -> str:
+    """استدعاء خلفية الـ LLM الحالية وإرجاع النص فقط (مع احتساب التوكنات للعميل الحالي)."""
+    t0 = time.perf_counter()
+    try:
+        with span("llm", backend=llm.name) as sp:
+            reply = llm.complete(messages, max_tokens=max_tokens, temperature=temperature)
+            sp.set(
+                prompt_tokens=reply.prompt_tokens,
+                completion_tokens=reply.completion_tokens,
+                backend_ms=reply.latency_ms,
+            )
+    finally:
+        # الأخطاء والمهلات تُحتسب أيضاً (هي غالباً أبطأ الاستدعاءات)
+        ADMISSION.observe_llm((time.perf_counter() - t0) * 1000.0)
+    cid = _CLIENT.get()
+    if RATE_LIMITER and cid:
+        RATE_LIMITER.record_usage(cid, reply.prompt_tokens + reply.completion_tokens)
+    return reply.text
 
-    if lang == "en":
-        cut_marks = [".", "?", "!", "…"]
-    else:
-        cut_marks = [".", "؟", "!", "…"]
 
-    trunc = text[: max_length - 5]
-    cut_pos = -1
-    for m in cut_marks:
-        pos = trunc.rfind(m)
-        if pos > cut_pos:
-            cut_pos = pos
+# جلسة HTTP لكل عملية (تُنشأ عند أول استخدام بعد fork، ولا تُشارك بين العمال)
+_HTTP = {"pid": None, "session": None}
 
-    if cut_pos == -1:
-        cut_pos = trunc.rfind(" ")
-        if cut_pos == -1:
-            cut_pos = len(trunc)
 
-    summary = trunc[:cut_pos].strip()
-    if lang == "en":
-        return f"{summary}...\n\nWould you like more details?"
-    else:
-        return f"{summary}...\n\nهل ترغب بالتفصيل أكثر؟"
+def http_session():
+    if _HTTP["pid"] != os.getpid():
+        import requests
+
+        _HTTP["session"] = requests.Session()
+        _HTTP["pid"] = os.getpid()
+    return _HTTP["session"]
+
+
+_startup_mark("config+llm")
+
+# ==============================
+# 2) Arabic / Text utils
+# ==============================
+# normalize_arabic و summarize_and_simplify و text_script: انظر chat_core.py (بلا آثار جانبية،
+# تستوردها سكربتات الصيانة أيضاً)، وجدول النوايا INTENT_TABLE هناك أيضاً.
 
 
 def openai_translate(text: str, target_language_code: str) -> str:
     """ترجمة بسيطة باستخدام OpenAI عند توفره."""
-    if not client or not text:
+    if not llm or not text or ai_degraded():
         return text
     try:
-        if target_language_code == "ar":
-            prompt = f"Translate to standard Arabic. Return only the translation:\n\n{text}"
-        elif target_language_code == "en":
-            prompt = f"Translate the following text to English. Return only the translation:\n\n{text}"
-        else:
-            prompt = (
-                f"Translate the following Arabic text to {target_language_code}. "
-                f"Return only the translation:\n\n{text}"
-            )
-        resp = client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=256,
-        )
-        out = (resp.choices[0].message.content or "").strip()
-        return out.split(":", 1)[-1].strip() if ":" in out[:15] else out
+        prompt = translation_prompt(text, target_language_code)
+        with span("translate", lang=target_language_code, chars=len(text)):
+            out = llm_complete([{"role": "user", "content": prompt}], max_tokens=256)
+        return strip_llm_label(out)
     except Exception as e:
         print("⚠️ ترجمة:", e)
         return text
@@ -168,16 +301,11 @@ def translate_field_for_lang(text: str, lang: str) -> str:
 
 def openai_correct(text: str) -> str:
     """تصحيح الإملاء العربي باستخدام OpenAI إن توفر (حاليًا غير مستخدم للتسريع)."""
-    if not client or not text:
+    if not llm or not text or ai_degraded():
         return text
     try:
         prompt = f"صحّح الأخطاء الإملائية في النص العربي التالي وأعد النص المصحح فقط:\n\n{text}"
-        resp = client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=128,
-        )
-        out = (resp.choices[0].message.content or "").strip()
+        out = llm_complete([{"role": "user", "content": prompt}], max_tokens=128)
         return out.split(":", 1)[-1].strip() if ":" in out[:15] else out
     except Exception as e:
         print("⚠️ تصحيح:", e)
@@ -195,7 +323,7 @@ def spell_correct_ar_en(text: str) -> str:
     - يصحح الإملاء والنحو فقط
     - يعيد النص المصحح فقط بدون شرح
     """
-    if not client or not text:
+    if not llm or not text or ai_degraded():
         return text
 
     try:
@@ -217,16 +345,10 @@ def spell_correct_ar_en(text: str) -> str:
                 f"{text}"
             )
 
-        resp = client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=80,
-            temperature=0.0,
+        return llm_complete(
+            [{"role": "user", "content": prompt}], max_tokens=80, temperature=0.0
         )
 
-        out = (resp.choices[0].message.content or "").strip()
-        return out
-
     except Exception as e:
         print("⚠️ spell_correct_ar_en:", e)
         return text
@@ -236,19 +358,8 @@ def spell_correct_ar_en(text: str) -> str:
 FOOTER_AR = "مُولَّد آليًا • قد يحتوي على أخطاء طفيفة\nمع تحياتي فريق زمرة 🩸"
 FOOTER_EN = "AI-generated • may contain minor errors\nWith regards, Zomrah Team 🩸"
 
-# ==============================
-# Intent: خدمة العملاء / الدعم
-# ==============================
-CUSTOMER_SERVICE_RE = re.compile(
-    r"(خدمة.?العملاء|الدعم|التواصل|تواصل|واتساب|whatsapp|customer service|support|contact\s+us|contact)",
-    re.IGNORECASE,
-)
-
-
 def is_customer_service_intent(text: str) -> bool:
-    if not text:
-        return False
-    return bool(CUSTOMER_SERVICE_RE.search(text))
+    return INTENT_ROUTER.match(text) == "support"
 
 
 WHATSAPP_URL = "https://wa.me/966504635135?text=" + up.quote(
@@ -259,17 +370,150 @@ WHATSAPP_URL = "https://wa.me/966504635135?text=" + up.quote(
 # 3) Flask + DB
 # ==============================
 app = Flask(__name__, template_folder="templates", static_folder="static")
+# حد أعلى لحجم الطلب (يحمي من رفع ملفات صوتية ضخمة قبل الوصول للمسار)
+app.config["MAX_CONTENT_LENGTH"] = AUDIO_MAX_BYTES + 1024 * 1024
+if TRUSTED_PROXY_HOPS > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS)
 CORS(app)
 
-DB_NAME = "chat_logs.db"
+# DB.writer() للكتابة و DB.reader() للقراءة فقط: اتصال طويل العمر لكل خيط (انظر db.py)
+DB = Database(DB_NAME, mmap_mb=DB_MMAP_MB, cache_kb=DB_CACHE_KB)
+
+# ==============================
+# Tracing / التتبّع
+# ==============================
+TRACER = Tracer(
+    TRACE_PATH,
+    sample_rate=TRACE_SAMPLE_RATE,
+    slow_ms=TRACE_SLOW_MS,
+    enabled=TRACE_ENABLED,
+)
+
+
+@app.before_request
+def _trace_start():
+    # يُسجَّل قبل تحديد المعدل حتى تظهر طلبات 429 أيضاً
+    if request.path.startswith("/static/"):
+        return
+    g.trace, g.trace_token = TRACER.start(
+        f"{request.method} {request.path}",
+        trace_id=TRACER.clean_id(request.headers.get("X-Trace-Id")),
+        force=request.headers.get("X-Trace-Sample") == "1",
+    )
+
+
+@app.after_request
+def _trace_finish(resp):
+    trace = g.pop("trace", None)
+    if trace is not None:
+        resp.headers["X-Trace-Id"] = trace.trace_id
+        TRACER.finish(
+            trace,
+            g.pop("trace_token", None),
+            status=resp.status_code,
+            client=_CLIENT.get(),
+        )
+    return resp
+
+
+# ==============================
+# Admission control / التحكّم بالقبول
+# ==============================
+@app.before_request
+def _admission_enter():
+    if request.path.startswith("/static/"):
+        return
+    g.admitted = True
+    ADMISSION.enter(parse_request_start(request.headers.get("X-Request-Start")))
+
+
+@app.teardown_request
+def _admission_leave(exc=None):
+    if g.pop("admitted", False):
+        ADMISSION.leave()
+
+
+# ==============================
+# Rate limiting / الحصص
+# ==============================
+# العميل الحالي (يُضبط لكل طلب، ولكل مهمة صوتية داخل خيوط الطابور)
+_CLIENT = contextvars.ContextVar("zomra_client", default=None)
+
+RATE_LIMITED_PATHS = {"/api/chat", "/api/autocorrect", "/api/upload_audio"}
+
+RATE_LIMITER = None
+if RATE_LIMIT_ENABLED:
+    try:
+        RATE_LIMITER = TokenBucketLimiter(
+            RATE_LIMIT_DB, {k: parse_policy(v) for k, v in RATE_POLICIES.items()}
+        )
+        RATE_LIMITER.init_db()
+    except Exception as e:
+        print("⚠️ فشل تهيئة تحديد المعدل:", e)
+        RATE_LIMITER = None
+
+
+def client_id() -> str:
+    """هوية العميل: مفتاح API معروف إن وُجد، وإلا IP العميل كما رآه الوكيل الموثوق (ProxyFix)."""
+    key = (request.headers.get("X-API-Key") or "").strip()
+    if key and key in API_KEYS:
+        return "key:" + hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+    ip = request.remote_addr or "unknown"
+    return "ip:" + ip
+
+
+def check_rate(cid: str, kind: str, cost: float = 1.0):
+    """kind: cheap | ai. يرفع RateLimited عند التجاوز."""
+    if not RATE_LIMITER or not cid:
+        return
+    bucket = kind + "_key" if cid.startswith("key:") else kind
+    # طلب أكبر من سعة الدلو لن يُسمح به أبداً، فيُحسب بالسعة كاملة
+    cost = min(cost, RATE_LIMITER.policies[bucket][0])
+    wait = RATE_LIMITER.take(cid, bucket, cost)
+    if wait > 0:
+        raise RateLimited(bucket, wait)
+
+
+def charge_ai():
+    """يُستدعى قبل أي استدعاء مدفوع لـ OpenAI: دلو ai + حصة التوكنات اليومية."""
+    cid = _CLIENT.get()
+    if not RATE_LIMITER or not cid:
+        return
+    check_rate(cid, "ai")
+    quota = AI_DAILY_TOKEN_QUOTA_KEY if cid.startswith("key:") else AI_DAILY_TOKEN_QUOTA
+    if quota and RATE_LIMITER.tokens_today(cid) >= quota:
+        now = datetime.now()
+        midnight = datetime(now.year, now.month, now.day) + timedelta(days=1)
+        raise RateLimited("ai", (midnight - now).total_seconds(), reason="quota")
+
+
+@app.before_request
+def _rate_limit_cheap():
+    cid = client_id()
+    _CLIENT.set(cid)
+    if request.path in RATE_LIMITED_PATHS and request.method == "POST":
+        check_rate(cid, "cheap")
+
+
+@app.errorhandler(RateLimited)
+def _rate_limited(e: RateLimited):
+    retry = max(1, math.ceil(e.retry_after))
+    msg = (
+        "تم تجاوز الحصة اليومية. حاول لاحقاً."
+        if e.reason == "quota"
+        else "طلبات كثيرة. حاول بعد قليل."
+    )
+    resp = jsonify({"ok": False, "error": msg, "retry_after": retry, "bucket": e.bucket})
+    resp.status_code = 429
+    resp.headers["Retry-After"] = str(retry)
+    return resp
+
 
 
 def init_db():
     """تهيئة قواعد البيانات (logs + reminders)."""
-    conn = sqlite3.connect(DB_NAME)
+    conn = DB.writer()  # WAL و synchronous=NORMAL يُضبطان عند فتح الاتصال
     c = conn.cursor()
-    c.execute("PRAGMA journal_mode=WAL;")
-    c.execute("PRAGMA synchronous=NORMAL;")
     c.execute(
         """
         CREATE TABLE IF NOT EXISTS logs(
@@ -295,42 +539,151 @@ def init_db():
         )
         """
     )
+    # فهارس لفلاتر الفترة الزمنية في التصدير
+    c.execute("CREATE INDEX IF NOT EXISTS idx_logs_timestamp ON logs(timestamp)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_reminders_created ON reminders(created_at)")
     conn.commit()
-    conn.close()
+    LOG_STORE.init(conn)
+    init_logs_fts(conn)
+    init_eligibility_histogram(conn)
+    migrate_donor_match(conn)
+    DETAIL_CACHE.init_db()
 
 
-def save_log(raw_query, corrected_query, response_type, kb_source, bot_response):
-    """حفظ ملخص الرد في جدول logs لأغراض الإحصاء والمتابعة."""
-    try:
-        conn = sqlite3.connect(DB_NAME)
-        c = conn.cursor()
-        snippet = (bot_response or "")[:500] + (
-            "..." if bot_response and len(bot_response) > 500 else ""
+def init_eligibility_histogram(conn):
+    """
+    eligibility_histogram: عدد المتبرعين الذين يصبحون مؤهلين في كل يوم (من reminders.next_date).
+    يُحدَّث مع كل إدراج تذكير في نفس المعاملة؛ يُبنى من reminders مرة واحدة عند إنشائه.
+    """
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='eligibility_histogram'"
+    ).fetchone()
+    if exists:
+        return
+    with conn:
+        conn.execute(
+            """
+            CREATE TABLE eligibility_histogram(
+                day TEXT PRIMARY KEY,
+                donors INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+            """
         )
-        c.execute(
+        conn.execute(
+            """
+            INSERT INTO eligibility_histogram(day, donors)
+            SELECT next_date, COUNT(*) FROM reminders
+            WHERE next_date IS NOT NULL GROUP BY next_date
             """
-            INSERT INTO logs(timestamp,raw_query,corrected_query,response_type,kb_source,bot_response)
-            VALUES(?,?,?,?,?,?)
-            """,
-            (
-                datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                raw_query,
-                corrected_query,
-                response_type,
-                kb_source,
-                snippet,
-            ),
         )
-        conn.commit()
+
+
+def bump_eligibility(conn, day: str, n: int = 1):
+    conn.execute(
+        """
+        INSERT INTO eligibility_histogram(day, donors) VALUES(?, ?)
+        ON CONFLICT(day) DO UPDATE SET donors = donors + excluded.donors
+        """,
+        (day, n),
+    )
+
+
+# ردود البوت: نص فريد واحد لكل بصمة في responses، مضغوط بقاموس zlib (انظر log_store.py).
+# القراءة عبر LOG_STORE.attach(conn) ثم العرض المؤقت logs_v بدل logs.
+LOG_STORE = ResponseStore(samples=lambda: _response_dict_samples())
+
+# النص الكامل للإجابات الملخّصة (مشترك بين العمال عبر جدول answer_details)
+DETAIL_CACHE = DetailCache(DB, ttl_s=DETAIL_CACHE_TTL_S, max_items=DETAIL_CACHE_SIZE)
+
+
+# فهرس نصي كامل (FTS5) على raw_query و bot_response بعد التطبيع، rowid = logs.id.
+# contentless: النصوص الأصلية تبقى في logs فقط، والفهرس يحتفظ بالكلمات.
+LOGS_FTS_READY = False
+
+
+# أداة التعريف ملتصقة بالكلمة: "الصفائح" و"بالصفائح" تُفهرس "صفائح" (نفس التطبيع عند البحث)
+_FTS_ARTICLE_RE = re.compile(r"(?<!\w)(?:وال|بال|فال|كال|لل|ال)(?=\w{2,})")
+
+
+def fts_normalize(text: str) -> str:
+    return _FTS_ARTICLE_RE.sub("", normalize_arabic(text or "").casefold())
+
+
+def init_logs_fts(conn):
+    """إنشاء logs_fts وفهرسة أي صفوف أقدم منه (مرة واحدة بعد أول نشر)."""
+    global LOGS_FTS_READY
+    try:
+        conn.execute(
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS logs_fts USING fts5(
+                raw_query, bot_response,
+                content='', tokenize='unicode61 remove_diacritics 2'
+            )
+            """
+        )
+        indexed = conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM logs_fts").fetchone()[0]
+        conn.create_function("fts_normalize", 1, fts_normalize, deterministic=True)
+        LOG_STORE.attach(conn)
+        with conn:
+            n = conn.execute(
+                """
+                INSERT INTO logs_fts(rowid, raw_query, bot_response)
+                SELECT id, fts_normalize(raw_query), fts_normalize(bot_response)
+                FROM logs_v WHERE id > ?
+                """,
+                (indexed,),
+            ).rowcount
+        if n > 0:
+            print(f"✅ فُهرس {n} سجلاً في logs_fts.")
+        LOGS_FTS_READY = True
+    except sqlite3.Error as e:
+        LOGS_FTS_READY = False
+        print("⚠️ FTS5 غير متاح، البحث في السجلات معطّل:", e)
+
+
+def _log_snippet(bot_response):
+    return (bot_response or "")[:500] + (
+        "..." if bot_response and len(bot_response) > 500 else ""
+    )
+
+
+def save_logs(rows):
+    """
+    حفظ عدة سجلات (raw_query, corrected_query, response_type, kb_source, bot_response)
+    مع فهرسها النصي (logs_fts) في معاملة واحدة.
+    """
+    if not rows:
+        return
+    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    pending = []
+    try:
+        conn = DB.writer()
+        with span("db_write", table="logs", rows=len(rows)), conn:
+            for rq, cq, rt, ks, br in rows:
+                snippet = _log_snippet(br)
+                cur = conn.execute(
+                    """
+                    INSERT INTO logs(timestamp,raw_query,corrected_query,response_type,kb_source,response_hash)
+                    VALUES(?,?,?,?,?,?)
+                    """,
+                    (ts, rq, cq, rt, ks, LOG_STORE.put(conn, snippet, pending)),
+                )
+                if LOGS_FTS_READY:
+                    # نفس المعاملة: السجل وفهرسه يُحفظان معاً أو لا يُحفظان
+                    conn.execute(
+                        "INSERT INTO logs_fts(rowid, raw_query, bot_response) VALUES(?,?,?)",
+                        (cur.lastrowid, fts_normalize(rq), fts_normalize(snippet)),
+                    )
+        # بعد commit فقط: عند rollback تُنسى البصمات مع صفوف responses
+        LOG_STORE.publish(pending)
     except Exception as e:
         print("⚠️ لم يُحفظ السجل:", e)
-    finally:
-        try:
-            conn.close()
-        except Exception:
-            pass
 
 
+def save_log(raw_query, corrected_query, response_type, kb_source, bot_response):
+    """حفظ ملخص الرد في جدول logs لأغراض الإحصاء والمتابعة."""
+    save_logs([(raw_query, corrected_query, response_type, kb_source, bot_response)])
+
 with app.app_context():
     try:
         init_db()
@@ -338,6 +691,8 @@ with app.app_context():
     except Exception as e:
         print("⚠️ فشل تهيئة قاعدة البيانات:", e)
 
+_startup_mark("db")
+
 # ==============================
 # 4) Base Routes
 # ==============================
@@ -355,7 +710,8 @@ def health():
     return jsonify(
         {
             "ok": True,
-            "openai": bool(client),
+            "openai": bool(llm),
+            "llm_backend": llm.name if llm else None,
             "model": OPENAI_MODEL,
             "urgent_sheet": bool(URGENT_SHEET_URL),
             "urgent_json": URGENT_JSON_PATH if os.path.exists(URGENT_JSON_PATH) else None,
@@ -365,6 +721,14 @@ def health():
             "sendgrid_ready": bool(SENDGRID_READY),
             "email_from_name": EMAIL_FROM_NAME,
             "sendgrid_from": SENDGRID_FROM,
+            "kb_questions": len(KB),
+            "kb_mmap": bool(KB.path),
+            "startup_ms": dict(STARTUP_TIMINGS),
+            "first_response_ms": FIRST_RESPONSE_MS,
+            "startup_target_ms": STARTUP_TARGET_MS,
+            "admission": ADMISSION.status(),
+            "donor_match": DONOR_MATCHER.stats,
+            "detail_cache": DETAIL_CACHE.stats,
         }
     )
 
@@ -373,259 +737,457 @@ def health():
 # ==============================
 
 
-def load_knowledge_base(path: str = "knowledge_base.json"):
-    kb = {}
-    if os.path.exists(path):
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            for item in data:
-                answer = item.get("answer", "")
-                src = (
-                    item.get("source_type")
-                    or item.get("source")
-                    or "القاعدة المعرفية"
-                )
-                for q in item.get("questions", []):
-                    kb[q] = {"answer": answer, "source": src}
-            if kb:
-                print(f"✅ تم تحميل قاعدة معرفية من {path} بعدد {len(kb)} سؤالاً.")
-                return kb
-        except Exception as e:
-            print("⚠️ فشل تحميل knowledge_base.json:", e)
+# القاعدة تُحمَّل هنا (عند الإقلاع، قبل fork) ليشاركها كل العمال؛ البحث نفسه في chat_core.py
+_KB_STATE = kb_state()
+KB = _KB_STATE.kb
+KB_I18N = _KB_STATE.i18n
+_startup_mark("kb")
 
-    print("ℹ️ سيتم استخدام قاعدة معرفية افتراضية بسيطة.")
-    return {
-        "ما هي شروط التبرع بالدم؟": {
-            "answer": "يجب أن يكون العمر 18-60 عاماً والوزن ≥50 كجم وبصحة جيدة وبدون أمراض معدية. يفضّل مراجعة المستشفى قبل التبرع.",
-            "source": "القاعدة المعرفية",
-        },
-        "المدة الفاصلة بين التبرعات؟": {
-            "answer": "التبرع الكامل: 90 يومًا على الأقل بين كل تبرعين. مكوّنات الدم قد تختلف.",
-            "source": "القاعدة المعرفية",
-        },
-        "هل التبرع بالدم مؤلم؟": {
-            "answer": "وخزة الإبرة سريعة وخفيفة عادةً، والسحب نفسه يستغرق دقائق، مع راحة بسيطة بعد التبرع.",
-            "source": "القاعدة المعرفية",
-        },
-    }
 
+def kb_answer_forms(answer: str, lang: str):
+    """
+    نص إجابة KB باللغة المطلوبة: (الملخّص، الكامل).
+    يستخدم النسخ المبنية مسبقاً أولاً (بدون شبكة)، ثم الترجمة الحية كخطة بديلة.
+    ترجع (None, None) إن تعذّر توفير النسخة الإنجليزية (فيُرد بالعربية كما هي، لا نص
+    عربي على أنه إنجليزي).
+    """
+    variants = (KB_I18N.get(kb_answer_key(answer)) or {}).get(lang) or {}
+    full = variants.get("full")
+    if not full:
+        if lang == "en":
+            if not llm:
+                return None, None
+            # openai_translate ترجع النص نفسه في وضع KB فقط أو عند الفشل
+            full = openai_translate(answer, "en")
+            if not full or full == answer:
+                return None, None
+        else:
+            full = answer
+    summary = variants.get("summary") or summarize_and_simplify(full, KB_SUMMARY_LEN, lang)
+    return summary, full
 
-KNOWLEDGE_BASE = load_knowledge_base()
 
+# ==============================
+# 6) Chat Endpoint
+# ==============================
 
-def search_knowledge_base(corrected_query: str):
-    """
-    البحث بالتقريب في القاعدة المعرفية باستخدام fuzzywuzzy.
-    ترجع: (answer, source, similarity_score من 0 إلى 100)
-    """
-    if not corrected_query:
-        return None, None, 0
 
-    nq = normalize_arabic(corrected_query)
-    keys = list(KNOWLEDGE_BASE.keys())
-    norm = {k: normalize_arabic(k) for k in keys}
-    vals = list(norm.values())
+WA_BTN_STYLE = (
+    'style="display:inline-block;margin-top:8px;padding:8px 14px;'
+    'border-radius:999px;background:#25D366;color:#fff;'
+    'text-decoration:none;font-weight:700;"'
+)
 
-    if not vals:
-        return None, None, 0
 
-    best_partial = process.extractOne(nq, vals, scorer=fuzz.partial_ratio)
-    best_token = process.extractOne(nq, vals, scorer=fuzz.token_sort_ratio)
+def _render_fallback(lang: str, ai_error: bool) -> Tuple[str, str, str]:
+    wa_label = "Contact via WhatsApp" if lang == "en" else "التواصل عبر واتساب"
+    wa_btn = (
+        f'<a href="{WHATSAPP_URL}" '
+        'target="_blank" rel="noopener" '
+        f"{WA_BTN_STYLE}>"
+        f"{wa_label}"
+        "</a>"
+    )
 
-    candidate = None
-    if best_partial and best_token:
-        candidate = best_partial if best_partial[1] >= best_token[1] else best_token
+    if lang == "en":
+        base = "I couldn’t clearly understand your question."
+        if ai_error:
+            base += "\nThere was also an issue connecting to the AI service."
+        base += "\nYou can contact the Zomrah team via WhatsApp:\n\n"
+        base += wa_btn + "\n\n" + FOOTER_EN
+        return base, "Fallback", "Zomrah team"
     else:
-        candidate = best_partial or best_token
+        base = "لم أستطع فهم سؤالك بشكل كافٍ."
+        if ai_error:
+            base += "\nكما حدثت مشكلة في الاتصال بخدمة الذكاء الاصطناعي."
+        base += "\nيمكنك التواصل مع فريق زمرة عبر واتساب:\n\n"
+        base += wa_btn + "\n\n" + FOOTER_AR
+        return base, "Fallback", "فريق زمرة"
+
+
+# الردود الثابتة تُبنى مرة واحدة عند التحميل بدل كل طلب
+_FALLBACK_REPLIES = {
+    (lang, ai_error): _render_fallback(lang, ai_error)
+    for lang in ("ar", "en")
+    for ai_error in (False, True)
+}
 
-    if not candidate:
-        return None, None, 0
 
-    best_norm_text, score = candidate
-    orig = next((k for k, v in norm.items() if v == best_norm_text), None)
-    if not orig:
-        return None, None, 0
+def _response_dict_samples():
+    """نصوص الردود الثابتة (بصيغتها المحفوظة في logs) لتدريب أول قاموس ضغط."""
+    out = [FOOTER_AR, FOOTER_EN]
+    out += [_log_snippet(r[0]) for r in _FALLBACK_REPLIES.values()]
+    out += [_log_snippet(r[0]) for r in _SUPPORT_REPLIES.values()]
+    out += [_log_snippet(r[0]) for r in _ELIGIBILITY_REPLIES.values()]
+    for i in range(min(len(KB), 200)):
+        out.append(_log_snippet(f"المصدر: القاعدة المعرفية\n\n{KB.answer(i)}\n\n{FOOTER_AR}"))
+    return out
+
+
+def fallback_message(lang: str, ai_error: bool = False) -> Tuple[str, str, str]:
+    """
+    ترجع: (final_text, source_type, source_text)
+    """
+    return _FALLBACK_REPLIES[("en" if lang == "en" else "ar", bool(ai_error))]
 
-    d = KNOWLEDGE_BASE[orig]
-    return d["answer"], d.get("source"), int(score)
 
 # ==============================
-# 6) Chat Endpoint
+# Intent handlers (بيانات محلية، بدون KB/AI)
 # ==============================
+# كل معالج: handler(user_message, lang) → (final_text, source_type, source_text) أو None
+# (None = لا توجد بيانات مناسبة، فيكمل الطلب إلى KB/AI).
+
+_SUPPORT_REPLIES = {
+    "ar": (
+        "للتواصل مع خدمة عملاء زمرة عبر واتساب، اضغط على الرابط التالي:\n\n"
+        f'<a href="{WHATSAPP_URL}" target="_blank" rel="noopener">'
+        "فتح واتساب</a>\n\n"
+        f"{FOOTER_AR}",
+        "Support",
+        "Customer Service",
+    ),
+    "en": (
+        "To contact Zomrah customer support via WhatsApp, click the link below:\n\n"
+        f'<a href="{WHATSAPP_URL}" target="_blank" rel="noopener">'
+        "Open WhatsApp</a>\n\n"
+        f"{FOOTER_EN}",
+        "Support",
+        "Customer Service",
+    ),
+}
 
+_ELIGIBILITY_REPLIES = {
+    "ar": (
+        "المصدر: اختبار الأهلية في زمرة\n\n"
+        "الشروط الأساسية للتبرع:\n"
+        "• العمر 18 سنة فأكثر، والوزن 50 كجم فأكثر.\n"
+        "• مرور 90 يوماً على الأقل منذ آخر تبرع.\n"
+        "• عدم تناول أدوية السيولة، ومرور 7 أيام بعد المضاد الحيوي أو قلع الأسنان.\n"
+        "• لا زكام أو حمى حالياً، ولا حمل، ولا وشم/ثقب خلال آخر 6 أشهر.\n\n"
+        "للتقييم الدقيق أجب عن أسئلة «اختبار الأهلية» في الصفحة.\n\n"
+        f"{FOOTER_AR}",
+        "Eligibility",
+        "اختبار الأهلية",
+    ),
+    "en": (
+        "Source: Zomrah eligibility check\n\n"
+        "Basic donation requirements:\n"
+        "• Age 18+ and weight 50 kg+.\n"
+        "• At least 90 days since your last donation.\n"
+        "• No blood thinners; wait 7 days after antibiotics or a dental extraction.\n"
+        "• No current cold or fever, not pregnant, no tattoo/piercing in the last 6 months.\n\n"
+        "For a precise answer, take the “eligibility check” on the page.\n\n"
+        f"{FOOTER_EN}",
+        "Eligibility",
+        "Eligibility check",
+    ),
+}
 
-@app.route("/api/chat", methods=["POST"])
-def chat():
-    data = request.json or {}
-    raw = data.get("message") or ""
-    user_message = raw.strip()
-    want_detail = bool(data.get("detail"))
+# ردود مبنية من ملفات البيانات: تُعاد بناؤها فقط عند تغيّر الملف (mtime) أو اللقطة (etag)
+_INTENT_RENDER_CACHE = {}
+_INTENT_RENDER_CACHE_MAX = 256
 
-    ui_lang = (data.get("lang") or "").lower()
-    if ui_lang not in ("ar", "en"):
-        ui_lang = "ar"  # افتراضي عربي
-    target_lang = ui_lang  # نستخدم لغة الواجهة كمرجع أساسي
 
-    if not user_message:
-        msg = "الرجاء كتابة سؤالك." if target_lang == "ar" else "Please type your question."
-        return jsonify(
-            {
-                "answer": msg,
-                "source_type": "Error",
-                "source_text": None,
-                "not_understood": True,
-                "corrected_message": user_message,
-            }
-        ), 200
+def _cached_reply(key, render):
+    out = _INTENT_RENDER_CACHE.get(key)
+    if out is None:
+        out = render()
+        if len(_INTENT_RENDER_CACHE) >= _INTENT_RENDER_CACHE_MAX:
+            _INTENT_RENDER_CACHE.clear()
+        _INTENT_RENDER_CACHE[key] = out
+    return out
 
-    # --------------------------
-    # أولوية: Intent خدمة العملاء
-    # --------------------------
-    if is_customer_service_intent(user_message):
-        if target_lang == "ar":
-            txt = (
-                "للتواصل مع خدمة عملاء زمرة عبر واتساب، اضغط على الرابط التالي:\n\n"
-                f'<a href="{WHATSAPP_URL}" target="_blank" rel="noopener">'
-                "فتح واتساب</a>\n\n"
-                f"{FOOTER_AR}"
-            )
-        else:
-            txt = (
-                "To contact Zomrah customer support via WhatsApp, click the link below:\n\n"
-                f'<a href="{WHATSAPP_URL}" target="_blank" rel="noopener">'
-                "Open WhatsApp</a>\n\n"
-                f"{FOOTER_EN}"
-            )
 
-        save_log(user_message, user_message, "Support", "Customer Service", txt)
-        return jsonify(
-            {
-                "answer": txt,
-                "source_type": "Support",
-                "source_text": "Customer Service",
-                "corrected_message": user_message,
-                "not_understood": False,
-            }
-        ), 200
+def _mtime(path: str) -> float:
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return 0.0
+
+
+def _wrap_local(lang: str, source_ar: str, source_en: str, body: str):
+    if lang == "en":
+        return f"Source: {source_en}\n\n{body}\n\n{FOOTER_EN}"
+    return f"المصدر: {source_ar}\n\n{body}\n\n{FOOTER_AR}"
+
+
+def _link(url: str, label: str) -> str:
+    return f'<a href="{url}" target="_blank" rel="noopener">{label}</a>'
+
+
+def _intent_support(user_message: str, lang: str):
+    return _SUPPORT_REPLIES[lang]
+
+
+def _intent_eligibility(user_message: str, lang: str):
+    return _ELIGIBILITY_REPLIES[lang]
+
+
+def _render_centers(lang: str):
+    centers = _load_json(CENTERS_JSON_PATH) or []
+    if not centers:
+        return None
+    map_label = "Map" if lang == "en" else "الخريطة"
+    lines = []
+    for c in centers:
+        if not c.get("name"):
+            continue
+        url = (
+            f"https://www.google.com/maps/search/?api=1&query={c['lat']},{c['lng']}"
+            if c.get("lat") is not None and c.get("lng") is not None
+            else gmaps_place_link(c["name"])
+        )
+        parts = [c["name"]]
+        if c.get("hours"):
+            parts.append(c["hours"])
+        if c.get("phone"):
+            parts.append("☎ " + c["phone"])
+        lines.append("• " + " — ".join(parts) + " " + _link(url, map_label))
+    title = (
+        "Blood donation centers in Jeddah:" if lang == "en" else "مراكز التبرع بالدم في جدة:"
+    )
+    body = title + "\n" + "\n".join(lines)
+    text = _wrap_local(lang, "مراكز التبرع المعتمدة", "Approved donation centers", body)
+    src = "Donation centers" if lang == "en" else "مراكز التبرع"
+    return text, "Centers", src
 
-    # كشف لغة النص (سريع) - يُستخدم فقط لمعرفة إن كان السؤال بالعربي للبحث في KB
-    detected_lang = "ar"
+
+def _intent_centers(user_message: str, lang: str):
+    key = ("centers", lang, _mtime(CENTERS_JSON_PATH))
+    return _cached_reply(key, lambda: _render_centers(lang))
+
+
+def _render_campaigns(lang: str):
+    data = _load_json(CAMPAIGNS_JSON_PATH) or {}
+    items = [
+        c for c in (data.get("campaigns") or [])
+        if c.get("status") in ("upcoming", "ongoing")
+    ]
+    if not items:
+        return None
+    register = "Register" if lang == "en" else "التسجيل"
+    lines = []
+    for c in items:
+        line = f"• {c.get('title', '')} — {c.get('date', '')} {c.get('time', '')}".rstrip()
+        if c.get("location"):
+            line += f" — {c['location']}"
+        if c.get("register_url"):
+            line += " " + _link(c["register_url"], register)
+        lines.append(line)
+    title = "Current and upcoming campaigns:" if lang == "en" else "الحملات الحالية والقادمة:"
+    body = title + "\n" + "\n".join(lines)
+    text = _wrap_local(lang, "حملات زمرة", "Zomrah campaigns", body)
+    src = "Campaigns" if lang == "en" else "الحملات"
+    return text, "Campaigns", src
+
+
+def _intent_campaigns(user_message: str, lang: str):
+    key = ("campaigns", lang, _mtime(CAMPAIGNS_JSON_PATH))
+    return _cached_reply(key, lambda: _render_campaigns(lang))
+
+
+def _render_urgent(index, lang: str, blood_type: str):
+    hits = index.query(blood_type=blood_type, limit=5)
+    if not hits:
+        if not blood_type:
+            return None
+        body = (
+            f"No urgent need is currently listed for blood type {blood_type}."
+            if lang == "en"
+            else f"لا يوجد احتياج عاجل مسجّل حالياً لفصيلة {blood_type}."
+        )
+    else:
+        needs = [n for n, _ in hits]
+        map_label = "Map" if lang == "en" else "الخريطة"
+        lines = []
+        for n in needs:
+            line = f"• {n.get('hospital', '')} — {n.get('status', '')} — {n.get('details', '')}"
+            if n.get("location_url"):
+                line += " " + _link(n["location_url"], map_label)
+            lines.append(line)
+        title = (
+            "Current urgent blood needs (please call before visiting):"
+            if lang == "en"
+            else "الاحتياج العاجل حالياً (يرجى الاتصال قبل الزيارة):"
+        )
+        body = title + "\n" + "\n".join(lines)
+    text = _wrap_local(lang, "الاحتياج العاجل للمستشفيات", "Hospital urgent needs", body)
+    src = "Urgent needs" if lang == "en" else "الاحتياج العاجل"
+    return text, "UrgentNeeds", src
+
+
+def _intent_urgent_needs(user_message: str, lang: str):
+    index, etag = URGENT_FEED.index()
+    if index is None:
+        return None
+    types = parse_blood_types(user_message)
+    blood_type = types[0] if types else None
+    # الأسماء تبقى بالعربية في الرد الإنجليزي (بدون استدعاء ترجمة)
+    key = ("urgent", lang, etag, blood_type)
+    return _cached_reply(key, lambda: _render_urgent(index, lang, blood_type))
+
+
+INTENT_HANDLERS = {
+    "support": _intent_support,
+    "urgent_needs": _intent_urgent_needs,
+    "centers": _intent_centers,
+    "campaigns": _intent_campaigns,
+    "eligibility": _intent_eligibility,
+}
+
+
+def answer_intent(user_message: str, lang: str):
+    """ترجع (final_text, source_type, source_text) من البيانات المحلية، أو None."""
+    intent = INTENT_ROUTER.match(user_message)
+    if not intent:
+        return None
     try:
-        detected_lang = detect(user_message)
-    except LangDetectException:
-        pass
+        return INTENT_HANDLERS[intent](user_message, "en" if lang == "en" else "ar")
+    except Exception as e:
+        print(f"⚠️ intent {intent}:", e)
+        return None
+
+
+def _chat_payload(final_text, source_type, source_text, user_message, not_understood,
+                  answer_id=None):
+    payload = {
+        "answer": final_text,
+        "source_type": source_type,
+        "source_text": source_text,
+        "corrected_message": user_message,
+        "not_understood": not_understood,
+    }
+    if answer_id:
+        payload["answer_id"] = answer_id
+    return payload
+
+
+def _detail_id(final_text, full_text, source_type, source_text):
+    """answer_id للنص الكامل إن كان المعروض ملخّصاً منه (وإلا None: لا تفاصيل إضافية)."""
+    if full_text == final_text:
+        return None
+    return DETAIL_CACHE.put(full_text, source_type, source_text)
+
+
+def autocorrect_message(text: str) -> str:
+    """تصحيح الرسالة داخل /api/chat (نفس spell_correct_ar_en)؛ يرجع النص كما هو عند التعذّر."""
+    if not llm or not text or ai_degraded():
+        return text
+    charge_ai()
+    with span("autocorrect") as sp:
+        out = (spell_correct_ar_en(text) or "").strip()
+        # رد أطول بكثير من الرسالة ليس تصحيحاً (غالباً إجابة عن السؤال): يُتجاهل
+        if len(out) > 2 * len(text) + 20:
+            out = ""
+        sp.set(changed=bool(out) and out != text)
+    return out or text
+
+
+def answer_message(user_message: str, target_lang: str, want_detail: bool = False,
+                   kb_hits: dict = None, autocorrect: bool = False):
+    """
+    مسار الإجابة الكامل (KB → Intent → AI/Fallback) لرسالة واحدة.
+    ترجع: (payload, log_row) حيث log_row معاملات save_log أو None إن لم يلزم الحفظ.
+    kb_hits (اختياري): نتائج search_knowledge_base_many المحسوبة مسبقاً للدفعة.
+    autocorrect: تصحيح الرسالة فقط إن لم تُطابق نيةً أو KB كما كُتبت، ثم المسار نفسه
+    على النص المصحّح (payload["corrected_message"]).
+    يُستخدم من /api/chat و/api/chat/batch ومن مهام الرسائل الصوتية.
+    """
+    if not user_message:
+        msg = "الرجاء كتابة سؤالك." if target_lang == "ar" else "Please type your question."
+        return _chat_payload(msg, "Error", None, user_message, True), None
 
     # --------------------------
-    # 1) نحاول من قاعدة المعرفة
+    # 1) نحاول من قاعدة المعرفة (فهرس الأسئلة العربي أو الإنجليزي حسب حروف الرسالة)
     # --------------------------
-    SIM_THRESHOLD = 85
-    kb_answer = None
-    kb_source = None
-    kb_score = 0
-
-    # قاعدة المعرفة عربية بالأساس، فنبحث فقط لو النص عربي
-    if detected_lang == "ar":
-        kb_answer, kb_source, kb_score = search_knowledge_base(user_message)
+    if kb_hits is not None and user_message in kb_hits:
+        kb_answer, kb_source, kb_score = kb_hits[user_message]
+    else:
+        with span("kb_search") as sp:
+            kb_answer, kb_source, kb_score = search_kb(user_message)
+            sp.set(script=text_script(user_message), score=kb_score)
 
-    if kb_answer and kb_score >= SIM_THRESHOLD:
+    if kb_answer and kb_score >= KB_SIM_THRESHOLD:
         source_type = "KB"
         source_text = "القاعدة المعرفية" if target_lang == "ar" else "Knowledge base"
-        not_understood = False
 
-        if target_lang == "en" and client:
-            # نترجم الجواب الأساسي إلى الإنجليزية أولاً
-            translated = openai_translate(kb_answer, "en")
-            core_text = translated if want_detail else summarize_and_simplify(
-                translated, 220, "en"
-            )
-            final_text = (
-                "Source: Knowledge base\n\n"
-                f"{core_text}\n\n"
-                f"{FOOTER_EN}"
-            )
+        forms = kb_answer_forms(kb_answer, "en") if target_lang == "en" else (None, None)
+        if forms[0]:
+            wrap = lambda core: f"Source: Knowledge base\n\n{core}\n\n{FOOTER_EN}"
         else:
-            core_ar = kb_answer if want_detail else summarize_and_simplify(
-                kb_answer, 220, "ar"
-            )
-            final_text = (
-                "المصدر: القاعدة المعرفية\n\n"
-                f"{core_ar}\n\n"
-                f"{FOOTER_AR}"
-            )
+            forms = kb_answer_forms(kb_answer, "ar")
+            wrap = lambda core: f"المصدر: القاعدة المعرفية\n\n{core}\n\n{FOOTER_AR}"
+        core_summary, core_full = forms
+        final_text = wrap(core_full if want_detail else core_summary)
+        answer_id = None
+        if not want_detail:
+            answer_id = _detail_id(final_text, wrap(core_full), source_type, source_text)
 
-        save_log(user_message, user_message, source_type, source_text, final_text)
-        return jsonify(
-            {
-                "answer": final_text,
-                "source_type": source_type,
-                "source_text": source_text,
-                "corrected_message": user_message,
-                "not_understood": not_understood,
-            }
-        ), 200
+        return (
+            _chat_payload(final_text, source_type, source_text, user_message, False, answer_id),
+            (user_message, user_message, source_type, source_text, final_text),
+        )
 
     # --------------------------
-    # 2) لم نجد إجابة في القاعدة → AI أو فولباك
+    # النوايا المحلية (خدمة العملاء، الاحتياج العاجل، المراكز، الحملات، الأهلية): فقط إن
+    # لم تُجب القاعدة، فالسؤال المحدد الذي يذكر "الحملات" أو "التواصل" يأخذ إجابته من KB
     # --------------------------
-    not_understood = True
-
-    def fallback_message(lang: str, ai_error: bool = False) -> Tuple[str, str, str]:
-        """
-        ترجع: (final_text, source_type, source_text)
-        """
-        wa_url = WHATSAPP_URL
-        wa_btn_ar = (
-            f'<a href="{wa_url}" '
-            'target="_blank" rel="noopener" '
-            'style="display:inline-block;margin-top:8px;padding:8px 14px;'
-            'border-radius:999px;background:#25D366;color:#fff;'
-            'text-decoration:none;font-weight:700;">'
-            'التواصل عبر واتساب'
-            '</a>'
-        )
-        wa_btn_en = (
-            f'<a href="{wa_url}" '
-            'target="_blank" rel="noopener" '
-            'style="display:inline-block;margin-top:8px;padding:8px 14px;'
-            'border-radius:999px;background:#25D366;color:#fff;'
-            'text-decoration:none;font-weight:700;">'
-            'Contact via WhatsApp'
-            '</a>'
+    with span("intent") as sp:
+        local = answer_intent(user_message, target_lang)
+        sp.set(hit=bool(local))
+    if local:
+        final_text, source_type, source_text = local
+        return (
+            _chat_payload(final_text, source_type, source_text, user_message, False),
+            (user_message, user_message, source_type, source_text, final_text),
         )
 
-        if lang == "en":
-            base = "I couldn’t clearly understand your question."
-            if ai_error:
-                base += "\nThere was also an issue connecting to the AI service."
-            base += "\nYou can contact the Zomrah team via WhatsApp:\n\n"
-            base += wa_btn_en + "\n\n" + FOOTER_EN
-            return base, "Fallback", "Zomrah team"
-        else:
-            base = "لم أستطع فهم سؤالك بشكل كافٍ."
-            if ai_error:
-                base += "\nكما حدثت مشكلة في الاتصال بخدمة الذكاء الاصطناعي."
-            base += "\nيمكنك التواصل مع فريق زمرة عبر واتساب:\n\n"
-            base += wa_btn_ar + "\n\n" + FOOTER_AR
-            return base, "Fallback", "فريق زمرة"
+    # --------------------------
+    # التصحيح المدمج: البحث على النص الخام يكلّف ميلي ثوانٍ، فلا يُستدعى التصحيح
+    # (استدعاء LLM) إلا بعد إخفاقه
+    # --------------------------
+    if autocorrect:
+        corrected = autocorrect_message(user_message)
+        if corrected != user_message:
+            payload, log_row = answer_message(corrected, target_lang, want_detail)
+            if log_row:
+                log_row = (user_message,) + log_row[1:]
+            return payload, log_row
+
+    # --------------------------
+    # 2) لم نجد إجابة في القاعدة → AI أو فولباك
+    # --------------------------
+    not_understood = True
 
     # لو ما في OpenAI أو مفعّل FORCE_AI_FALLBACK ⇒ فولباك دقيق
-    if (not client) or FORCE_AI_FALLBACK:
+    if (not llm) or FORCE_AI_FALLBACK:
         final_text, source_type, source_text = fallback_message(target_lang, ai_error=False)
-        save_log(user_message, user_message, source_type, source_text, final_text)
-        return jsonify(
-            {
-                "answer": final_text,
-                "source_type": source_type,
-                "source_text": source_text,
-                "corrected_message": user_message,
-                "not_understood": not_understood,
-            }
-        ), 200
+        return (
+            _chat_payload(final_text, source_type, source_text, user_message, not_understood),
+            (user_message, user_message, source_type, source_text, final_text),
+        )
+
+    # --------------------------
+    # وضع KB فقط تحت الضغط: إجابة OpenAI مخزّنة لنفس السؤال، وإلا فولباك
+    # --------------------------
+    cache_key = (normalize_arabic(user_message), target_lang, want_detail)
+    if not ADMISSION.allow_ai():
+        cached = AI_ANSWER_CACHE.get(cache_key)
+        with span("degraded", cached=bool(cached)):
+            if cached:
+                final_text, source_type, source_text = cached, "AI", "OpenAI (cache)"
+            else:
+                final_text, source_type, source_text = fallback_message(target_lang, ai_error=False)
+        return (
+            _chat_payload(final_text, source_type, source_text, user_message, not_understood),
+            (user_message, user_message, source_type, source_text, final_text),
+        )
 
     # --------------------------
     # 3) استخدام OpenAI مع الرسالة الجديدة
     # --------------------------
+    charge_ai()
+    answer_id = None
     try:
         prompt_lang = "العربية" if target_lang == "ar" else "الإنجليزية"
         system_instruction = (
@@ -635,16 +1197,14 @@ def chat():
             f"- إن لم تكن متأكداً، اعتذر بلطف واطلب مراجعة الطبيب أو التواصل مع فريق زمرة.\n"
         )
 
-        res = client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=[
+        ai_text = llm_complete(
+            [
                 {"role": "system", "content": system_instruction},
                 {"role": "user", "content": user_message},
             ],
             max_tokens=220,
             temperature=0.3,
         )
-        ai_text = (res.choices[0].message.content or "").strip()
 
         if not ai_text or len(ai_text) < 15:
             final_text, source_type, source_text = fallback_message(target_lang, ai_error=False)
@@ -653,40 +1213,146 @@ def chat():
             source_text = "OpenAI"
 
             if target_lang == "en":
-                core_txt = ai_text if want_detail else summarize_and_simplify(
-                    ai_text, 230, "en"
-                )
-                final_text = (
+                wrap = lambda core: (
                     "We couldn’t find an answer in the knowledge base; "
                     "we used OpenAI to draft the following reply:\n\n"
-                    f"{core_txt}\n\n"
+                    f"{core}\n\n"
                     f"{FOOTER_EN}"
                 )
             else:
-                core_txt = ai_text if want_detail else summarize_and_simplify(
-                    ai_text, 230, "ar"
-                )
-                final_text = (
+                wrap = lambda core: (
                     "لم نعثر على إجابة في قاعدة المعرفة؛ استعنا بـ OpenAI لصياغة الرد التالي:\n\n"
-                    f"{core_txt}\n\n"
+                    f"{core}\n\n"
                     f"{FOOTER_AR}"
                 )
+            if want_detail:
+                final_text = wrap(ai_text)
+            else:
+                final_text = wrap(summarize_and_simplify(ai_text, 230, target_lang))
+                # التفاصيل من نفس الإجابة لاحقاً، لا من استدعاء OpenAI جديد
+                answer_id = _detail_id(final_text, wrap(ai_text), source_type, source_text)
+            AI_ANSWER_CACHE.put(cache_key, final_text)
 
     except Exception as e:
         print("⚠️ خطأ في استدعاء OpenAI:", e)
         final_text, source_type, source_text = fallback_message(target_lang, ai_error=True)
 
-    save_log(user_message, user_message, source_type, source_text, final_text)
+    return (
+        _chat_payload(final_text, source_type, source_text, user_message, not_understood, answer_id),
+        (user_message, user_message, source_type, source_text, final_text),
+    )
 
-    return jsonify(
-        {
-            "answer": final_text,
-            "source_type": source_type,
-            "source_text": source_text,
-            "corrected_message": user_message,
-            "not_understood": not_understood,
-        }
-    ), 200
+
+@app.route("/api/chat", methods=["POST"])
+def chat():
+    data = request.json or {}
+    raw = data.get("message") or ""
+    user_message = raw.strip()
+    want_detail = bool(data.get("detail"))
+    # autocorrect: التصحيح داخل نفس الطلب بدل /api/autocorrect ثم /api/chat
+    want_correct = bool(data.get("autocorrect"))
+
+    ui_lang = (data.get("lang") or "").lower()
+    if ui_lang not in ("ar", "en"):
+        ui_lang = "ar"  # افتراضي عربي
+    target_lang = ui_lang  # نستخدم لغة الواجهة كمرجع أساسي
+
+    # "تفاصيل أكثر" لإجابة سابقة: النص الكامل المحفوظ لها، بلا بحث ولا OpenAI
+    full = DETAIL_CACHE.get(data.get("answer_id")) if want_detail else None
+    if full:
+        with span("detail_cache", hit=True):
+            payload = _chat_payload(
+                full["answer"], full["source_type"], full["source_text"], user_message,
+                full["source_type"] != "KB",
+            )
+        save_log(user_message, user_message, full["source_type"], full["source_text"], full["answer"])
+        return jsonify(payload), 200
+
+    payload, log_row = answer_message(
+        user_message, target_lang, want_detail, autocorrect=want_correct
+    )
+    if log_row:
+        save_log(*log_row)
+    return jsonify(payload), 200
+
+
+_BATCH_POOL = {"pid": None, "pool": None}
+
+
+def batch_pool() -> ThreadPoolExecutor:
+    """مجمّع خيوط محدود لكل عملية (لا يُورَّث عبر fork) لاستدعاءات الدفعات."""
+    if _BATCH_POOL["pid"] != os.getpid():
+        _BATCH_POOL["pool"] = ThreadPoolExecutor(
+            max_workers=CHAT_BATCH_WORKERS, thread_name_prefix="chat-batch"
+        )
+        _BATCH_POOL["pid"] = os.getpid()
+    return _BATCH_POOL["pool"]
+
+
+def _answer_batch_item(message, lang, detail, kb_hits):
+    try:
+        return answer_message(message, lang, detail, kb_hits=kb_hits)
+    except RateLimited as e:
+        retry = max(1, math.ceil(e.retry_after))
+        return {"ok": False, "error": "rate_limited", "retry_after": retry}, None
+
+
+@app.route("/api/chat/batch", methods=["POST"])
+def chat_batch():
+    """
+    دفعة أسئلة من الشركاء (أكشاك المستشفيات / بوابات SMS):
+        {"lang": "ar", "messages": ["...", {"message": "...", "lang": "en", "detail": true}]}
+    - الأسئلة المتطابقة بعد التطبيع تُجاب مرة واحدة.
+    - بحث KB لكل سؤال فريد (حلقة على نفس الأسئلة المطبّعة)، ثم ما يحتاج OpenAI عبر مجمّع خيوط محدود.
+    - كل السجلات تُحفظ في معاملة واحدة، والنتائج بنفس ترتيب الإدخال.
+    """
+    data = request.get_json(silent=True) or {}
+    messages = data.get("messages")
+    if not isinstance(messages, list) or not messages:
+        return jsonify({"ok": False, "error": "messages يجب أن تكون قائمة غير فارغة"}), 400
+    if len(messages) > CHAT_BATCH_MAX:
+        return jsonify({"ok": False, "error": f"الحد الأقصى {CHAT_BATCH_MAX} رسالة"}), 413
+
+    default_lang = (data.get("lang") or "ar").lower()
+    default_detail = bool(data.get("detail"))
+    items = []
+    for m in messages:
+        if isinstance(m, dict):
+            text = str(m.get("message") or "").strip()
+            lang = (m.get("lang") or default_lang).lower()
+            detail = bool(m.get("detail", default_detail))
+        else:
+            text, lang, detail = str(m or "").strip(), default_lang, default_detail
+        items.append((text, lang if lang in ("ar", "en") else "ar", detail))
+
+    # إزالة التكرار: مفتاح = النص المطبّع + اللغة + التفصيل
+    uniq = {}
+    for text, lang, detail in items:
+        uniq.setdefault((normalize_arabic(text), lang, detail), (text, lang, detail))
+
+    check_rate(_CLIENT.get(), "cheap", cost=len(uniq))
+
+    with span("kb_search", batch=len(uniq)):
+        kb_hits = search_knowledge_base_many(t for t, _, _ in uniq.values())
+
+    futures = {}
+    for key, (text, lang, detail) in uniq.items():
+        ctx = contextvars.copy_context()  # ينقل هوية العميل (الحصص) إلى خيط المجمّع
+        futures[key] = batch_pool().submit(
+            ctx.run, _answer_batch_item, text, lang, detail, kb_hits
+        )
+    answers = {key: f.result() for key, f in futures.items()}
+
+    results, log_rows = [], []
+    for text, lang, detail in items:
+        payload, log_row = answers[(normalize_arabic(text), lang, detail)]
+        results.append(payload)
+        if log_row:
+            # كل رسالة واردة تُسجَّل (حتى المكررة) لتبقى الإحصاءات صحيحة
+            log_rows.append((text, text) + tuple(log_row[2:]))
+    save_logs(log_rows)
+
+    return jsonify({"ok": True, "count": len(results), "unique": len(uniq), "results": results}), 200
 
 # ==============================
 # API: Auto Correct (Arabic + English) - NEW
@@ -696,14 +1362,18 @@ def chat():
 def autocorrect():
     """
     يستقبل نص المستخدم ويعيد نسخة مصحّحة.
-    يُستخدم من الواجهة قبل عرض الرسالة في مربع المحادثة.
+    الواجهة لم تعد تستدعيه قبل كل رسالة: /api/chat مع autocorrect=true يصحّح عند الحاجة
+    فقط ويرجع corrected_message في نفس الرد. يبقى للعملاء الآخرين.
     """
     data = request.json or {}
     text = (data.get("text") or "").strip()
 
     if not text:
         return jsonify({"corrected": ""})
+    if not llm or ai_degraded():
+        return jsonify({"corrected": text})
 
+    charge_ai()
     corrected = spell_correct_ar_en(text)
     return jsonify({"corrected": corrected})
 
@@ -718,7 +1388,7 @@ def gmaps_place_link(name: str) -> str:
 
 def _fetch_csv(url: str):
     try:
-        r = requests.get(url, timeout=6)
+        r = http_session().get(url, timeout=6)
         r.raise_for_status()
         rows = list(csv.DictReader(StringIO(r.text)))
         return rows
@@ -761,6 +1431,8 @@ def _format_urgent_rows(rows, lang: str = "ar"):
         )
         if hospital and not loc:
             loc = gmaps_place_link(hospital)
+        lat = r.get("lat") or r.get("Lat") or r.get("latitude") or ""
+        lng = r.get("lng") or r.get("Lng") or r.get("longitude") or ""
 
         if hospital:
             if lang == "en":
@@ -770,14 +1442,15 @@ def _format_urgent_rows(rows, lang: str = "ar"):
             else:
                 hospital_t, status_t, details_t = hospital, status, details
 
-            out.append(
-                {
-                    "hospital": hospital_t,
-                    "status": status_t,
-                    "details": details_t,
-                    "location_url": loc,
-                }
-            )
+            row = {
+                "hospital": hospital_t,
+                "status": status_t,
+                "details": details_t,
+                "location_url": loc,
+            }
+            if lat and lng:
+                row["lat"], row["lng"] = lat, lng
+            out.append(row)
     return out
 
 
@@ -803,29 +1476,145 @@ FALLBACK_URGENT = [
 ]
 
 
-@app.route("/api/urgent_needs")
-def urgent_needs():
-    """جلب قائمة الاحتياج العاجل من Google Sheet أو JSON أو fallback."""
-    lang = (request.args.get("lang") or "ar").lower()
-    if lang not in ("ar", "en"):
-        lang = "ar"
+_CENTER_LOCATOR = None
+
 
+def center_locator() -> CenterLocator:
+    global _CENTER_LOCATOR
+    if _CENTER_LOCATOR is None:
+        _CENTER_LOCATOR = CenterLocator(
+            _load_json(CENTERS_JSON_PATH) or [],
+            normalize_arabic,
+            score_fn=lambda a, b: fuzz.token_set_ratio(a, b, force_ascii=False),
+        )
+    return _CENTER_LOCATOR
+
+
+def fetch_urgent_rows():
+    """
+    المصدر الخام (بالعربية، بصيغة موحدة): Google Sheet ثم JSON ثم fallback.
+    كل صف يُحلَّل مرة واحدة هنا إلى حقول منظّمة (الفصيلة، المكوّن، الإلحاح، الإحداثيات).
+    """
     needs = None
 
     if URGENT_SHEET_URL:
         rows = _fetch_csv(URGENT_SHEET_URL)
         if rows:
-            needs = _format_urgent_rows(rows, lang=lang)
+            needs = _format_urgent_rows(rows, lang="ar")
 
     if not needs:
         js = _load_json(URGENT_JSON_PATH)
         if isinstance(js, dict) and isinstance(js.get("needs"), list):
-            needs = _format_urgent_rows(js["needs"], lang=lang)
+            needs = _format_urgent_rows(js["needs"], lang="ar")
         elif isinstance(js, list):
-            needs = _format_urgent_rows(js, lang=lang)
+            needs = _format_urgent_rows(js, lang="ar")
 
     if not needs:
-        needs = _format_urgent_rows(FALLBACK_URGENT, lang=lang)
+        needs = _format_urgent_rows(FALLBACK_URGENT, lang="ar")
+    locator = center_locator()
+    return [parse_need(r, locator) for r in needs]
+
+
+URGENT_FEED = UrgentFeed(
+    fetch_urgent_rows,
+    refresh_s=URGENT_REFRESH_S,
+    max_clients=URGENT_SSE_MAX_CLIENTS,
+    build_index=UrgentIndex,
+)
+
+# ترجمة الحقول للإنجليزية مرة واحدة لكل نص (بدل كل طلب)
+_URGENT_TR_CACHE = {}
+_URGENT_TR_CACHE_MAX = 2048
+
+
+def _translate_cached(text: str, lang: str) -> str:
+    if not text or lang == "ar":
+        return text
+    key = (lang, text)
+    out = _URGENT_TR_CACHE.get(key)
+    if out is None:
+        out = translate_field_for_lang(text, lang)
+        if len(_URGENT_TR_CACHE) >= _URGENT_TR_CACHE_MAX:
+            _URGENT_TR_CACHE.clear()
+        _URGENT_TR_CACHE[key] = out
+    return out
+
+
+def localize_needs(rows, lang: str):
+    """id = اسم المستشفى الأصلي (مفتاح ثابت للفروقات مهما كانت لغة العرض)."""
+    if lang == "ar":
+        return [dict(r, id=r.get("hospital", "")) for r in rows]
+    return [
+        dict(
+            r,
+            id=r.get("hospital", ""),
+            hospital=_translate_cached(r.get("hospital", ""), lang),
+            status=_translate_cached(r.get("status", ""), lang),
+            details=_translate_cached(r.get("details", ""), lang),
+        )
+        for r in rows
+    ]
+
+
+def _urgent_lang() -> str:
+    lang = (request.args.get("lang") or "ar").lower()
+    return lang if lang in ("ar", "en") else "ar"
+
+
+def _parse_urgent_filters():
+    """?blood_type=O-&near=lat,lng&radius_km=25 → (blood_type, near, radius) أو ValueError."""
+    # "+" غير المُرمَّزة في الرابط تصل مسافة: ?blood_type=O+ → "O "
+    bt = (request.args.get("blood_type") or "").upper().replace(" ", "+").strip()
+    if bt and bt not in BLOOD_TYPES:
+        raise ValueError(f"blood_type غير معروف: {bt}")
+
+    near = None
+    raw = (request.args.get("near") or "").strip()
+    if raw:
+        try:
+            lat, lng = (float(x) for x in raw.split(","))
+        except ValueError:
+            raise ValueError("near يجب أن يكون بصيغة lat,lng")
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            raise ValueError("near خارج النطاق")
+        near = (lat, lng)
+
+    try:
+        radius = float(request.args.get("radius_km") or URGENT_NEAR_RADIUS_KM)
+    except ValueError:
+        raise ValueError("radius_km غير صالح")
+    radius = max(0.1, min(radius, URGENT_NEAR_MAX_RADIUS_KM))
+    return bt or None, near, radius
+
+
+@app.route("/api/urgent_needs")
+def urgent_needs():
+    """
+    جلب قائمة الاحتياج العاجل (لقطة مشتركة مع TTL، تدعم ETag/304).
+    فلاتر اختيارية من الفهرس: ?blood_type=O-  و ?near=lat,lng&radius_km=25
+    """
+    lang = _urgent_lang()
+    try:
+        blood_type, near, radius = _parse_urgent_filters()
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+
+    rows, etag, fetched_at = URGENT_FEED.snapshot()
+    etag = f'"{etag}-{lang}"'
+    if etag in (request.headers.get("If-None-Match") or ""):
+        return Response(status=304, headers={"ETag": etag})
+
+    if blood_type or near:
+        index, _ = URGENT_FEED.index()
+        if index is None:
+            index = UrgentIndex(rows)
+        hits = index.query(blood_type=blood_type, near=near, radius_km=radius)
+        needs = localize_needs([n for n, _ in hits], lang)
+        if near:
+            for n, (_, d) in zip(needs, hits):
+                n["distance_km"] = round(d, 2)
+    else:
+        needs = localize_needs(rows, lang)
 
     base_text_ar = "احتياجات عاجلة (يرجى الاتصال قبل الزيارة)."
     base_text_en = "Urgent needs (please call the hospital before visiting)."
@@ -833,15 +1622,65 @@ def urgent_needs():
     answer_ar = base_text_ar
     answer_en = base_text_en
 
-    return jsonify(
+    resp = jsonify(
         {
             "answer_ar": answer_ar,
             "answer_en": answer_en,
             "source": "Sheet/JSON/Fallback",
             "needs": needs,
-            "updated_at": datetime.utcnow().isoformat() + "Z",
+            "updated_at": datetime.utcfromtimestamp(fetched_at).isoformat() + "Z",
         }
-    ), 200
+    )
+    resp.headers["ETag"] = etag
+    return resp, 200
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.route("/api/urgent_needs/stream")
+def urgent_needs_stream():
+    """
+    Server-Sent Events: لقطة كاملة عند الاتصال (event: snapshot) ثم الفروقات فقط
+    (event: diff → added / removed / changed) كلما تغيّر المصدر، مع ping دوري.
+    """
+    lang = _urgent_lang()
+    q = URGENT_FEED.subscribe()
+    if q is None:
+        resp = jsonify({"ok": False, "error": "عدد المشتركين مكتمل؛ استخدم /api/urgent_needs"})
+        resp.status_code = 503
+        resp.headers["Retry-After"] = str(int(URGENT_REFRESH_S))
+        return resp
+
+    def gen():
+        try:
+            rows, etag, _ = URGENT_FEED.snapshot()
+            yield f"retry: {int(URGENT_REFRESH_S * 1000)}\n\n"
+            yield _sse("snapshot", {"needs": localize_needs(rows, lang), "etag": etag})
+            while True:
+                try:
+                    diff = q.get(timeout=URGENT_SSE_HEARTBEAT_S)
+                except queue.Empty:
+                    yield ": ping\n\n"
+                    continue
+                yield _sse(
+                    "diff",
+                    {
+                        "added": localize_needs(diff["added"], lang),
+                        "changed": localize_needs(diff["changed"], lang),
+                        "removed": diff["removed"],
+                        "etag": diff["etag"],
+                    },
+                )
+        finally:
+            URGENT_FEED.unsubscribe(q)
+
+    return Response(
+        gen(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 # ==============================
 # 8) Eligibility (فحص الأهلية)
@@ -1005,6 +1844,12 @@ END:VCALENDAR"""
     return ics.encode("utf-8")
 
 
+SMTP_POOL = PooledSMTP(
+    SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASS, use_tls=SMTP_TLS, idle_s=SMTP_IDLE_S
+)
+
+
+@traced("email")
 def try_send_email(
     to_email: str, subject: str, body: str, ics_bytes: bytes, ics_name: str
 ) -> Tuple[bool, str]:
@@ -1038,7 +1883,7 @@ def try_send_email(
                     }
                 )
 
-            resp = requests.post(url, headers=headers, json=payload, timeout=10)
+            resp = http_session().post(url, headers=headers, json=payload, timeout=10)
             if resp.status_code in (200, 202):
                 return True, "تم الإرسال عبر SendGrid."
             else:
@@ -1062,15 +1907,7 @@ def try_send_email(
                 subtype="calendar",
                 filename=ics_name,
             )
-        if SMTP_TLS:
-            server = smtplib.SMTP(SMTP_HOST, SMTP_PORT)
-            server.starttls()
-        else:
-            server = smtplib.SMTP(SMTP_HOST, SMTP_PORT)
-        if SMTP_USER:
-            server.login(SMTP_USER, SMTP_PASS)
-        server.send_message(msg)
-        server.quit()
+        SMTP_POOL.send(msg)
         return True, "تم الإرسال عبر SMTP."
     except Exception as e:
         return False, str(e)
@@ -1083,27 +1920,39 @@ def reminder():
     email = (data.get("email") or "").strip()
     next_date = (datetime.now() + timedelta(days=90)).strftime("%Y-%m-%d")
 
+    # حقول اختيارية لتنبيهات الاحتياج العاجل: الفصيلة والموقع والموافقة
+    blood_type = (data.get("blood_type") or "").strip().upper() or None
+    if blood_type and blood_type not in BLOOD_TYPES:
+        parsed = parse_blood_types(blood_type)
+        blood_type = parsed[0] if parsed else None
+    lat, lng, cell = donor_location_fields(data.get("lat"), data.get("lng"))
+    notify_opt_in = 1 if (data.get("notify_opt_in") and email and blood_type) else 0
+
     try:
-        conn = sqlite3.connect(DB_NAME)
-        c = conn.cursor()
-        c.execute(
-            "INSERT INTO reminders(created_at,user_hint,email,next_date,note) VALUES(?,?,?,?,?)",
-            (
-                datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                user_hint,
-                email,
-                next_date,
-                "Reminder for next eligible donation (whole blood).",
-            ),
-        )
-        conn.commit()
+        conn = DB.writer()
+        with span("db_write", table="reminders"), conn:
+            conn.execute(
+                """
+                INSERT INTO reminders(created_at,user_hint,email,next_date,note,
+                                      blood_type,lat,lng,geo_cell,notify_opt_in)
+                VALUES(?,?,?,?,?,?,?,?,?,?)
+                """,
+                (
+                    datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    user_hint,
+                    email,
+                    next_date,
+                    "Reminder for next eligible donation (whole blood).",
+                    blood_type,
+                    lat,
+                    lng,
+                    cell,
+                    notify_opt_in,
+                ),
+            )
+            bump_eligibility(conn, next_date)
     except Exception as e:
         print("⚠️ خطأ في حفظ التذكير في قاعدة البيانات:", e)
-    finally:
-        try:
-            conn.close()
-        except Exception:
-            pass
 
     email_status = {
         "sent": False,
@@ -1131,7 +1980,47 @@ def reminder():
             "via": "sendgrid" if SENDGRID_READY else ("smtp" if SMTP_READY else None),
         }
 
-    return jsonify({"ok": True, "next_date": next_date, "email_status": email_status})
+    return jsonify(
+        {
+            "ok": True,
+            "next_date": next_date,
+            "email_status": email_status,
+            "urgent_alerts": bool(notify_opt_in),
+        }
+    )
+
+
+def render_donor_alert(need: dict, blood_type: str, user_hint: str):
+    hospital = need.get("hospital") or "أقرب بنك دم"
+    subject = f"زمرة: احتياج عاجل لفصيلة {blood_type} قرب موقعك"
+    body = (
+        f"مرحباً {user_hint or 'متبرع'},\n\n"
+        f"يوجد احتياج عاجل لفصيلة {blood_type} في {hospital}"
+        + (f" ({need['details']})" if need.get("details") else "")
+        + ".\nأنت مؤهل للتبرع الآن حسب آخر موعد مسجّل لديك.\n\n"
+        "لإيقاف هذه التنبيهات راسلنا بالرد على هذه الرسالة.\n\n"
+        "مع التحية،\nفريق زمرة."
+    )
+    return subject, body
+
+
+DONOR_MATCHER = DonorMatcher(
+    DB,
+    send=lambda to, subject, body: try_send_email(to, subject, body, None, ""),
+    render=render_donor_alert,
+    radius_km=DONOR_MATCH_RADIUS_KM,
+    cooldown_days=DONOR_NOTIFY_COOLDOWN_DAYS,
+    max_per_need=DONOR_MATCH_MAX_PER_NEED,
+    need_ttl_days=DONOR_NEED_TTL_DAYS,
+)
+if DONOR_MATCH_ENABLED and (SENDGRID_READY or SMTP_READY):
+    URGENT_FEED.listeners.append(DONOR_MATCHER.on_diff)
+
+
+def start_donor_polling():
+    """بعد fork فقط: الخيط لا يُورَّث، والعملية الرئيسية لا تطابق ولا ترسل."""
+    if URGENT_FEED.listeners and DONOR_MATCH_POLL_S > 0:
+        URGENT_FEED.start_polling(DONOR_MATCH_POLL_S)
 
 
 @app.route("/api/reminder/ics/<date_str>")
@@ -1151,39 +2040,98 @@ def reminder_ics(date_str):
     )
 
 # ==============================
-# 10) Upload audio (Mock)
+# 10) Upload audio (طابور مهام + تفريغ نصي)
 # ==============================
 
 
+def _answer_transcribed(text: str, lang: str, client: str = None) -> dict:
+    """معالجة النص المفرّغ بنفس مسار /api/chat (تُستدعى من خيوط طابور الصوت)."""
+    _CLIENT.set(client)
+    payload, log_row = answer_message(text, lang, False)
+    if log_row:
+        save_log(*log_row)
+    return payload
+
+
+AUDIO_QUEUE = None
+try:
+    _transcriber = make_transcriber(AUDIO_TRANSCRIBER, api_key=OPENAI_API_KEY)
+    if _transcriber:
+        os.makedirs(AUDIO_UPLOAD_DIR, exist_ok=True)
+        AUDIO_QUEUE = AudioJobQueue(
+            DB, _transcriber, _answer_transcribed, max_workers=AUDIO_WORKERS
+        )
+        AUDIO_QUEUE.init_db()
+except Exception as e:
+    print("⚠️ فشل تهيئة طابور الصوت:", e)
+    AUDIO_QUEUE = None
+
+_AUDIO_EXT_RE = re.compile(r"^\.[a-z0-9]{1,6}$")
+
+
 @app.route("/api/upload_audio", methods=["POST"])
 def upload_audio():
+    """
+    ينقل الملف إلى AUDIO_UPLOAD_DIR ويضيفه للطابور، ويرجع job_id فوراً (202).
+    werkzeug يكون قد حلّل multipart مسبقاً (ملف مؤقت)؛ الطلب الأكبر من MAX_CONTENT_LENGTH
+    يُرفض بـ 413 قبل ذلك، وsave_upload_stream يطبّق AUDIO_MAX_BYTES على الملف نفسه.
+    النتيجة: GET /api/audio_jobs/<job_id>?wait=ثوانٍ
+    """
     if "audio_file" not in request.files:
         return jsonify({"error": "لم يتم إرسال ملف صوتي"}), 400
+    if not AUDIO_QUEUE:
+        return jsonify({"error": "تحويل الصوت غير مفعّل في الخادم"}), 503
 
-    text = "ما هي شروط التبرع بالدم؟"
-    corrected = text
-    answer, src, score = search_knowledge_base(corrected)
-
-    if answer:
-        final = summarize_and_simplify(answer, 250, "ar")
-        st = "KB (من الصوت)"
-        src_label = "القاعدة المعرفية"
-    else:
-        final = "تم تحويل الصوت؛ لا إجابة محددة في القاعدة المعرفية."
-        st = "Error (من الصوت)"
-        src_label = None
+    lang = (request.form.get("lang") or request.args.get("lang") or "ar").lower()
+    if lang not in ("ar", "en"):
+        lang = "ar"
 
-    save_log("ملف صوتي", corrected, st, src_label, final)
+    f = request.files["audio_file"]
+    ext = os.path.splitext(f.filename or "")[1].lower()
+    if not _AUDIO_EXT_RE.match(ext):
+        ext = ".webm"
 
+    job_id = AUDIO_QUEUE.new_job_id()
+    path = os.path.join(AUDIO_UPLOAD_DIR, job_id + ext)
+    try:
+        save_upload_stream(f.stream, path, AUDIO_MAX_BYTES)
+    except UploadTooLarge:
+        return jsonify({"error": "حجم الملف الصوتي أكبر من المسموح"}), 413
+    except OSError as e:
+        print("⚠️ حفظ الملف الصوتي:", e)
+        return jsonify({"error": "تعذّر حفظ الملف الصوتي"}), 500
+
+    AUDIO_QUEUE.submit(job_id, path, lang, client=_CLIENT.get())
     return jsonify(
-        {
-            "transcribed_text": corrected,
-            "answer": final,
-            "source_type": st,
-            "source_text": src_label,
-            "corrected_message": corrected,
-        }
-    )
+        {"job_id": job_id, "status": "queued", "poll_url": f"/api/audio_jobs/{job_id}"}
+    ), 202
+
+
+@app.route("/api/audio_jobs/<job_id>")
+def audio_job_status(job_id):
+    """
+    حالة مهمة صوتية. wait=N ينتظر حتى N ثوانٍ (بحد أقصى AUDIO_MAX_WAIT_S) قبل الرد.
+    rate_limited: لم تُعالج الرسالة؛ يعيد العميل رفعها بعد retry_after (ترويسة Retry-After أيضاً).
+    """
+    if not AUDIO_QUEUE:
+        return jsonify({"error": "تحويل الصوت غير مفعّل في الخادم"}), 503
+    try:
+        wait = min(max(float(request.args.get("wait") or 0), 0.0), AUDIO_MAX_WAIT_S)
+    except ValueError:
+        wait = 0.0
+
+    deadline = time.time() + wait
+    job = AUDIO_QUEUE.get(job_id)
+    while job and job["status"] in ("queued", "running") and time.time() < deadline:
+        time.sleep(0.25)
+        job = AUDIO_QUEUE.get(job_id)
+
+    if not job:
+        return jsonify({"error": "مهمة غير موجودة"}), 404
+    resp = jsonify(job)
+    if job["status"] == "rate_limited" and job["retry_after"]:
+        resp.headers["Retry-After"] = str(job["retry_after"])
+    return resp
 
 # ==============================
 # 11) Stats / Campaigns
@@ -1193,18 +2141,109 @@ def upload_audio():
 @app.route("/api/stats")
 def stats():
     try:
-        conn = sqlite3.connect(DB_NAME)
-        c = conn.cursor()
-        c.execute("SELECT COUNT(*) FROM logs")
-        total = c.fetchone()[0]
-        c.execute("SELECT response_type, COUNT(*) FROM logs GROUP BY response_type")
-        by_type = {k: v for k, v in c.fetchall()}
-        conn.close()
+        conn = DB.reader()
+        total = conn.execute("SELECT COUNT(*) FROM logs").fetchone()[0]
+        by_type = dict(
+            conn.execute("SELECT response_type, COUNT(*) FROM logs GROUP BY response_type").fetchall()
+        )
         return jsonify({"ok": True, "total_logs": total, "by_type": by_type})
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
 
 
+FORECAST_MAX_DAYS = 731
+
+
+def _parse_day_arg(name: str, default):
+    raw = (request.args.get(name) or "").strip()
+    return datetime.strptime(raw, "%Y-%m-%d").date() if raw else default
+
+
+@app.route("/api/forecast")
+def forecast():
+    """
+    عدد المتبرعين العائدين الذين يصبحون مؤهلين للتبرع، من eligibility_histogram (بدون مسح reminders).
+    ?from=YYYY-MM-DD&to=YYYY-MM-DD&window=7
+    - days   : لكل يوم عدد المؤهلين الجدد + مجموع متحرك لآخر window يوماً.
+    - weeks  : مجموع كل أسبوع (يبدأ الاثنين).
+    """
+    today = datetime.now().date()
+    try:
+        start = _parse_day_arg("from", today)
+        end = _parse_day_arg("to", start + timedelta(days=27))
+        window = max(1, min(int(request.args.get("window") or 7), 90))
+    except ValueError as e:
+        return jsonify({"ok": False, "error": f"معامل غير صالح: {e}"}), 400
+    if end < start:
+        return jsonify({"ok": False, "error": "to قبل from"}), 400
+    if (end - start).days >= FORECAST_MAX_DAYS:
+        return jsonify({"ok": False, "error": f"الحد الأقصى {FORECAST_MAX_DAYS} يوماً"}), 400
+
+    # نقرأ window-1 يوماً قبل البداية ليكون المجموع المتحرك صحيحاً من اليوم الأول
+    lead = start - timedelta(days=window - 1)
+    try:
+        counts = dict(
+            DB.reader().execute(
+                "SELECT day, donors FROM eligibility_histogram WHERE day >= ? AND day <= ?",
+                (lead.isoformat(), end.isoformat()),
+            ).fetchall()
+        )
+    except sqlite3.Error as e:
+        return jsonify({"ok": False, "error": str(e)}), 500
+
+    days, weeks = [], {}
+    rolling, ring = 0, []
+    d = lead
+    while d <= end:
+        n = counts.get(d.isoformat(), 0)
+        ring.append(n)
+        rolling += n
+        if len(ring) > window:
+            rolling -= ring.pop(0)
+        if d >= start:
+            days.append({"date": d.isoformat(), "eligible": n, "rolling": rolling})
+            wk = (d - timedelta(days=d.weekday())).isoformat()
+            weeks[wk] = weeks.get(wk, 0) + n
+        d += timedelta(days=1)
+
+    return jsonify(
+        {
+            "ok": True,
+            "from": start.isoformat(),
+            "to": end.isoformat(),
+            "window": window,
+            "total": sum(x["eligible"] for x in days),
+            "days": days,
+            "weeks": [{"week_start": k, "eligible": v} for k, v in sorted(weeks.items())],
+        }
+    )
+
+
+@app.route("/api/usage")
+def usage():
+    """استهلاك التوكنات لكل عميل في يوم محدد (افتراضياً اليوم) — للإدارة فقط."""
+    denied = _require_admin()
+    if denied:
+        return denied
+    if not RATE_LIMITER:
+        return jsonify({"ok": False, "error": "تحديد المعدل غير مفعّل"}), 503
+    day = (request.args.get("day") or "").strip() or None
+    return jsonify({"ok": True, "day": day or RATE_LIMITER.today(), "clients": RATE_LIMITER.usage_report(day)})
+
+
+@app.route("/api/traces/<trace_id>")
+def trace_lookup(trace_id):
+    """إرجاع trace محفوظ (عيّنة أو طلب بطيء) بالمعرّف من ترويسة X-Trace-Id — للإدارة فقط."""
+    denied = _require_admin()
+    if denied:
+        return denied
+    trace_id = TRACER.clean_id(trace_id)
+    found = TRACER.find(trace_id) if trace_id else None
+    if not found:
+        return jsonify({"ok": False, "error": "غير موجود (لم يقع في العيّنة أو دُوِّر الملف)"}), 404
+    return jsonify({"ok": True, "trace": found})
+
+
 @app.route("/api/campaigns")
 def campaigns():
     data = _load_json(CAMPAIGNS_JSON_PATH)
@@ -1219,11 +2258,313 @@ def campaigns():
     return jsonify({"ok": True, "campaigns": data})
 
 # ==============================
-# 12) Run (Local)
+# 12) Export (CSV / JSONL بث تدريجي)
+# ==============================
+
+# (الجدول، عمود الوقت، الأعمدة)
+EXPORT_TABLES = {
+    "logs": (
+        "logs_v",
+        "timestamp",
+        ["id", "timestamp", "raw_query", "corrected_query", "response_type", "kb_source", "bot_response"],
+    ),
+    "reminders": (
+        "reminders",
+        "created_at",
+        ["id", "created_at", "user_hint", "email", "next_date", "note"],
+    ),
+}
+EXPORT_PAGE_SIZE = 1000
+
+
+def _require_admin():
+    """
+    التحقق من رمز الإدارة (Authorization: Bearer <token> أو X-Admin-Token).
+    ترجع None عند النجاح أو رد خطأ جاهز.
+    """
+    if not ADMIN_API_TOKEN:
+        return jsonify({"ok": False, "error": "واجهات الإدارة غير مفعّلة (ADMIN_API_TOKEN)."}), 403
+    auth = request.headers.get("Authorization") or ""
+    token = auth[7:].strip() if auth.lower().startswith("bearer ") else ""
+    token = token or (request.headers.get("X-Admin-Token") or "").strip()
+    if not token or not hmac.compare_digest(token, ADMIN_API_TOKEN):
+        return jsonify({"ok": False, "error": "غير مصرح"}), 401
+    return None
+
+
+def _parse_ts_arg(name: str):
+    """قراءة تاريخ/وقت من الاستعلام وإرجاعه بصيغة التخزين "%Y-%m-%d %H:%M:%S"."""
+    raw = (request.args.get(name) or "").strip()
+    if not raw:
+        return None
+    dt = datetime.fromisoformat(raw.replace("T", " ").replace("Z", ""))
+    return dt.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _iter_export_pages(table: str, ts_col: str, cols, after_id: int, since, until, limit):
+    """
+    Keyset pagination على id: كل صفحة استعلام قصير مستقل (WHERE id > آخر id)،
+    فلا تبقى معاملة قراءة مفتوحة طوال التصدير ولا يتعطل checkpoint الخاص بـ WAL.
+    الذاكرة ثابتة: صفحة واحدة فقط في أي لحظة.
+    """
+    where = ["id > ?"]
+    base_params = []
+    if since:
+        where.append(f"{ts_col} >= ?")
+        base_params.append(since)
+    if until:
+        where.append(f"{ts_col} < ?")
+        base_params.append(until)
+    sql = (
+        f"SELECT {', '.join(cols)} FROM {table} WHERE {' AND '.join(where)} "
+        f"ORDER BY id LIMIT ?"
+    )
+
+    conn = LOG_STORE.attach(DB.reader())
+    last_id = after_id
+    remaining = limit
+    while remaining is None or remaining > 0:
+        page = EXPORT_PAGE_SIZE if remaining is None else min(EXPORT_PAGE_SIZE, remaining)
+        rows = conn.execute(sql, [last_id, *base_params, page]).fetchall()
+        if not rows:
+            break
+        yield rows
+        last_id = rows[-1][0]
+        if remaining is not None:
+            remaining -= len(rows)
+        if len(rows) < page:
+            break
+
+
+def _encode_export(pages, cols, fmt: str):
+    """تحويل الصفحات إلى نصوص CSV أو JSONL (قطعة لكل صفحة)."""
+    if fmt == "csv":
+        buf = StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(cols)
+        for rows in pages:
+            writer.writerows(rows)
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate(0)
+        tail = buf.getvalue()
+        if tail:
+            yield tail
+    else:
+        for rows in pages:
+            yield "".join(
+                json.dumps(dict(zip(cols, r)), ensure_ascii=False) + "\n" for r in rows
+            )
+
+
+def _gzip_stream(chunks):
+    comp = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 ⇒ صيغة gzip
+    for chunk in chunks:
+        data = comp.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield comp.flush()
+
+
+@app.route("/api/export/<name>")
+def export_table(name):
+    """
+    تصدير logs / reminders كبث CSV أو JSONL.
+    المعاملات: format=csv|jsonl, after_id, since, until, limit, gzip=1
+    للاستكمال: after_id = آخر id تم استلامه.
+    """
+    denied = _require_admin()
+    if denied:
+        return denied
+
+    if name not in EXPORT_TABLES:
+        return jsonify({"ok": False, "error": "جدول غير معروف"}), 404
+    table, ts_col, cols = EXPORT_TABLES[name]
+
+    fmt = (request.args.get("format") or "csv").lower()
+    if fmt not in ("csv", "jsonl"):
+        return jsonify({"ok": False, "error": "format يجب أن يكون csv أو jsonl"}), 400
+
+    try:
+        after_id = int(request.args.get("after_id") or 0)
+        limit = request.args.get("limit")
+        limit = int(limit) if limit else None
+        since = _parse_ts_arg("since")
+        until = _parse_ts_arg("until")
+    except ValueError:
+        return jsonify({"ok": False, "error": "معاملات غير صحيحة"}), 400
+
+    use_gzip = (request.args.get("gzip") or "").lower() in {"1", "true", "yes"}
+
+    body = _encode_export(
+        _iter_export_pages(table, ts_col, cols, after_id, since, until, limit), cols, fmt
+    )
+    filename = f"zomra-{name}.{fmt}"
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    if use_gzip:
+        body = _gzip_stream(body)
+        filename += ".gz"
+        mimetype = "application/gzip"
+
+    return Response(
+        body,
+        mimetype=mimetype,
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "Cache-Control": "no-store",
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
+# ---------- بحث نصي في السجلات (فريق الدعم) ----------
+LOGS_SEARCH_MAX = 200
+LOGS_SEARCH_FIELDS = {"all": None, "query": "raw_query", "response": "bot_response"}
+
+
+def fts_query(text: str, field: str = None, prefix: bool = False) -> str:
+    """نص المستخدم → تعبير MATCH آمن: كل كلمة بين علامتي تنصيص (AND ضمني)."""
+    terms = [t.replace('"', '""') for t in re.findall(r"\w+", fts_normalize(text))]
+    if not terms:
+        return ""
+    star = "*" if prefix else ""
+    expr = " ".join(f'"{t}"{star}' for t in terms)
+    return f"{field} : ({expr})" if field else expr
+
+
+@app.route("/api/logs/search")
+def logs_search():
+    """
+    بحث نصي كامل في السجلات عبر FTS5 — للإدارة فقط.
+    ?q=صفائح&in=all|query|response&type=AI&since=...&until=...&limit=50&before_id=...&prefix=1
+    النتائج الأحدث أولاً؛ للصفحة التالية مرّر before_id = next_before_id.
+    """
+    denied = _require_admin()
+    if denied:
+        return denied
+    if not LOGS_FTS_READY:
+        return jsonify({"ok": False, "error": "FTS5 غير متاح على هذا الخادم"}), 503
+
+    field = (request.args.get("in") or "all").lower()
+    if field not in LOGS_SEARCH_FIELDS:
+        return jsonify({"ok": False, "error": "in يجب أن يكون all أو query أو response"}), 400
+    match = fts_query(
+        request.args.get("q") or "",
+        LOGS_SEARCH_FIELDS[field],
+        prefix=(request.args.get("prefix") or "").lower() in {"1", "true", "yes"},
+    )
+    if not match:
+        return jsonify({"ok": False, "error": "q مطلوب"}), 400
+    try:
+        since = _parse_ts_arg("since")
+        until = _parse_ts_arg("until")
+        limit = max(1, min(int(request.args.get("limit") or 50), LOGS_SEARCH_MAX))
+        before_id = int(request.args.get("before_id") or 0)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": f"معامل غير صالح: {e}"}), 400
+
+    where = ["logs_fts MATCH ?"]
+    params = [match]
+    if before_id:
+        where.append("f.rowid < ?")
+        params.append(before_id)
+    if since:
+        where.append("l.timestamp >= ?")
+        params.append(since)
+    if until:
+        where.append("l.timestamp < ?")
+        params.append(until)
+    rtype = (request.args.get("type") or "").strip()
+    if rtype:
+        where.append("l.response_type = ?")
+        params.append(rtype)
+
+    cols = ["id", "timestamp", "raw_query", "response_type", "kb_source", "bot_response"]
+    sql = (
+        f"SELECT {', '.join('l.' + c for c in cols)} FROM logs_fts f "
+        f"JOIN logs_v l ON l.id = f.rowid WHERE {' AND '.join(where)} "
+        f"ORDER BY f.rowid DESC LIMIT ?"
+    )
+    # اتصال قراءة فقط: مع WAL لا يحجب الكتابات الجارية
+    try:
+        conn = LOG_STORE.attach(DB.reader())
+        with span("db_read", table="logs_fts"):
+            rows = conn.execute(sql, params + [limit]).fetchall()
+    except sqlite3.OperationalError as e:
+        return jsonify({"ok": False, "error": f"استعلام غير صالح: {e}"}), 400
+
+    results = [dict(zip(cols, r)) for r in rows]
+    return jsonify(
+        {
+            "ok": True,
+            "count": len(results),
+            "results": results,
+            "next_before_id": results[-1]["id"] if len(results) == limit else None,
+        }
+    )
+
+# ==============================
+# 13) Warm-up / Preload
+# ==============================
+
+
+def warm_up():
+    """
+    تهيئة ما يمكن مشاركته بين العمال قبل fork (gunicorn --preload):
+    ملفات لغات langdetect (تُحمَّل كسولاً عند أول detect) + أول تشغيل لمسار البحث.
+    """
+    try:
+        from langdetect.detector_factory import init_factory
+
+        init_factory()
+    except Exception as e:
+        print("⚠️ warm-up langdetect:", e)
+    search_knowledge_base("شروط التبرع")
+    try:
+        conn = DB.writer()
+        with conn:
+            LOG_STORE.ensure_dict(conn)
+    except sqlite3.Error as e:
+        print("⚠️ warm-up response dict:", e)
+
+
+def on_worker_fork():
+    """يُستدعى من gunicorn.conf.py (post_fork): تفريغ الموارد الخاصة بكل عملية."""
+    _HTTP["pid"] = None
+    _HTTP["session"] = None
+    start_donor_polling()
+
+
+@app.after_request
+def _record_first_response(resp):
+    global FIRST_RESPONSE_MS
+    if FIRST_RESPONSE_MS is None:
+        FIRST_RESPONSE_MS = round((time.perf_counter() - _BOOT_T0) * 1000.0, 1)
+        if FIRST_RESPONSE_MS > STARTUP_TARGET_MS:
+            print(
+                f"⚠️ أول رد بعد {FIRST_RESPONSE_MS:.0f}ms "
+                f"(الهدف {STARTUP_TARGET_MS}ms)."
+            )
+    return resp
+
+
+warm_up()
+_startup_mark("warm_up")
+
+if STARTUP_PROFILE:
+    total = sum(ms for _, ms in STARTUP_TIMINGS)
+    print("⏱️ Startup profile (ms):")
+    for phase, ms in STARTUP_TIMINGS:
+        print(f"   {phase:<12} {ms:>8.1f}")
+    print(f"   {'total':<12} {total:>8.1f}")
+
+# ==============================
+# 14) Run (Local)
 # ==============================
 
 if __name__ == "__main__":
     init_db()
+    start_donor_polling()
     app.run(host="0.0.0.0", port=5000, debug=True)
 
 
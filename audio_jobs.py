@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+"""
+audio_jobs.py - طابور مهام الرسائل الصوتية.
+
+- نسخ الملف المرفوع إلى مجلد الرفع بقطع صغيرة مع حد أقصى للحجم. هذا ليس رفعاً متدفقاً:
+  werkzeug يحلّل multipart كاملاً قبل المسار (في ملف مؤقت على القرص للملفات الكبيرة)،
+  والحماية من الطلبات الضخمة هي MAX_CONTENT_LENGTH (413 قبل التحليل).
+- مجمّع خيوط (ThreadPoolExecutor) يشغّل التفريغ النصي ثم مسار الإجابة نفسه المستخدم في /api/chat.
+- حالة المهام تُحفظ في SQLite (جدول audio_jobs) فيستطيع أي عامل gunicorn الرد على الاستعلام.
+- خلفية التفريغ قابلة للاستبدال (AUDIO_TRANSCRIBER): stub | openai | none.
+- تجاوز حد المعدل أثناء الإجابة (RateLimited) يُنهي المهمة بحالة rate_limited مع retry_after
+  بدل failed، فيعرف العميل أنه يستطيع إعادة الإرسال بعد المهلة.
+- المهمة تعيش في ذاكرة العامل الذي استلمها (owner_pid): إن توقف العامل قبل إنهائها
+  تُعلَّم failed عند الإقلاع التالي أو عند الاستعلام عنها، بدل أن تبقى running للأبد.
+"""
+
+import os, json, math, time, uuid, threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from rate_limit import RateLimited
+
+CHUNK_SIZE = 64 * 1024
+# أقصى عمر لمهمة غير منتهية حتى لو بدا عاملها حياً (إعادة استخدام رقم العملية، خيط عالق)
+STALE_JOB_S = 900
+
+
+class UploadTooLarge(ValueError):
+    """الملف الصوتي تجاوز الحد المسموح."""
+
+
+class TranscriptionError(RuntimeError):
+    """فشل تحويل الصوت إلى نص."""
+
+
+def save_upload_stream(stream, dest_path: str, max_bytes: int) -> int:
+    """
+    نسخ stream إلى dest_path بقطع CHUNK_SIZE. يرفع UploadTooLarge ويحذف الملف الجزئي
+    عند تجاوز max_bytes. ترجع عدد البايتات المكتوبة.
+    """
+    written = 0
+    try:
+        with open(dest_path, "wb") as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > max_bytes:
+                    raise UploadTooLarge(f"الحجم يتجاوز {max_bytes} بايت")
+                out.write(chunk)
+    except BaseException:
+        try:
+            os.remove(dest_path)
+        except OSError:
+            pass
+        raise
+    return written
+
+
+# ==============================
+# Transcribers
+# ==============================
+
+
+class StubTranscriber:
+    """تفريغ محلي للاختبارات: يرجع نصاً ثابتاً بعد زمن محدد (بدون شبكة)."""
+
+    name = "stub"
+
+    def __init__(self, text: str = "ما هي شروط التبرع بالدم؟", latency_ms: float = 0.0):
+        self.text = text
+        self.latency_ms = latency_ms
+
+    def transcribe(self, path: str, lang: str = None) -> str:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+        return self.text
+
+
+class OpenAITranscriber:
+    """تفريغ عبر OpenAI (whisper). العميل يُنشأ كسولاً داخل كل عملية."""
+
+    name = "openai"
+
+    def __init__(self, api_key: str, model: str = "whisper-1"):
+        self.api_key = api_key
+        self.model = model
+        self._client = None
+        self._pid = None
+
+    def transcribe(self, path: str, lang: str = None) -> str:
+        if self._client is None or self._pid != os.getpid():
+            from openai import OpenAI
+
+            self._client = OpenAI(api_key=self.api_key)
+            self._pid = os.getpid()
+        kwargs = {"model": self.model}
+        if lang in ("ar", "en"):
+            kwargs["language"] = lang
+        try:
+            with open(path, "rb") as f:
+                resp = self._client.audio.transcriptions.create(file=f, **kwargs)
+        except Exception as e:
+            raise TranscriptionError(str(e)) from e
+        return (getattr(resp, "text", "") or "").strip()
+
+
+def make_transcriber(kind: str, api_key: str = ""):
+    kind = (kind or "").strip().lower()
+    if kind in ("", "none", "off"):
+        return None
+    if kind == "stub":
+        return StubTranscriber(
+            text=(os.getenv("AUDIO_STUB_TEXT") or "ما هي شروط التبرع بالدم؟"),
+            latency_ms=float(os.getenv("AUDIO_STUB_LATENCY_MS") or "0"),
+        )
+    if kind == "openai":
+        if not api_key:
+            return None
+        return OpenAITranscriber(api_key, model=(os.getenv("AUDIO_MODEL") or "whisper-1"))
+    raise ValueError(f"AUDIO_TRANSCRIBER غير معروف: {kind!r}")
+
+
+# ==============================
+# Job queue
+# ==============================
+
+
+def _pid_alive(pid) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class AudioJobQueue:
+    """
+    handler(text, lang, client) -> payload: مسار الإجابة (يُمرَّر من app.py).
+    الحالات: queued → running → done | failed | rate_limited.
+    """
+
+    def __init__(self, db, transcriber, handler, max_workers: int = 2,
+                 retention_s: int = 3600):
+        """db: db.Database (اتصالات الخيوط المشتركة مع بقية التطبيق)."""
+        self.db = db
+        self.transcriber = transcriber
+        self.handler = handler
+        self.max_workers = max_workers
+        self.retention_s = retention_s
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    # ---------- DB ----------
+    def init_db(self):
+        conn = self.db.writer()
+        with conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS audio_jobs(
+                    id TEXT PRIMARY KEY,
+                    created_at REAL,
+                    updated_at REAL,
+                    status TEXT,
+                    lang TEXT,
+                    result TEXT,
+                    error TEXT,
+                    owner_pid INTEGER,
+                    path TEXT,
+                    retry_after INTEGER
+                )
+                """
+            )
+            cols = {r[1] for r in conn.execute("PRAGMA table_info(audio_jobs)")}
+            for name, decl in (("owner_pid", "INTEGER"), ("path", "TEXT"), ("retry_after", "INTEGER")):
+                if name not in cols:
+                    conn.execute(f"ALTER TABLE audio_jobs ADD COLUMN {name} {decl}")
+        self.recover()
+
+    def recover(self, job_id: str = None) -> int:
+        """
+        المهام queued/running التي توقف عاملها (أو تجاوزت STALE_JOB_S) تُعلَّم failed
+        ويُحذف ملفها المرفوع. job_id: فحص مهمة واحدة فقط. ترجع عدد المهام المُعلَّمة.
+        """
+        sql = "SELECT id, owner_pid, updated_at, path FROM audio_jobs WHERE status IN ('queued','running')"
+        params = ()
+        if job_id:
+            sql += " AND id=?"
+            params = (job_id,)
+        cutoff = time.time() - STALE_JOB_S
+        lost = [
+            (jid, path)
+            for jid, pid, updated_at, path in self.db.reader().execute(sql, params).fetchall()
+            if (updated_at or 0) < cutoff or not _pid_alive(pid)
+        ]
+        for jid, path in lost:
+            self._update(jid, "failed", error="توقفت المهمة قبل اكتمالها (إعادة تشغيل العامل)")
+            if path:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        if lost and not job_id:
+            print(f"⚠️ {len(lost)} مهمة صوتية متوقفة عُلّمت failed.")
+        return len(lost)
+
+    def _update(self, job_id: str, status: str, result=None, error=None, retry_after=None):
+        conn = self.db.writer()
+        with conn:
+            conn.execute(
+                """
+                UPDATE audio_jobs SET status=?, updated_at=?, result=?, error=?, retry_after=?
+                WHERE id=?
+                """,
+                (
+                    status,
+                    time.time(),
+                    json.dumps(result, ensure_ascii=False) if result is not None else None,
+                    error,
+                    retry_after,
+                    job_id,
+                ),
+            )
+
+    def get(self, job_id: str):
+        self.recover(job_id)
+        row = self.db.reader().execute(
+            """
+            SELECT id, status, created_at, updated_at, result, error, retry_after
+            FROM audio_jobs WHERE id=?
+            """,
+            (job_id,),
+        ).fetchone()
+        if not row:
+            return None
+        return {
+            "job_id": row[0],
+            "status": row[1],
+            "created_at": datetime.utcfromtimestamp(row[2]).isoformat() + "Z",
+            "updated_at": datetime.utcfromtimestamp(row[3]).isoformat() + "Z",
+            "result": json.loads(row[4]) if row[4] else None,
+            "error": row[5],
+            "retry_after": row[6],
+        }
+
+    # ---------- تنفيذ ----------
+    def _executor(self):
+        # مجمّع الخيوط لكل عملية (لا يُورَّث عبر fork)
+        if self._pool is None or self._pid != os.getpid():
+            with self._lock:
+                if self._pool is None or self._pid != os.getpid():
+                    self._pool = ThreadPoolExecutor(
+                        max_workers=self.max_workers, thread_name_prefix="audio"
+                    )
+                    self._pid = os.getpid()
+        return self._pool
+
+    def new_job_id(self) -> str:
+        return uuid.uuid4().hex
+
+    def submit(self, job_id: str, path: str, lang: str, client: str = None):
+        now = time.time()
+        conn = self.db.writer()
+        with conn:
+            conn.execute(
+                """
+                INSERT INTO audio_jobs(id, created_at, updated_at, status, lang, owner_pid, path)
+                VALUES(?,?,?,?,?,?,?)
+                """,
+                (job_id, now, now, "queued", lang, os.getpid(), path),
+            )
+            # تنظيف المهام القديمة
+            conn.execute("DELETE FROM audio_jobs WHERE created_at < ?", (now - self.retention_s,))
+        self._executor().submit(self._run, job_id, path, lang, client)
+
+    def _run(self, job_id: str, path: str, lang: str, client: str = None):
+        try:
+            self._update(job_id, "running")
+            text = self.transcriber.transcribe(path, lang)
+            if not text:
+                raise TranscriptionError("لم يُستخرج أي نص من الصوت")
+            payload = self.handler(text, lang, client)
+            payload["transcribed_text"] = text
+            self._update(job_id, "done", result=payload)
+        except RateLimited as e:
+            retry = max(1, math.ceil(e.retry_after))
+            self._update(
+                job_id, "rate_limited", error=f"تم تجاوز الحد المسموح؛ أعد الإرسال بعد {retry} ثانية",
+                retry_after=retry,
+            )
+        except Exception as e:
+            print("⚠️ مهمة صوتية فشلت:", e)
+            self._update(job_id, "failed", error=str(e))
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def shutdown(self):
+        if self._pool is not None and self._pid == os.getpid():
+            self._pool.shutdown(wait=False)
+        self._pool = None
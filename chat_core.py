@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+"""
+chat_core.py - الثوابت والدوال المشتركة بين app.py وسكربتات الصيانة، بلا آثار جانبية.
+
+الاستيراد لا يفتح قاعدة بيانات ولا ينشئ مجلدات ولا يتصل بالشبكة ولا يدرّب شيئاً؛
+لذلك تستوردها kb_build.py (أثناء البناء على Render) و replay_logs.py و mine_questions.py
+و log_store.py بدل "import app" الذي يشغّل إقلاع التطبيق كاملاً.
+
+- اسم قاعدة البيانات ومسارات القاعدة المعرفية وملفاتها المبنية.
+- أدوات النص: normalize_arabic (من text_norm)، text_script، normalize_english، التلخيص.
+- القاعدة المعرفية: تُحمَّل (قراءة ملفات فقط) عند أول بحث أو أول kb_state()، لا عند الاستيراد.
+- جدول النوايا والموجّه المبني منه (المعالجات في app.py).
+"""
+
+import os, re, json, hashlib, threading
+
+from fuzzywuzzy import process, fuzz
+
+from intent_router import IntentRouter
+from kb_store import CompiledKB, KBFormatError, compile_kb, file_digest, open_compiled
+from text_norm import normalize_arabic_cached as normalize_arabic
+
+DB_NAME = "chat_logs.db"
+
+KB_PATH = "knowledge_base.json"
+# النسخة المجمّعة (mmap) — يبنيها: python kb_build.py compile
+KB_COMPILED_PATH = "knowledge_base.kbc"
+# نسخ الإجابات المترجمة/الملخّصة مسبقاً (يبنيها: python kb_build.py i18n)
+KB_I18N_PATH = "knowledge_base.i18n.json"
+KB_I18N_VERSION = 1
+KB_SUMMARY_LEN = 220
+# أقل درجة تشابه (0-100) لاعتماد إجابة KB؛ جرّب القيم الجديدة أولاً عبر replay_logs.py
+KB_SIM_THRESHOLD = int(os.getenv("KB_SIM_THRESHOLD") or "85")
+
+
+# ==============================
+# Text utils
+# ==============================
+
+
+def summarize_and_simplify(text: str, max_length: int = 250, lang: str = "ar") -> str:
+    """
+    تلخيص بسيط مع احترام الجمل (يدعم عربي وإنجليزي).
+    - lang = "ar": يختم بـ "هل ترغب بالتفصيل أكثر؟"
+    - lang = "en": يختم بـ "Would you like more details?"
+    """
+    if not text or len(text) <= max_length:
+        return text
+
+    if lang == "en":
+        cut_marks = [".", "?", "!", "…"]
+    else:
+        cut_marks = [".", "؟", "!", "…"]
+
+    trunc = text[: max_length - 5]
+    cut_pos = -1
+    for m in cut_marks:
+        pos = trunc.rfind(m)
+        if pos > cut_pos:
+            cut_pos = pos
+
+    if cut_pos == -1:
+        cut_pos = trunc.rfind(" ")
+        if cut_pos == -1:
+            cut_pos = len(trunc)
+
+    summary = trunc[:cut_pos].strip()
+    if lang == "en":
+        return f"{summary}...\n\nWould you like more details?"
+    else:
+        return f"{summary}...\n\nهل ترغب بالتفصيل أكثر؟"
+
+
+def translation_prompt(text: str, target_language_code: str) -> str:
+    if target_language_code == "ar":
+        return f"Translate to standard Arabic. Return only the translation:\n\n{text}"
+    if target_language_code == "en":
+        return f"Translate the following text to English. Return only the translation:\n\n{text}"
+    return (
+        f"Translate the following Arabic text to {target_language_code}. "
+        f"Return only the translation:\n\n{text}"
+    )
+
+
+def strip_llm_label(out: str) -> str:
+    """حذف بادئة مثل "Translation:" يضيفها النموذج أحياناً."""
+    return out.split(":", 1)[-1].strip() if ":" in out[:15] else out
+
+
+# حروف عربية (مع أشكال العرض) مقابل لاتينية: يحدد أي فهرس أسئلة يُبحث فيه
+_ARABIC_LETTER_RE = re.compile(r"[\u0621-\u064A\u0671-\u06D3\uFB50-\uFDFF\uFE70-\uFEFC]")
+_LATIN_LETTER_RE = re.compile(r"[A-Za-z]")
+
+
+def text_script(text: str) -> str:
+    """"en" إن غلبت الحروف اللاتينية، وإلا "ar" (حتمي وأسرع من langdetect بكثير)."""
+    text = text or ""
+    return "en" if len(_LATIN_LETTER_RE.findall(text)) > len(_ARABIC_LETTER_RE.findall(text)) else "ar"
+
+
+def normalize_english(text: str) -> str:
+    return " ".join((text or "").casefold().split())
+
+
+# ==============================
+# Knowledge Base
+# ==============================
+
+
+def load_knowledge_base(path: str = KB_PATH):
+    kb = {}
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            overwritten = []
+            for item in data:
+                answer = item.get("answer", "")
+                src = (
+                    item.get("source_type")
+                    or item.get("source")
+                    or "القاعدة المعرفية"
+                )
+                for q in item.get("questions", []):
+                    prev = kb.get(q)
+                    if prev is not None and prev["answer"] != answer:
+                        overwritten.append(q)
+                    kb[q] = {"answer": answer, "source": src}
+            if overwritten:
+                # آخر مدخل يفوز بصمت؛ التفاصيل الكاملة: python kb_build.py validate
+                print(
+                    f"⚠️ {len(overwritten)} سؤالاً مكرراً بإجابة مختلفة (اعتُمد آخرها)، "
+                    f"مثل: {overwritten[:3]}"
+                )
+            if kb:
+                print(f"✅ تم تحميل قاعدة معرفية من {path} بعدد {len(kb)} سؤالاً.")
+                return kb
+        except Exception as e:
+            print("⚠️ فشل تحميل knowledge_base.json:", e)
+
+    print("ℹ️ سيتم استخدام قاعدة معرفية افتراضية بسيطة.")
+    return {
+        "ما هي شروط التبرع بالدم؟": {
+            "answer": "يجب أن يكون العمر 18-60 عاماً والوزن ≥50 كجم وبصحة جيدة وبدون أمراض معدية. يفضّل مراجعة المستشفى قبل التبرع.",
+            "source": "القاعدة المعرفية",
+        },
+        "المدة الفاصلة بين التبرعات؟": {
+            "answer": "التبرع الكامل: 90 يومًا على الأقل بين كل تبرعين. مكوّنات الدم قد تختلف.",
+            "source": "القاعدة المعرفية",
+        },
+        "هل التبرع بالدم مؤلم؟": {
+            "answer": "وخزة الإبرة سريعة وخفيفة عادةً، والسحب نفسه يستغرق دقائق، مع راحة بسيطة بعد التبرع.",
+            "source": "القاعدة المعرفية",
+        },
+    }
+
+
+def load_kb_store():
+    """
+    تحميل القاعدة كـ CompiledKB:
+    - knowledge_base.kbc عبر mmap (قراءة فقط، مشترك بين العمال) إن كان مطابقاً لـ JSON الحالي.
+    - وإلا تجميع knowledge_base.json في الذاكرة بنفس الصيغة.
+    """
+    if os.path.exists(KB_COMPILED_PATH):
+        try:
+            kb = open_compiled(KB_COMPILED_PATH)
+            if not os.path.exists(KB_PATH) or kb.source_digest == file_digest(KB_PATH):
+                print(f"✅ تم فتح القاعدة المجمّعة {KB_COMPILED_PATH} ({len(kb)} سؤالاً).")
+                return kb
+            print(f"ℹ️ {KB_COMPILED_PATH} قديم مقارنةً بـ {KB_PATH}؛ أعد تشغيل: python kb_build.py compile")
+        except (OSError, KBFormatError) as e:
+            print(f"⚠️ تعذّر فتح {KB_COMPILED_PATH}:", e)
+
+    digest = file_digest(KB_PATH) if os.path.exists(KB_PATH) else b""
+    return CompiledKB(compile_kb(load_knowledge_base(), normalize_arabic, digest))
+
+
+def kb_answer_key(answer: str) -> str:
+    """بصمة نص الإجابة (تتغير فقط عند تغيّر النص ⇒ إعادة بناء تلك الإجابة فقط)."""
+    return hashlib.sha1((answer or "").encode("utf-8")).hexdigest()[:16]
+
+
+def load_kb_i18n(path: str = KB_I18N_PATH):
+    """تحميل نسخ الإجابات (ar/en × full/summary). ترجع {} عند غياب الملف أو اختلاف الإصدار."""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception as e:
+        print(f"⚠️ فشل تحميل {path}:", e)
+        return {}
+    if not isinstance(data, dict) or data.get("version") != KB_I18N_VERSION:
+        print(f"⚠️ إصدار {path} غير متوافق؛ سيتم تجاهله.")
+        return {}
+    answers = data.get("answers") or {}
+    print(f"✅ تم تحميل {len(answers)} إجابة مترجمة مسبقاً من {path}.")
+    return answers
+
+
+def build_kb_en_index(kb, i18n):
+    """
+    فهرس الأسئلة الإنجليزية (من knowledge_base.i18n.json → en.questions):
+    ({j: normalized}, [KB index لكل j]) — كل سؤال يشير لأول سؤال عربي له نفس الإجابة،
+    فتُرجع KB.answer/KB.source كما في البحث العربي تماماً.
+    """
+    first = {}
+    for i in range(len(kb)):
+        first.setdefault(kb_answer_key(kb.answer(i)), i)
+    choices, owners = {}, []
+    for key, variants in i18n.items():
+        idx = first.get(key)
+        if idx is None:
+            continue
+        for q in (variants.get("en") or {}).get("questions") or ():
+            nq = normalize_english(q)
+            if nq:
+                choices[len(owners)] = nq
+                owners.append(idx)
+    if owners:
+        print(f"✅ فهرس الأسئلة الإنجليزية: {len(owners)} سؤالاً.")
+    return choices, owners
+
+
+class KBState:
+    """القاعدة المحمّلة مع نسخها المترجمة وفهرس أسئلتها الإنجليزية."""
+
+    def __init__(self, kb, i18n):
+        self.kb = kb
+        self.i18n = i18n
+        self.en_choices, self.en_owners = build_kb_en_index(kb, i18n)
+
+
+_STATE = None
+_STATE_LOCK = threading.Lock()
+
+
+def kb_state() -> KBState:
+    """القاعدة الحالية؛ تُحمَّل من الملفات عند أول استدعاء في العملية."""
+    global _STATE
+    if _STATE is None:
+        with _STATE_LOCK:
+            if _STATE is None:
+                _STATE = KBState(load_kb_store(), load_kb_i18n())
+    return _STATE
+
+
+def set_kb_state(state: KBState):
+    """استبدال القاعدة الحالية (مثلاً بقاعدة مبنية في الذاكرة)."""
+    global _STATE
+    with _STATE_LOCK:
+        _STATE = state
+
+
+def search_knowledge_base(corrected_query: str, choices=None):
+    """
+    البحث بالتقريب في القاعدة المعرفية باستخدام fuzzywuzzy.
+    choices (اختياري): {index: normalized} بديل لأسئلة القاعدة (الافتراضي KB.normalized_items()).
+    ترجع: (answer, source, similarity_score من 0 إلى 100)
+    """
+    if not corrected_query:
+        return None, None, 0
+
+    nq = normalize_arabic(corrected_query)
+    kb = kb_state().kb
+    if not len(kb):
+        return None, None, 0
+    vals = choices if choices is not None else kb.normalized_items()
+
+    candidate = _best_match(nq, vals)
+    if not candidate:
+        return None, None, 0
+
+    _, score, idx = candidate
+    return kb.answer(idx), kb.source(idx), int(score)
+
+
+def _best_match(nq: str, vals):
+    best_partial = process.extractOne(nq, vals, scorer=fuzz.partial_ratio)
+    best_token = process.extractOne(nq, vals, scorer=fuzz.token_sort_ratio)
+    if best_partial and best_token:
+        return best_partial if best_partial[1] >= best_token[1] else best_token
+    return best_partial or best_token
+
+
+def search_knowledge_base_en(query: str, choices=None):
+    """نفس search_knowledge_base لكن على فهرس الأسئلة الإنجليزية (بدون شبكة)."""
+    nq = normalize_english(query)
+    st = kb_state()
+    if not nq or not st.en_owners:
+        return None, None, 0
+    candidate = _best_match(nq, st.en_choices)
+    if not candidate:
+        return None, None, 0
+    _, score, j = candidate
+    idx = st.en_owners[j]
+    return st.kb.answer(idx), st.kb.source(idx), int(score)
+
+
+def search_kb(query: str, choices=None):
+    """البحث في فهرس الأسئلة المطابق لحروف الرسالة (عربي/إنجليزي)."""
+    if text_script(query) == "en":
+        return search_knowledge_base_en(query)
+    return search_knowledge_base(query, choices)
+
+
+def search_knowledge_base_many(queries):
+    """
+    بحث لدفعة نصوص: حلقة search_kb على النصوص الفريدة (لا حساب مصفوفي؛ fuzzywuzzy
+    يقارن نصاً واحداً في كل مرة). الوفر من إزالة التكرار ومن قائمة الأسئلة المطبّعة
+    المفكوكة مرة واحدة لكل عملية (normalized_items).
+    ترجع {query: (answer, source, score)} لكل نص فريد.
+    """
+    uniq = {q for q in queries if q}
+    return {q: search_kb(q) for q in uniq}
+
+
+# ==============================
+# Intents: جدول النوايا (بترتيب الأولوية)
+# ==============================
+# يُجمَّع في تعبير نمطي واحد (intent_router.py)؛ المعالجات في app.py تجيب من
+# البيانات المحلية دون KB أو OpenAI. لإضافة نية: سطر هنا + معالج في INTENT_HANDLERS.
+INTENT_TABLE = [
+    ("support", [
+        "خدمة العملاء", "خدمةالعملاء", "الدعم", "التواصل", "تواصل", "أتواصل", "نتواصل", "واتساب",
+        "whatsapp", "customer service", "support", "contact us", "contact",
+    ]),
+    ("urgent_needs", [
+        "احتياج عاجل", "الاحتياج العاجل", "احتياجات عاجلة", "الاحتياجات العاجلة",
+        "حاجة عاجلة للدم", "مطلوب دم", "urgent need", "urgent needs", "urgent blood",
+        "blood needed",
+    ]),
+    ("centers", [
+        "أقرب مركز", "أقرب بنك دم", "مراكز التبرع", "مركز تبرع", "بنوك الدم", "أين أتبرع",
+        "وين أتبرع", "أماكن التبرع", "nearest center", "donation center", "donation centers",
+        "where can i donate", "where to donate", "blood bank near",
+    ]),
+    ("campaigns", [
+        "حملات التبرع", "حملة تبرع", "حملات", "الحملات", "campaign", "campaigns",
+    ]),
+    ("eligibility", [
+        "هل أنا مؤهل", "هل انا مؤهلة", "هل يحق لي التبرع", "اختبار الأهلية", "فحص الأهلية",
+        "am i eligible", "eligibility test", "eligibility check",
+    ]),
+]
+
+# كلمات الربط والطلب: لا تُحسب عند التحقق من أن الرسالة عن النية نفسها لا سؤال محدد
+INTENT_STOPWORDS = [
+    "هل", "كيف", "أين", "وين", "ما", "ماذا", "متى", "ابي", "أبي", "ابغى", "أبغى", "أريد",
+    "ودي", "ممكن", "لو", "سمحت", "من", "في", "على", "عن", "مع", "إلى", "لي", "أنا", "انا",
+    "ايش", "شو", "عندكم", "معكم", "لكم", "يا", "الحين", "اليوم",
+    "i", "i'd", "id", "want", "would", "like", "to", "the", "a", "an", "how", "can", "could",
+    "do", "does", "is", "are", "me", "my", "you", "your", "please", "with", "for", "in", "of",
+    "what", "where", "when", "there", "any", "show", "tell", "us", "see", "need",
+]
+INTENT_MAX_EXTRA_TOKENS = 2
+
+INTENT_ROUTER = IntentRouter(
+    INTENT_TABLE, normalize_arabic, stopwords=INTENT_STOPWORDS, max_extra=INTENT_MAX_EXTRA_TOKENS
+)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+db.py - اتصالات SQLite طويلة العمر لكل خيط، مُهيّأة مرة واحدة.
+
+بدل sqlite3.connect() في كل طلب (PRAGMAs لا تُطبَّق إلا في init_db، ولا مهلة انتظار،
+وذاكرة الجمل المُجهّزة تضيع مع كل إغلاق):
+- writer(): اتصال كتابة لكل خيط (WAL، synchronous=NORMAL، busy_timeout، mmap_size،
+  cache_size). يبقى مفتوحاً فتُعاد الجمل المُجهّزة من ذاكرة الاتصال (cached_statements).
+- reader(): اتصال قراءة فقط منفصل لكل خيط (mode=ro)؛ مع WAL لا يحجب
+  الكاتبين ولا يحجبونه، فالإحصاءات والتصدير والبحث لا تؤخر حفظ السجلات.
+- الاتصالات مرتبطة بالعملية: بعد fork تُفتح اتصالات جديدة ولا يُمس الموروث.
+- close() / close_all() تغلق اتصالات العملية الحالية (عند خروج عامل gunicorn أو انتهاء السكربت).
+
+الاستخدام: الكتابة داخل "with conn:" (commit أو rollback) كما في sqlite3 مباشرة، ولا
+يُستدعى conn.close() على اتصال من هنا.
+"""
+
+import os, atexit, sqlite3, threading, weakref
+from urllib.request import pathname2url
+
+DEFAULT_TIMEOUT_S = 10.0
+DEFAULT_MMAP_MB = 64
+DEFAULT_CACHE_KB = 8192
+DEFAULT_STATEMENTS = 256
+
+_DATABASES = weakref.WeakSet()
+
+
+class _Slot:
+    """حامل اتصال خيط واحد (sqlite3.Connection لا يقبل weakref)."""
+
+    __slots__ = ("conn", "pid", "__weakref__")
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.pid = os.getpid()
+
+
+class Database:
+    def __init__(self, path: str, timeout_s: float = DEFAULT_TIMEOUT_S, autocommit: bool = False,
+                 mmap_mb: int = DEFAULT_MMAP_MB, cache_kb: int = DEFAULT_CACHE_KB,
+                 statements: int = DEFAULT_STATEMENTS):
+        """autocommit=True: isolation_level=None (المستدعي يدير BEGIN/COMMIT بنفسه)."""
+        self.path = path
+        self.timeout_s = timeout_s
+        self.autocommit = autocommit
+        self.mmap_mb = mmap_mb
+        self.cache_kb = cache_kb
+        self.statements = statements
+        self._local = threading.local()
+        self._slots = weakref.WeakSet()  # اتصالات كل الخيوط (للإغلاق عند الخروج)
+        self._lock = threading.Lock()
+        _DATABASES.add(self)
+
+    def _connect(self, readonly: bool):
+        target, uri = self.path, False
+        if readonly:
+            target, uri = f"file:{pathname2url(os.path.abspath(self.path))}?mode=ro", True
+        conn = sqlite3.connect(
+            target,
+            uri=uri,
+            timeout=self.timeout_s,
+            isolation_level=None if self.autocommit else "",
+            cached_statements=self.statements,
+            # كل اتصال يُستخدم من خيط واحد؛ الإغلاق فقط قد يأتي من خيط الخروج
+            check_same_thread=False,
+        )
+        conn.execute(f"PRAGMA busy_timeout={int(self.timeout_s * 1000)};")
+        conn.execute(f"PRAGMA mmap_size={self.mmap_mb * 1024 * 1024};")
+        conn.execute(f"PRAGMA cache_size=-{self.cache_kb};")
+        # mode=ro يكفي لمنع الكتابة؛ query_only كان سيمنع العروض المؤقتة أيضاً (logs_v)
+        if not readonly:
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("PRAGMA synchronous=NORMAL;")
+        return conn
+
+    def _get(self, kind: str):
+        slot = getattr(self._local, kind, None)
+        if slot is None or slot.conn is None or slot.pid != os.getpid():
+            slot = _Slot(self._connect(kind == "reader"))
+            setattr(self._local, kind, slot)
+            with self._lock:
+                self._slots.add(slot)
+        return slot.conn
+
+    def writer(self):
+        return self._get("writer")
+
+    def reader(self):
+        return self._get("reader")
+
+    def close(self):
+        """إغلاق اتصالات هذه العملية (الموروثة عبر fork تُترك لعمليتها)."""
+        pid = os.getpid()
+        with self._lock:
+            slots = list(self._slots)
+        for slot in slots:
+            conn = slot.conn
+            if conn is None or slot.pid != pid:
+                continue
+            slot.conn = None
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+
+def close_all():
+    for database in list(_DATABASES):
+        database.close()
+
+
+atexit.register(close_all)
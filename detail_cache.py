@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+detail_cache.py - النص الكامل للإجابات الملخّصة، لطلب "تفاصيل أكثر" دون إعادة الحساب.
+
+عند تلخيص إجابة (KB أو OpenAI) يُحفظ نصها الكامل هنا بمعرّف عشوائي (answer_id) يُرسل
+مع الرد؛ طلب التفاصيل بنفس المعرّف يرجع النص نفسه فوراً بدل إعادة البحث أو استدعاء
+OpenAI من جديد (وقد يرجع إجابة مختلفة عن الملخّص الأول).
+
+- ذاكرة LRU محدودة لكل عملية (الحالة الأغلب: التفاصيل تُطلب بعد ثوانٍ من نفس العامل).
+- نسخة في SQLite (WAL) مشتركة بين عمال gunicorn، لأن طلب التفاصيل قد يصل لعامل آخر.
+- لكل مدخل مدة صلاحية (ttl_s)؛ المنتهي لا يُرجع ويُحذف دورياً عند الكتابة.
+"""
+
+import json, time, sqlite3, secrets, threading
+from collections import OrderedDict
+
+PURGE_EVERY = 200
+
+
+class DetailCache:
+    def __init__(self, db=None, ttl_s: float = 1800.0, max_items: int = 2048):
+        """db: db.Database، أو None لذاكرة العملية فقط."""
+        self.db = db
+        self.ttl_s = ttl_s
+        self.max_items = max_items
+        self._items = OrderedDict()  # answer_id → (expires_at, entry)
+        self._lock = threading.Lock()
+        self._puts = 0
+        self.stats = {"hits": 0, "shared_hits": 0, "misses": 0}
+
+    # ---------- DB ----------
+    def init_db(self):
+        if not self.db:
+            return
+        conn = self.db.writer()
+        with conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS answer_details(
+                    id TEXT PRIMARY KEY,
+                    expires_at REAL NOT NULL,
+                    entry TEXT NOT NULL
+                ) WITHOUT ROWID
+                """
+            )
+
+    # ---------- الواجهة ----------
+    def put(self, answer: str, source_type: str, source_text: str) -> str:
+        """يحفظ النص الكامل ويرجع answer_id."""
+        answer_id = secrets.token_urlsafe(12)
+        entry = {"answer": answer, "source_type": source_type, "source_text": source_text}
+        expires_at = time.time() + self.ttl_s
+        with self._lock:
+            self._items[answer_id] = (expires_at, entry)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+            self._puts += 1
+            purge = self._puts % PURGE_EVERY == 0
+        if self.db:
+            try:
+                conn = self.db.writer()
+                with conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO answer_details(id, expires_at, entry) VALUES(?,?,?)",
+                        (answer_id, expires_at, json.dumps(entry, ensure_ascii=False)),
+                    )
+                    if purge:
+                        conn.execute("DELETE FROM answer_details WHERE expires_at < ?", (time.time(),))
+            except sqlite3.Error as e:
+                print("⚠️ detail cache:", e)  # يبقى المدخل في ذاكرة هذه العملية
+        return answer_id
+
+    def get(self, answer_id: str):
+        """{"answer", "source_type", "source_text"} أو None (غير موجود أو منتهٍ)."""
+        if not answer_id:
+            return None
+        now = time.time()
+        with self._lock:
+            item = self._items.get(answer_id)
+            if item is not None:
+                if item[0] >= now:
+                    self._items.move_to_end(answer_id)
+                    self.stats["hits"] += 1
+                    return item[1]
+                del self._items[answer_id]
+        entry = None
+        if self.db:
+            try:
+                row = self.db.reader().execute(
+                    "SELECT entry FROM answer_details WHERE id=? AND expires_at >= ?",
+                    (answer_id, now),
+                ).fetchone()
+                entry = json.loads(row[0]) if row else None
+            except sqlite3.Error as e:
+                print("⚠️ detail cache:", e)
+        with self._lock:
+            self.stats["shared_hits" if entry else "misses"] += 1
+        return entry
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""
+donor_match.py - مطابقة الاحتياجات العاجلة الجديدة مع المتبرعين المشتركين في التنبيهات.
+
+- المتبرع (صف في reminders) يختار اختيارياً فصيلته وموقعه ويوافق على التنبيهات؛
+  يُخزَّن الموقع مع مفتاح خلية الشبكة (geo_cell) نفسها المستخدمة في urgent_index.py.
+- عند ظهور احتياج جديد أو تغيّره (UrgentFeed.listeners) تعمل مهمة مطابقة في الخلفية:
+  استعلام واحد على الفهرس (notify_opt_in, blood_type, geo_cell, next_date) للفصائل
+  المتوافقة والخلايا ضمن نصف القطر، ثم فلترة المسافة الدقيقة في بايثون.
+- الاحتياج بلا موقع (لا lat/lng ولم يُعرف المستشفى في قائمة المراكز) لا يُطابَق: لا نعرف
+  من هو "قريب"، وتنبيه متبرعين في كل المدن إزعاج لا فائدة منه.
+- كل تطابق يُسجَّل في donor_notifications بقيد UNIQUE(reminder_id, need_key)، فلا يُنبَّه
+  المتبرع مرتين لنفس الاحتياج حتى لو اكتشف الفرق أكثر من عامل gunicorn؛ العامل الذي
+  أدرج الصف هو من يرسله، عبر دالة إرسال واحدة (اتصال بريد مُعاد استخدامه).
+- المتبرع نفسه قد يملك عدة صفوف في reminders (تذكير لكل تبرع)، فالتكرار وفترة التهدئة
+  يُحسبان على البريد المطبّع (lower/trim) لا على الصف.
+- الصفوف المنتهية (sent/failed) أقدم من need_ttl_days تُحذف: المصدر لا يعطي الاحتياج
+  معرّفاً ولا تاريخ نشر، فاحتياج جديد لنفس المستشفى والفصيلة بعد تلك المدة يُعامل كاحتياج
+  جديد (مع بقاء cooldown_days لكل متبرع).
+- التنبيه العالق في queued يُعاد إرساله حتى MAX_ATTEMPTS مرات ثم يُعلَّم failed.
+"""
+
+import os, time, threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from urgent_index import BLOOD_TYPES, geo_cell, geo_cells_within, haversine_km
+
+# توافق كريات الدم الحمراء/الدم الكامل: فصيلة المريض → فصائل المتبرعين المناسبة
+RED_CELL_DONORS = {
+    "O-": ("O-",),
+    "O+": ("O-", "O+"),
+    "A-": ("O-", "A-"),
+    "A+": ("O-", "O+", "A-", "A+"),
+    "B-": ("O-", "B-"),
+    "B+": ("O-", "O+", "B-", "B+"),
+    "AB-": ("O-", "A-", "B-", "AB-"),
+    "AB+": BLOOD_TYPES,
+}
+
+STALE_QUEUED_S = 600
+MAX_ATTEMPTS = 3
+
+
+def compatible_donors(blood_type: str, component: str):
+    """الصفائح والبلازما لها قواعد توافق مختلفة؛ نكتفي فيها بنفس الفصيلة."""
+    if component in ("whole_blood", "red_cells"):
+        return RED_CELL_DONORS.get(blood_type, ())
+    return (blood_type,) if blood_type in BLOOD_TYPES else ()
+
+
+def need_key(need: dict, blood_type: str) -> str:
+    return f"{need.get('hospital', '')}|{blood_type}"
+
+
+def email_key(email: str) -> str:
+    return (email or "").strip().lower()
+
+
+def has_location(need: dict) -> bool:
+    return need.get("lat") is not None and need.get("lng") is not None
+
+
+def migrate(conn):
+    """أعمدة المتبرع في reminders + جدول التنبيهات + الفهارس (آمن للتكرار)."""
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(reminders)")}
+    for name, decl in (
+        ("blood_type", "TEXT"),
+        ("lat", "REAL"),
+        ("lng", "REAL"),
+        ("geo_cell", "TEXT"),
+        ("notify_opt_in", "INTEGER DEFAULT 0"),
+        ("last_notified_at", "TEXT"),
+    ):
+        if name not in cols:
+            conn.execute(f"ALTER TABLE reminders ADD COLUMN {name} {decl}")
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_reminders_match
+        ON reminders(notify_opt_in, blood_type, geo_cell, next_date)
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS donor_notifications(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            reminder_id INTEGER NOT NULL,
+            need_key TEXT NOT NULL,
+            created_at REAL,
+            status TEXT,
+            sent_at REAL,
+            error TEXT,
+            attempts INTEGER DEFAULT 1,
+            UNIQUE(reminder_id, need_key)
+        )
+        """
+    )
+    ncols = {r[1] for r in conn.execute("PRAGMA table_info(donor_notifications)")}
+    if "attempts" not in ncols:
+        conn.execute("ALTER TABLE donor_notifications ADD COLUMN attempts INTEGER DEFAULT 1")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_donor_notifications_status ON donor_notifications(status, created_at)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_donor_notifications_need ON donor_notifications(need_key)"
+    )
+    conn.commit()
+
+
+def donor_location_fields(lat, lng):
+    """(lat, lng, geo_cell) أو (None, None, None) إن لم يكن الموقع صالحاً."""
+    try:
+        lat, lng = float(lat), float(lng)
+    except (TypeError, ValueError):
+        return None, None, None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None, None, None
+    return lat, lng, geo_cell(lat, lng)
+
+
+class DonorMatcher:
+    def __init__(self, db, send, render, radius_km: float = 30.0,
+                 cooldown_days: int = 7, max_per_need: int = 200, need_ttl_days: int = 14):
+        """
+        db: db.Database
+        send(to_email, subject, body) -> (ok, msg)
+        render(need, blood_type, user_hint) -> (subject, body)
+        """
+        self.db = db
+        self.send = send
+        self.render = render
+        self.radius_km = radius_km
+        self.cooldown_days = cooldown_days
+        self.max_per_need = max_per_need
+        self.need_ttl_days = need_ttl_days
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.stats = {"matched": 0, "queued": 0, "sent": 0, "failed": 0}
+
+    def _executor(self):
+        # خيط واحد لكل عملية: المطابقة والإرسال متسلسلان عبر نفس اتصال البريد
+        if self._pool is None or self._pid != os.getpid():
+            with self._lock:
+                if self._pool is None or self._pid != os.getpid():
+                    self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="donor-match")
+                    self._pid = os.getpid()
+        return self._pool
+
+    # ---------- المطابقة ----------
+    def match_need(self, need: dict, blood_type: str, conn=None, today: str = None, limit: int = None):
+        """
+        [(reminder_id, email, user_hint, distance_km)] للمتبرعين المؤهلين الآن، الأقرب أولاً،
+        صف واحد لكل بريد. الاحتياج بلا موقع يرجع [].
+        """
+        donors = compatible_donors(blood_type, need.get("component") or "whole_blood")
+        if not donors or not has_location(need):
+            return []
+        today = today or datetime.now().strftime("%Y-%m-%d")
+        cooldown = (datetime.now() - timedelta(days=self.cooldown_days)).strftime("%Y-%m-%d %H:%M:%S")
+
+        where = [
+            "notify_opt_in = 1",
+            f"blood_type IN ({','.join('?' * len(donors))})",
+            "next_date <= ?",
+            "email IS NOT NULL AND email != ''",
+            # التهدئة على البريد: صف آخر لنفس المتبرع نُبِّه مؤخراً يكفي للاستبعاد
+            """lower(trim(email)) NOT IN (
+                SELECT lower(trim(email)) FROM reminders
+                WHERE last_notified_at >= ? AND email IS NOT NULL
+            )""",
+        ]
+        params = list(donors) + [today, cooldown]
+        lat, lng = need["lat"], need["lng"]
+        cells = geo_cells_within(lat, lng, self.radius_km)
+        where.append(f"geo_cell IN ({','.join('?' * len(cells))})")
+        params.extend(cells)
+
+        rows = (conn or self.db.reader()).execute(
+            f"SELECT id, email, user_hint, lat, lng FROM reminders WHERE {' AND '.join(where)}",
+            params,
+        ).fetchall()
+
+        best = {}  # بريد مطبّع → أقرب صف له
+        for rid, email, hint, dlat, dlng in rows:
+            dist = haversine_km(lat, lng, dlat, dlng)
+            if dist > self.radius_km:
+                continue
+            key = email_key(email)
+            if key not in best or dist < best[key][3]:
+                best[key] = (rid, email, hint, dist)
+        out = sorted(best.values(), key=lambda r: r[3])
+        return out[: self.max_per_need if limit is None else limit]
+
+    def on_diff(self, diff: dict):
+        """مستمع UrgentFeed: لا يحجب خيط التحديث، المطابقة في الخلفية."""
+        needs = list(diff.get("added") or []) + list(diff.get("changed") or [])
+        needs = [n for n in needs if n.get("blood_types") and has_location(n)]
+        if needs:
+            self._executor().submit(self.process, needs)
+
+    def process(self, needs):
+        conn = self.db.writer()
+        try:
+            self._expire(conn)
+            jobs = self._queue_matches(conn, needs)
+            jobs.extend(self._claim_stale(conn))
+        except Exception as e:
+            print("⚠️ مطابقة المتبرعين:", e)
+            return
+        for job in jobs:
+            self._deliver(conn, *job)
+
+    def _expire(self, conn):
+        """حذف التنبيهات المنتهية القديمة: يسمح بتنبيه جديد لنفس المستشفى والفصيلة لاحقاً."""
+        cutoff = time.time() - self.need_ttl_days * 86400
+        with conn:
+            conn.execute(
+                "DELETE FROM donor_notifications WHERE status IN ('sent','failed') AND created_at < ?",
+                (cutoff,),
+            )
+
+    def _queue_matches(self, conn, needs):
+        now = time.time()
+        stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        jobs = []
+        with conn:
+            for need in needs:
+                for bt in need["blood_types"]:
+                    key = need_key(need, bt)
+                    # السقف لكل احتياج لا لكل تحديث: تغيّر الصف لا يوقظ دفعة جديدة من المتبرعين
+                    done = conn.execute(
+                        "SELECT COUNT(*) FROM donor_notifications WHERE need_key=?", (key,)
+                    ).fetchone()[0]
+                    if done >= self.max_per_need:
+                        continue
+                    # صف آخر لنفس البريد قد نُبِّه لهذا الاحتياج (UNIQUE على reminder_id لا يكفي)
+                    notified = {
+                        email_key(e)
+                        for (e,) in conn.execute(
+                            """
+                            SELECT r.email FROM donor_notifications n
+                            JOIN reminders r ON r.id = n.reminder_id WHERE n.need_key=?
+                            """,
+                            (key,),
+                        )
+                    }
+                    matches = self.match_need(need, bt, conn=conn)
+                    self.stats["matched"] += len(matches)
+                    for rid, email, hint, _ in matches:
+                        if done >= self.max_per_need:
+                            break
+                        if email_key(email) in notified:
+                            continue
+                        cur = conn.execute(
+                            """
+                            INSERT OR IGNORE INTO donor_notifications(reminder_id, need_key, created_at, status)
+                            VALUES(?,?,?,'queued')
+                            """,
+                            (rid, key, now),
+                        )
+                        if cur.rowcount != 1:
+                            continue  # سبق تنبيهه لهذا الاحتياج (أو أدرجه عامل آخر)
+                        conn.execute(
+                            "UPDATE reminders SET last_notified_at=? WHERE id=?", (stamp, rid)
+                        )
+                        notified.add(email_key(email))
+                        done += 1
+                        jobs.append((cur.lastrowid, email, hint, need, bt))
+        self.stats["queued"] += len(jobs)
+        if jobs:
+            print(f"✅ مطابقة الاحتياج العاجل: {len(jobs)} تنبيهاً في الطابور.")
+        return jobs
+
+    def _claim_stale(self, conn):
+        """
+        تنبيهات بقيت queued (توقف العامل قبل إرسالها): تُعاد إلى هذا العامل، وبعد
+        MAX_ATTEMPTS محاولة تُعلَّم failed بدل إعادتها كل مرة.
+        """
+        now = time.time()
+        cutoff = now - STALE_QUEUED_S
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                """
+                UPDATE donor_notifications SET status='failed', sent_at=?, error=?
+                WHERE status='queued' AND created_at < ? AND COALESCE(attempts, 1) >= ?
+                """,
+                (now, f"تُرك بعد {MAX_ATTEMPTS} محاولات", cutoff, MAX_ATTEMPTS),
+            )
+            rows = conn.execute(
+                """
+                SELECT n.id, r.email, r.user_hint, n.need_key FROM donor_notifications n
+                JOIN reminders r ON r.id = n.reminder_id
+                WHERE n.status='queued' AND n.created_at < ? LIMIT 500
+                """,
+                (cutoff,),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE donor_notifications SET created_at=?, attempts=COALESCE(attempts, 1) + 1 WHERE id=?",
+                [(now, r[0]) for r in rows],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        jobs = []
+        for nid, email, hint, key in rows:
+            hospital, _, bt = key.rpartition("|")
+            jobs.append((nid, email, hint, {"hospital": hospital}, bt))
+        return jobs
+
+    def _deliver(self, conn, notification_id, email, hint, need, blood_type):
+        try:
+            subject, body = self.render(need, blood_type, hint)
+            ok, msg = self.send(email, subject, body)
+        except Exception as e:
+            ok, msg = False, str(e)
+        with conn:
+            conn.execute(
+                "UPDATE donor_notifications SET status=?, sent_at=?, error=? WHERE id=?",
+                ("sent" if ok else "failed", time.time(), None if ok else msg, notification_id),
+            )
+        self.stats["sent" if ok else "failed"] += 1
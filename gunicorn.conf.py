@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# gunicorn.conf.py - إعدادات التشغيل في الإنتاج (Render)
+# تشغيل: gunicorn -c gunicorn.conf.py app:app
+#
+# preload_app: يُستورد app.py مرة واحدة في العملية الرئيسية (تحميل KB وبناء فهرسها،
+# ملفات langdetect، تهيئة DB) ثم يُعمل fork للعمال فتُشارك هذه البيانات (copy-on-write).
+# الموارد الخاصة بكل عامل (اتصالات DB، جلسات HTTP، عميل OpenAI) تُنشأ كسولاً بعد fork.
+
+import os
+
+preload_app = True
+# gthread افتراضياً؛ gevent يسمح بعدد كبير من اتصالات SSE الخاملة لكل عامل
+# (مع رفع URGENT_SSE_MAX_CLIENTS).
+worker_class = os.getenv("GUNICORN_WORKER_CLASS") or "gthread"
+workers = int(os.getenv("WEB_CONCURRENCY") or "2")
+threads = int(os.getenv("GUNICORN_THREADS") or "4")
+timeout = int(os.getenv("GUNICORN_TIMEOUT") or "120")
+
+
+def post_fork(server, worker):
+    from app import on_worker_fork
+
+    on_worker_fork()
+
+
+def pre_fork(server, worker):
+    # اتصالات SQLite التي فتحتها العملية الرئيسية أثناء preload (init_db، warm_up) لا تُورَّث
+    import db
+
+    db.close_all()
+
+
+def worker_exit(server, worker):
+    import db
+
+    db.close_all()
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+intent_router.py - موجّه نوايا مبني من جدول بيانات ومُجمّع في تعبير نمطي واحد.
+
+الجدول: [(intent, [كلمات مفتاحية...]), ...] بترتيب الأولوية. كل الكلمات تُطبَّع بنفس
+دالة تطبيع النص (عربي + casefold للإنجليزي) وتُجمع في alternation واحد مرتب من
+الأطول للأقصر، فيكفي مرور واحد على النص لمعرفة كل النوايا المطابقة؛ وعند تعدد
+المطابقات تُختار النية الأعلى أولوية.
+
+- المطابقة على كلمات كاملة فقط: الإنجليزية بحدود الكلمة، والعربية تسمح بالسوابق
+  الملتصقة (و، ف، ب، ل، ك، ال) قبل الكلمة ولا شيء بعدها ("تواصل" لا تطابق "التواصلية").
+- الرسالة يجب أن تكون عن النية نفسها: بعد حذف الكلمات المطابقة وكلمات الربط
+  (stopwords) لا يبقى أكثر من max_extra كلمة. "هل يحق لي التبرع وأنا آخذ مضاد حيوي"
+  سؤال محدد وليس طلب فحص أهلية عام، فلا يُوجَّه.
+"""
+
+import re
+
+_PROCLITIC = r"(?:[وف]?(?:[بلك]|ال|بال|لل|كال)?)"
+
+
+class IntentRouter:
+    def __init__(self, table, normalize, stopwords=(), max_extra: int = 2):
+        self.normalize = normalize
+        self.max_extra = max_extra
+        self._stop = {self._norm(w) for w in stopwords}
+        self._intent_of = {}
+        self._priority = {}
+        alts = []
+        for prio, (name, keywords) in enumerate(table):
+            self._priority.setdefault(name, prio)
+            for kw in keywords:
+                k = self._norm(kw)
+                if not k or k in self._intent_of:
+                    continue
+                self._intent_of[k] = name
+                alts.append(k)
+        alts.sort(key=len, reverse=True)
+        ar = "|".join(re.escape(k) for k in alts if not k.isascii())
+        en = "|".join(re.escape(k) for k in alts if k.isascii())
+        # المجموعتان ar/en هما الكلمة المفتاحية بلا السوابق (مفتاح _intent_of)
+        branches = []
+        if ar:
+            branches.append(r"(?<!\w)%s(?P<ar>%s)(?!\w)" % (_PROCLITIC, ar))
+        if en:
+            branches.append(r"\b(?P<en>%s)\b" % en)
+        self._re = re.compile("|".join(branches)) if branches else None
+
+    def _norm(self, text: str) -> str:
+        return self.normalize(text or "").casefold()
+
+    @property
+    def intents(self):
+        return sorted(self._priority, key=self._priority.get)
+
+    def _is_stop(self, tok: str) -> bool:
+        return tok in self._stop or (tok[:1] in ("و", "ف") and tok[1:] in self._stop)
+
+    def match(self, text: str):
+        """ترجع اسم النية الأعلى أولوية المطابقة للنص، أو None."""
+        if not text or self._re is None:
+            return None
+        norm = self._norm(text)
+        best, spans = None, []
+        for m in self._re.finditer(norm):
+            spans.append(m.span())
+            name = self._intent_of[m.group(m.lastgroup)]
+            if best is None or self._priority[name] < self._priority[best]:
+                best = name
+        if best is None:
+            return None
+        parts, last = [], 0
+        for a, b in spans:
+            parts.append(norm[last:a])
+            last = b
+        parts.append(norm[last:])
+        rest = " ".join(parts)
+        extra = [t for t in re.findall(r"\w+", rest) if not self._is_stop(t)]
+        return best if len(extra) <= self.max_extra else None
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+kb_build.py - خطوات بناء القاعدة المعرفية (تُشغَّل offline قبل النشر).
+
+الأوامر:
+    python kb_build.py i18n [--force]
+        يبني knowledge_base.i18n.json: لكل إجابة في knowledge_base.json نسخة
+        عربية وإنجليزية، كاملة وملخّصة، وترجمة إنجليزية لأسئلتها (en.questions)
+        يُبنى منها فهرس البحث الإنجليزي. لا تُعاد ترجمة إلا الإجابات التي تغيّر نصها
+        (المفتاح = بصمة نص الإجابة)، ولا الأسئلة إلا إن تغيّرت قائمتها (questions_key).
+        يحتاج خلفية LLM (LLM_BACKEND / OPENAI_API_KEY).
+
+    python kb_build.py validate [--threshold 0.8] [--strict] [--out report.json]
+        يفحص الأسئلة المكررة، والسؤال نفسه بإجابات مختلفة (خطأ)، والأسئلة المتقاربة
+        بإجابات مختلفة (تحذير؛ خطأ مع --strict). ≈14 ث لكل 100k سؤال؛ انظر kb_validate.py.
+
+    python kb_build.py compile [--skip-validate]
+        يجمّع knowledge_base.json إلى knowledge_base.kbc (صيغة ثنائية تُفتح بـ mmap
+        ويشاركها كل العمال). انظر kb_store.py. يفشل إن وجد validate أخطاء.
+
+الناتج يُحمَّل عند بدء التطبيق فتُخدم إجابات KB بالإنجليزية دون أي اتصال شبكي.
+يُفضّل إضافة الملف الناتج إلى المستودع بعد بنائه.
+"""
+
+import os, sys, json, time, argparse
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+from kb_store import compile_kb, file_digest, open_compiled, write_compiled
+from text_norm import normalize_arabic
+from kb_validate import DEFAULT_THRESHOLD, print_report, validate_entries
+
+from llm_backends import make_backend
+from chat_core import (
+    KB_COMPILED_PATH,
+    KB_PATH,
+    KB_I18N_PATH,
+    KB_I18N_VERSION,
+    KB_SUMMARY_LEN,
+    kb_answer_key,
+    load_knowledge_base,
+    strip_llm_label,
+    summarize_and_simplify,
+    translation_prompt,
+)
+
+
+def _read_entries(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _read_artifact(path: str):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") == KB_I18N_VERSION:
+            return data.get("answers") or {}
+    except Exception as e:
+        print("⚠️ تعذّر قراءة الملف السابق:", e)
+    return {}
+
+
+def _write_json(path: str, data):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+    os.replace(tmp, path)
+
+
+def make_translator():
+    """خلفية LLM من متغيرات البيئة (نفس إعداد app.py)، أو None."""
+    load_dotenv(override=True)
+    kind = (os.getenv("LLM_BACKEND") or "openai").strip().lower()
+    api_key = (os.getenv("OPENAI_API_KEY") or "").strip().strip('"').strip("'")
+    model = (os.getenv("OPENAI_MODEL") or "gpt-4o-mini").strip()
+    try:
+        return make_backend(kind, api_key=api_key, model=model)
+    except Exception as e:
+        print(f"⚠️ فشل تهيئة خلفية LLM ({kind}): {e}")
+        return None
+
+
+def translate(llm, text: str, target_language_code: str = "en") -> str:
+    """ترجمة نص واحد؛ ترجع النص نفسه عند الفشل (فيُعامل كترجمة فاشلة)."""
+    try:
+        prompt = translation_prompt(text, target_language_code)
+        reply = llm.complete([{"role": "user", "content": prompt}], max_tokens=256)
+        return strip_llm_label(reply.text)
+    except Exception as e:
+        print("⚠️ ترجمة:", e)
+        return text
+
+
+def translate_questions(llm, questions):
+    """ترجمة أسئلة الإجابة الواحدة للإنجليزية (بلا تكرار)؛ None إن فشلت كلها."""
+    out, seen = [], set()
+    for q in questions:
+        en = (translate(llm, q, "en") or "").strip()
+        if not en or en == q:
+            continue
+        k = " ".join(en.casefold().split())
+        if k not in seen:
+            seen.add(k)
+            out.append(en)
+    return out or None
+
+
+def build_i18n(kb_path: str, out_path: str, force: bool = False, llm=None) -> int:
+    llm = llm or make_translator()
+    if not llm:
+        print("❌ لا توجد خلفية LLM للترجمة (LLM_BACKEND / OPENAI_API_KEY).")
+        return 2
+
+    old = {} if force else _read_artifact(out_path)
+    answers = {}
+    built = reused = failed = 0
+
+    # الإجابة نفسها قد تتكرر في أكثر من مدخل: أسئلتها تُجمع تحت مفتاح واحد
+    grouped = {}
+    for entry in _read_entries(kb_path):
+        ar_full = entry.get("answer", "")
+        if not ar_full:
+            continue
+        qs = grouped.setdefault(kb_answer_key(ar_full), (ar_full, []))[1]
+        qs.extend(q for q in entry.get("questions", []) if q and q not in qs)
+
+    for key, (ar_full, questions) in grouped.items():
+        q_key = kb_answer_key("\n".join(questions))
+        prev = old.get(key)
+        if prev and prev.get("questions_key") == q_key:
+            answers[key] = prev
+            reused += 1
+            continue
+
+        if prev:
+            item = {"ar": prev["ar"], "en": dict(prev["en"])}
+        else:
+            en_full = translate(llm, ar_full, "en")
+            if not en_full or en_full == ar_full:
+                # فشلت الترجمة: لا نخزّن نصاً عربياً على أنه إنجليزي، وستُعاد المحاولة لاحقاً
+                print(f"⚠️ فشلت ترجمة الإجابة {key}")
+                failed += 1
+                continue
+            item = {
+                "ar": {
+                    "full": ar_full,
+                    "summary": summarize_and_simplify(ar_full, KB_SUMMARY_LEN, "ar"),
+                },
+                "en": {
+                    "full": en_full,
+                    "summary": summarize_and_simplify(en_full, KB_SUMMARY_LEN, "en"),
+                },
+            }
+
+        en_questions = translate_questions(llm, questions)
+        if en_questions:
+            item["en"]["questions"] = en_questions
+            item["questions_key"] = q_key
+        else:
+            # الإجابة صالحة بدون فهرس أسئلة؛ بلا questions_key تُعاد المحاولة في البناء التالي
+            print(f"⚠️ فشلت ترجمة أسئلة الإجابة {key}")
+            item["en"].pop("questions", None)
+            failed += 1
+        answers[key] = item
+        built += 1
+
+    _write_json(
+        out_path,
+        {
+            "version": KB_I18N_VERSION,
+            "built_at": datetime.utcnow().isoformat() + "Z",
+            "answers": answers,
+        },
+    )
+    print(
+        f"✅ {out_path}: {built} مبنية، {reused} دون تغيير، {failed} فاشلة، "
+        f"{len(old) - reused if old else 0} محذوفة."
+    )
+    return 1 if failed else 0
+
+
+def validate_kb(kb_path: str, threshold: float = DEFAULT_THRESHOLD, strict: bool = False,
+                out_path: str = None) -> int:
+    if not os.path.exists(kb_path):
+        print(f"❌ الملف غير موجود: {kb_path}")
+        return 2
+    t0 = time.perf_counter()
+    rep = validate_entries(_read_entries(kb_path), normalize_arabic, threshold)
+    rep["elapsed_s"] = round(time.perf_counter() - t0, 2)
+    if strict:
+        rep["errors"] += [w for w in rep["warnings"] if w["type"] == "ambiguous"]
+        rep["warnings"] = [w for w in rep["warnings"] if w["type"] != "ambiguous"]
+    print_report(rep)
+    if out_path:
+        _write_json(out_path, rep)
+    if rep["errors"]:
+        print(f"❌ {len(rep['errors'])} خطأ في {kb_path} ({rep['elapsed_s']} ث).")
+        return 1
+    print(f"✅ {kb_path} صالح ({rep['elapsed_s']} ث).")
+    return 0
+
+
+def build_compiled(kb_path: str, out_path: str, validate: bool = True) -> int:
+    if not os.path.exists(kb_path):
+        print(f"❌ الملف غير موجود: {kb_path}")
+        return 2
+    if validate and validate_kb(kb_path) != 0:
+        print("❌ لم يُجمَّع الملف؛ أصلح الأخطاء أو استخدم --skip-validate.")
+        return 1
+    data = compile_kb(load_knowledge_base(kb_path), normalize_arabic, file_digest(kb_path))
+    write_compiled(out_path, data)
+    kb = open_compiled(out_path)
+    print(
+        f"✅ {out_path}: {len(kb)} سؤالاً، {kb.n_answers} إجابة، "
+        f"{kb.n_sources} مصدراً، {len(data)} بايت."
+    )
+    return 0
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="أدوات بناء القاعدة المعرفية")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("i18n", help="بناء النسخ العربية/الإنجليزية الكاملة والملخّصة")
+    p.add_argument("--kb", default=KB_PATH)
+    p.add_argument("--out", default=KB_I18N_PATH)
+    p.add_argument("--force", action="store_true", help="إعادة بناء كل الإجابات")
+
+    p = sub.add_parser("validate", help="فحص التكرارات والتعارضات والأسئلة المتقاربة")
+    p.add_argument("--kb", default=KB_PATH)
+    p.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    p.add_argument("--strict", action="store_true", help="الأسئلة المتقاربة بإجابات مختلفة أخطاء")
+    p.add_argument("--out", help="حفظ التقرير كاملاً بصيغة JSON")
+
+    p = sub.add_parser("compile", help="تجميع القاعدة إلى الصيغة الثنائية (mmap)")
+    p.add_argument("--kb", default=KB_PATH)
+    p.add_argument("--out", default=KB_COMPILED_PATH)
+    p.add_argument("--skip-validate", action="store_true")
+
+    args = ap.parse_args(argv)
+    if args.cmd == "i18n":
+        return build_i18n(args.kb, args.out, force=args.force)
+    if args.cmd == "validate":
+        return validate_kb(args.kb, args.threshold, args.strict, args.out)
+    if args.cmd == "compile":
+        return build_compiled(args.kb, args.out, validate=not args.skip_validate)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+kb_store.py - صيغة مضغوطة ثنائية للقاعدة المعرفية تُقرأ عبر mmap.
+
+بدل أن يبني كل عامل gunicorn قاموساً كاملاً من knowledge_base.json، يُجمَّع الملف
+مرة واحدة (python kb_build.py compile) إلى knowledge_base.kbc، ويعمل كل عامل mmap
+للملف نفسه بوضع القراءة فقط؛ الصفحات تُشارك عبر page cache ويبقى استهلاك الذاكرة
+لكل عامل ثابتاً تقريباً مع نمو القاعدة، وزمن التحميل شبه صفري.
+
+الصيغة (little-endian، كل الأعداد uint32):
+    header : magic "ZKB1", version, n_questions, n_answers, n_sources, blob_offset,
+             source_digest (sha1 لملف JSON المصدر، 20 بايت)
+    questions[n_questions] : q_off, q_len, norm_off, norm_len, answer_id, source_id
+    answers[n_answers]     : off, len
+    sources[n_sources]     : off, len
+    blob                   : نصوص UTF-8 (كل نص مكرر يُخزَّن مرة واحدة)
+"""
+
+import os, sys, mmap, struct, hashlib, operator
+from array import array
+
+MAGIC = b"ZKB1"
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct("<4sIIIII20s")
+_QREC = 6  # عدد حقول uint32 في سجل السؤال
+_SREC = 2
+
+
+class KBFormatError(ValueError):
+    """ملف KB مجمّع غير صالح أو بإصدار مختلف."""
+
+
+def _u32(values) -> bytes:
+    arr = array("I", values)
+    if arr.itemsize != 4:
+        arr = array("L", values)
+    if sys.byteorder != "little":
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def file_digest(path: str) -> bytes:
+    """بصمة sha1 لملف المصدر (للتأكد من أن النسخة المجمّعة مطابقة له)."""
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.digest()
+
+
+def compile_kb(kb: dict, normalize, source_digest: bytes = b"") -> bytes:
+    """
+    تجميع قاموس {سؤال: {"answer", "source"}} إلى الصيغة الثنائية.
+    الإجابات والمصادر والنصوص المكررة تُخزَّن مرة واحدة (interning).
+    """
+    blob = bytearray()
+    interned = {}
+
+    def intern(text: str):
+        ref = interned.get(text)
+        if ref is None:
+            data = text.encode("utf-8")
+            ref = (len(blob), len(data))
+            blob.extend(data)
+            interned[text] = ref
+        return ref
+
+    answer_ids, source_ids = {}, {}
+    answers, sources, qtable = [], [], []
+
+    for question, item in kb.items():
+        answer = item.get("answer", "") or ""
+        source = item.get("source", "") or ""
+        if answer not in answer_ids:
+            answer_ids[answer] = len(answers) // _SREC
+            answers.extend(intern(answer))
+        if source not in source_ids:
+            source_ids[source] = len(sources) // _SREC
+            sources.extend(intern(source))
+        qtable.extend(intern(question))
+        qtable.extend(intern(normalize(question)))
+        qtable.append(answer_ids[answer])
+        qtable.append(source_ids[source])
+
+    nq = len(qtable) // _QREC
+    na = len(answers) // _SREC
+    ns = len(sources) // _SREC
+    blob_off = _HEADER.size + 4 * (len(qtable) + len(answers) + len(sources))
+
+    return b"".join(
+        [
+            _HEADER.pack(MAGIC, FORMAT_VERSION, nq, na, ns, blob_off, source_digest),
+            _u32(qtable),
+            _u32(answers),
+            _u32(sources),
+            bytes(blob),
+        ]
+    )
+
+
+def write_compiled(path: str, data: bytes):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    # os.replace ذري: العمال الذين عملوا mmap للنسخة القديمة يحتفظون بها حتى إعادة التشغيل
+    os.replace(tmp, path)
+
+
+class CompiledKB:
+    """قارئ للصيغة الثنائية فوق أي buffer (mmap أو bytes)."""
+
+    def __init__(self, buf, path: str = None):
+        mv = memoryview(buf)
+        if len(mv) < _HEADER.size:
+            raise KBFormatError("ملف قصير")
+        magic, version, nq, na, ns, blob_off, digest = _HEADER.unpack_from(mv, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise KBFormatError(f"magic/version غير متوافق: {magic!r} v{version}")
+        if sys.byteorder != "little":
+            raise KBFormatError("المنصة big-endian غير مدعومة للقراءة المباشرة")
+
+        q0 = _HEADER.size
+        a0 = q0 + 4 * _QREC * nq
+        s0 = a0 + 4 * _SREC * na
+        if s0 + 4 * _SREC * ns != blob_off or blob_off > len(mv):
+            raise KBFormatError("جداول تالفة")
+
+        self.path = path
+        self.source_digest = digest
+        self._buf = buf
+        self._n = nq
+        self._q = mv[q0:a0].cast("I")
+        self._a = mv[a0:s0].cast("I")
+        self._s = mv[s0:blob_off].cast("I")
+        self._blob = mv[blob_off:]
+        self.n_answers = na
+        self.n_sources = ns
+        self._choices = None
+        self._check_refs()
+
+    def _check_refs(self):
+        """ملف مقطوع أو تالف: كل مرجع (إزاحة + طول) يجب أن يقع داخل blob، وكل answer_id/source_id صالح."""
+        q = self._q
+        ends = [0]
+        for table, step in ((q, _QREC), (self._a, _SREC), (self._s, _SREC)):
+            if len(table):
+                ends.append(max(map(operator.add, table[0::step], table[1::step])))
+        if len(q):
+            ends.append(max(map(operator.add, q[2::_QREC], q[3::_QREC])))
+            if max(q[4::_QREC]) >= self.n_answers or max(q[5::_QREC]) >= self.n_sources:
+                raise KBFormatError("مرجع إجابة/مصدر خارج الجدول")
+        if max(ends) > len(self._blob):
+            raise KBFormatError("blob مقطوع")
+
+    def __len__(self):
+        return self._n
+
+    def _str(self, off: int, ln: int) -> str:
+        return str(self._blob[off : off + ln], "utf-8")
+
+    def question(self, i: int) -> str:
+        b = i * _QREC
+        return self._str(self._q[b], self._q[b + 1])
+
+    def normalized(self, i: int) -> str:
+        b = i * _QREC
+        return self._str(self._q[b + 2], self._q[b + 3])
+
+    def answer(self, i: int) -> str:
+        a = self._q[i * _QREC + 4] * _SREC
+        return self._str(self._a[a], self._a[a + 1])
+
+    def source(self, i: int) -> str:
+        s = self._q[i * _QREC + 5] * _SREC
+        return self._str(self._s[s], self._s[s + 1])
+
+    def entry(self, i: int) -> dict:
+        return {"answer": self.answer(i), "source": self.source(i)}
+
+    def normalized_items(self) -> dict:
+        """
+        {index: normalized} لـ fuzzywuzzy.process — يُفك من الملف مرة واحدة لكل عملية
+        ويُعاد استخدامه (فك كل النصوص في كل طلب كان أغلب زمن البحث). للقراءة فقط.
+        """
+        choices = self._choices
+        if choices is None:
+            choices = self._choices = {i: self.normalized(i) for i in range(self._n)}
+        return choices
+
+
+def open_compiled(path: str) -> CompiledKB:
+    """mmap للملف بوضع القراءة فقط (يُشارك بين كل العمليات التي تفتحه)."""
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return CompiledKB(mm, path=path)
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+kb_validate.py - فحص knowledge_base.json قبل التجميع: التكرارات والتعارضات والأسئلة المتقاربة.
+
+الأسئلة تُطبَّع (normalize_arabic + casefold) ثم:
+- تكرار حرفي/بعد التطبيع لنفس الإجابة            → تحذير (duplicate)
+- نفس السؤال المطبّع بإجابات مختلفة               → خطأ (conflict): load_knowledge_base
+  يحتفظ بآخر مدخل فقط، فالنتيجة تعتمد على ترتيب الملف.
+- أسئلة متقاربة (Jaccard على 3-grams حرفية ≥ العتبة) بإجابات مختلفة → تحذير (ambiguous):
+  البحث بالتقريب قد يرجع أيّاً منها حسب صياغة المستخدم.
+
+الربط بين كل الأزواج (similarity join) بـ prefix filtering (PPJoin): لكل سؤال تُرتَّب
+الـ 3-grams من الأندر للأشيع، وأي زوج تشابهه ≥ t لا بد أن يشترك في gram من أول
+|x| - ⌈t·|x|⌉ + 1 منها. مع فلتري الطول والموضع لا يُقارن فعلياً إلا عدد صغير من المرشحين.
+
+الكلفة المقاسة (بايثون خالص، t=0.8): ≈14 ث لكل 100k سؤال فريد (~36 gram للسؤال)؛ نحو ثلثها
+بناء الـ grams وترتيبها، والباقي المرور على قوائم الفهرس (~4.2M) والتحقق بتقاطع المجموعات
+(~1.15M مرشح لـ 7.9k زوج). إلغاء فلتر الموضع لصالح مجموعة مرشحين تُبنى في C كان أبطأ (~20 ث)
+لأن التحقق يتضاعف. الزمن يكبر تقريباً خطياً مع عدد المرشحين لا مع مربع عدد الأسئلة.
+"""
+
+import math
+from collections import Counter
+from itertools import chain
+
+GRAM = 3
+DEFAULT_THRESHOLD = 0.8
+MAX_REPORTED = 50
+# هامش لأخطاء الفاصلة العائمة: 0.8 * 35 = 28.000000000000004 وليس 28
+EPS = 1e-9
+
+
+def grams(text: str):
+    t = f" {text} "
+    if len(t) <= GRAM:
+        return {t}
+    return {t[i : i + GRAM] for i in range(len(t) - GRAM + 1)}
+
+
+def _ceil(v: float) -> int:
+    return math.ceil(v - EPS)
+
+
+def similarity_join(texts, threshold: float = DEFAULT_THRESHOLD):
+    """
+    كل الأزواج (i, j, jaccard) حيث i < j وتشابه مجموعات 3-grams ≥ threshold.
+    texts يجب أن تكون فريدة (التكرار الحرفي يُعالج قبلها).
+    """
+    sets = [grams(t) for t in texts]  # مجموعات نصية: تبقى للتحقق (hash كل gram محسوب مسبقاً)
+    df = Counter(chain.from_iterable(sets))
+    # ترتيب عالمي ثابت: الأندر أولاً ⇒ قوائم الفهرس للبادئات قصيرة. البادئات تُبنى من رتب
+    # الـ grams (أعداد صحيحة: الفهرسة والمقارنة أسرع من النصوص)
+    rank = {g: r for r, (g, _) in enumerate(sorted(df.items(), key=lambda kv: (kv[1], kv[0])))}
+    ordered = [sorted(map(rank.__getitem__, s)) for s in sets]
+    sizes = [len(o) for o in ordered]
+
+    order = sorted(range(len(texts)), key=sizes.__getitem__)
+    index = {}  # rank → [(y, |y|-j-1, ratio·|y|, |y|)] مرتبة تصاعدياً بالحجم
+    start = {}  # أول موضع صالح في كل قائمة (الأقصر من t·|x| لن يصلح لأي x لاحق)
+    pairs = []
+    ratio = threshold / (1 + threshold)
+    idx_ratio = 2 * ratio
+    for x in order:
+        nx = sizes[x]
+        min_len = threshold * nx - EPS  # فلتر الطول: y (الأقصر أو المساوي) يجب ألا يقل عن t·|x|
+        ox = ordered[x]
+        # الحد الأدنى للتقاطع ratio·(|x|+|y|): جزء x محسوب هنا وجزء y مخزّن في الفهرس
+        need_x = ratio * nx - EPS
+        overlap = {}
+        get = overlap.get
+        for i, g in enumerate(ox[: nx - _ceil(threshold * nx) + 1]):
+            plist = index.get(g)
+            if not plist:
+                continue
+            k = start.get(g, 0)
+            while k < len(plist) and plist[k][3] < min_len:
+                k += 1
+            start[g] = k
+            rest_x = nx - i - 1
+            for y, rest_y, need_y, _ in plist[k:]:
+                seen = get(y, 0)
+                if seen < 0:
+                    continue
+                # فلتر الموضع (PPJoin): ما بقي بعد i و j لا يكفي للوصول إلى الحد الأدنى للتقاطع
+                rest = rest_x if rest_x < rest_y else rest_y
+                overlap[y] = seen + 1 if seen + 1 + rest >= need_x + need_y else -1
+        sx = sets[x]
+        for y, seen in overlap.items():
+            if seen <= 0:
+                continue
+            inter = len(sx & sets[y])
+            sim = inter / (nx + sizes[y] - inter)
+            if sim >= threshold:
+                pairs.append((min(x, y), max(x, y), sim))
+        # بادئة الفهرسة أقصر من بادئة البحث (كل y لاحق أطول أو مساوٍ لـ x)
+        need = ratio * nx
+        for j, g in enumerate(ox[: nx - _ceil(idx_ratio * nx) + 1]):
+            index.setdefault(g, []).append((x, nx - j - 1, need, nx))
+    return pairs
+
+
+def validate_entries(entries, normalize, threshold: float = DEFAULT_THRESHOLD):
+    """
+    entries: قائمة مدخلات knowledge_base.json ({"questions": [...], "answer": ...}).
+    ترجع تقريراً: errors / warnings (قوائم) + counts.
+    """
+    errors, warnings = [], []
+
+    # سؤال مطبّع → [(entry_index, raw_question, answer)]
+    by_norm = {}
+    n_questions = 0
+    for ei, entry in enumerate(entries):
+        answer = (entry.get("answer") or "").strip()
+        if not answer:
+            errors.append({"type": "empty_answer", "entry": ei})
+        seen_in_entry = set()
+        for q in entry.get("questions") or []:
+            n_questions += 1
+            norm = " ".join(normalize(q or "").casefold().split())
+            if not norm:
+                errors.append({"type": "empty_question", "entry": ei})
+                continue
+            if norm in seen_in_entry:
+                warnings.append({"type": "duplicate", "entry": ei, "question": q})
+                continue
+            seen_in_entry.add(norm)
+            by_norm.setdefault(norm, []).append((ei, q, answer))
+
+    for norm, refs in by_norm.items():
+        if len(refs) < 2:
+            continue
+        answers = {a for _, _, a in refs}
+        item = {
+            "question": refs[0][1],
+            "entries": [ei for ei, _, _ in refs],
+            "variants": sorted({q for _, q, _ in refs}),
+        }
+        if len(answers) > 1:
+            errors.append(dict(item, type="conflict"))
+        else:
+            warnings.append(dict(item, type="duplicate"))
+
+    norms = list(by_norm)
+    pairs = similarity_join(norms, threshold)
+    for i, j, sim in pairs:
+        ri, rj = by_norm[norms[i]][0], by_norm[norms[j]][0]
+        if ri[2] != rj[2]:
+            warnings.append(
+                {
+                    "type": "ambiguous",
+                    "similarity": round(sim, 3),
+                    "questions": [ri[1], rj[1]],
+                    "entries": [ri[0], rj[0]],
+                }
+            )
+
+    counts = Counter(w["type"] for w in warnings + errors)
+    return {
+        "entries": len(entries),
+        "questions": n_questions,
+        "unique_normalized": len(norms),
+        "similar_pairs": len(pairs),
+        "threshold": threshold,
+        "counts": dict(counts),
+        "errors": errors,
+        "warnings": warnings,
+    }
+
+
+def print_report(rep: dict, limit: int = MAX_REPORTED):
+    print(
+        f"ℹ️ {rep['entries']} مدخلاً، {rep['questions']} سؤالاً "
+        f"({rep['unique_normalized']} فريداً بعد التطبيع)، "
+        f"{rep['similar_pairs']} زوجاً متقارباً (≥ {rep['threshold']})."
+    )
+    for label, items in (("❌ خطأ", rep["errors"]), ("⚠️ تحذير", rep["warnings"])):
+        for it in items[:limit]:
+            detail = {k: v for k, v in it.items() if k != "type"}
+            print(f"{label} [{it['type']}] {detail}")
+        if len(items) > limit:
+            print(f"{label}: و{len(items) - limit} أخرى (انظر --out).")
+    print(f"المجموع: {rep['counts'] or 'لا مشاكل'}")
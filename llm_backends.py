@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+llm_backends.py - طبقة موحّدة لمزوّدي نماذج اللغة (LLM) في زمرة.
+
+الخلفيات المتاحة (تُختار عبر LLM_BACKEND):
+- openai : الاتصال الحقيقي بـ OpenAI (الافتراضي عند توفر المفتاح).
+- stub   : خلفية محلية حتمية بدون شبكة، مع زمن استجابة ونسبة أخطاء وعدد توكنات قابلة للضبط
+           (لاختبارات الحمل وتقدير عدد العمال/الخيوط دون استهلاك رصيد الـ API).
+           كل استدعاء يسحب من التوزيع من جديد (البذرة + رقم الاستدعاء)، فتكرار السؤال نفسه
+           لا يعطي الزمن نفسه دائماً؛ LLM_STUB_KEYED=1 يربط النتيجة بنص الطلب لإعادة مطابقة.
+- record : يمرّر الطلبات إلى OpenAI ويسجّل كل طلب/رد في ملف JSONL.
+- replay : يعيد الردود المسجلة من ملف JSONL (مع إمكانية إعادة نفس زمن الاستجابة).
+- none   : بدون ذكاء اصطناعي (وضع KB فقط).
+
+صيغة توزيع الزمن (بالمللي ثانية) في LLM_STUB_LATENCY_MS:
+    "300"                → ثابت
+    "fixed:300"          → ثابت
+    "uniform:100,900"    → منتظم
+    "normal:400,120"     → طبيعي (متوسط، انحراف)
+    "lognormal:6.0,0.5"  → لوغاريتمي طبيعي (mu, sigma لـ ln(ms))
+    "pareto:200,1.5"     → باريتو (حد أدنى، alpha) لذيل طويل
+"""
+
+import os, json, time, random, hashlib, itertools, threading
+from abc import ABC, abstractmethod
+from collections import namedtuple
+
+LLMReply = namedtuple(
+    "LLMReply", ["text", "prompt_tokens", "completion_tokens", "latency_ms"]
+)
+
+
+class LLMError(RuntimeError):
+    """خطأ من خلفية الـ LLM (حقيقي أو محاكى)."""
+
+
+def _env(name: str, default: str = "") -> str:
+    return (os.getenv(name) or default).strip()
+
+
+def _request_key(messages, max_tokens, temperature) -> str:
+    """مفتاح ثابت للطلب (يُستخدم للتسجيل/الإعادة ولبذرة الخلفية المحلية)."""
+    raw = json.dumps(
+        {"m": messages, "t": max_tokens, "T": temperature},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _approx_tokens(messages) -> int:
+    """تقدير تقريبي لعدد التوكنات (≈ 4 أحرف لكل توكن)."""
+    chars = sum(len(m.get("content") or "") for m in messages or [])
+    return max(1, chars // 4)
+
+
+def parse_distribution(spec: str, default: float = 0.0):
+    """
+    تحويل وصف توزيع نصي إلى دالة sampler(rng) -> float.
+    ترفع ValueError عند صيغة غير معروفة.
+    """
+    spec = (spec or "").strip().lower()
+    if not spec:
+        return lambda rng: float(default)
+
+    kind, _, args = spec.partition(":")
+    if not args:
+        # رقم مجرد = قيمة ثابتة
+        value = float(kind)
+        return lambda rng: value
+
+    nums = [float(x) for x in args.split(",") if x.strip()]
+    if kind == "fixed" and len(nums) == 1:
+        return lambda rng: nums[0]
+    if kind == "uniform" and len(nums) == 2:
+        return lambda rng: rng.uniform(nums[0], nums[1])
+    if kind == "normal" and len(nums) == 2:
+        return lambda rng: max(0.0, rng.gauss(nums[0], nums[1]))
+    if kind == "lognormal" and len(nums) == 2:
+        return lambda rng: rng.lognormvariate(nums[0], nums[1])
+    if kind == "pareto" and len(nums) == 2:
+        return lambda rng: nums[0] * rng.paretovariate(nums[1])
+    raise ValueError(f"توزيع غير معروف: {spec!r}")
+
+
+# ==============================
+# Backends
+# ==============================
+
+
+class LLMBackend(ABC):
+    """الواجهة الأساسية: complete(messages, max_tokens, temperature) -> LLMReply."""
+
+    name = "base"
+
+    @abstractmethod
+    def complete(self, messages, max_tokens: int = 256, temperature=None) -> LLMReply:
+        ...
+
+
+class OpenAIBackend(LLMBackend):
+    """
+    العميل (ومجمّع اتصالات httpx بداخله) يُنشأ عند أول استدعاء داخل كل عملية،
+    فلا يُورَّث عبر fork عند تشغيل gunicorn مع --preload.
+    """
+
+    name = "openai"
+
+    def __init__(self, api_key: str, model: str, timeout: float = None):
+        self.api_key = api_key
+        self.model = model
+        self.timeout = timeout
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None or self._pid != os.getpid():
+            with self._lock:
+                if self._client is None or self._pid != os.getpid():
+                    from openai import OpenAI
+
+                    kwargs = {"api_key": self.api_key}
+                    if self.timeout:
+                        kwargs["timeout"] = self.timeout
+                    self._client = OpenAI(**kwargs)
+                    self._pid = os.getpid()
+        return self._client
+
+    def complete(self, messages, max_tokens: int = 256, temperature=None) -> LLMReply:
+        kwargs = {"model": self.model, "messages": messages, "max_tokens": max_tokens}
+        if temperature is not None:
+            kwargs["temperature"] = temperature
+
+        t0 = time.perf_counter()
+        resp = self.client.chat.completions.create(**kwargs)
+        latency_ms = (time.perf_counter() - t0) * 1000.0
+
+        text = (resp.choices[0].message.content or "").strip()
+        usage = getattr(resp, "usage", None)
+        return LLMReply(
+            text,
+            getattr(usage, "prompt_tokens", 0) or 0,
+            getattr(usage, "completion_tokens", 0) or 0,
+            latency_ms,
+        )
+
+
+_STUB_WORDS_AR = ["التبرع", "بالدم", "آمن", "ويستغرق", "دقائق", "قليلة", "يرجى", "مراجعة", "بنك", "الدم"]
+_STUB_WORDS_EN = ["blood", "donation", "is", "safe", "and", "takes", "a", "few", "minutes", "please"]
+
+
+class StubBackend(LLMBackend):
+    """
+    خلفية محلية حتمية لنفس البذرة: الاستدعاء رقم n يسحب دائماً نفس العينة، لكن تكرار
+    الطلب نفسه يسحب عينة جديدة (زمن الاستجابة والأخطاء توزيع حقيقي لا قيمة ثابتة لكل سؤال).
+    keyed=True: نفس الطلب ⇒ نفس النص ونفس الزمن ونفس الخطأ (إعادة مطابقة تامة).
+    تُحاكي الانتظار بـ time.sleep حتى تظهر مشاكل تجويع الخيوط والمهلات كما في الإنتاج.
+    """
+
+    name = "stub"
+
+    def __init__(
+        self,
+        latency_ms: str = "fixed:300",
+        error_rate: float = 0.0,
+        timeout_rate: float = 0.0,
+        timeout_s: float = 30.0,
+        tokens: str = "uniform:40,160",
+        seed: str = "zomra",
+        keyed: bool = False,
+    ):
+        self._latency = parse_distribution(latency_ms)
+        self._tokens = parse_distribution(tokens, 80)
+        self.error_rate = max(0.0, min(1.0, float(error_rate)))
+        self.timeout_rate = max(0.0, min(1.0, float(timeout_rate)))
+        self.timeout_s = float(timeout_s)
+        self.seed = seed
+        self.keyed = keyed
+        self._calls = itertools.count()
+
+    def complete(self, messages, max_tokens: int = 256, temperature=None) -> LLMReply:
+        if self.keyed:
+            key = _request_key(messages, max_tokens, temperature)
+        else:
+            key = next(self._calls)
+        rng = random.Random(f"{self.seed}:{key}")
+
+        roll = rng.random()
+        if roll < self.timeout_rate:
+            # مهلة: ننتظر كامل المدة ثم نفشل (مثل مهلة عميل HTTP)
+            time.sleep(self.timeout_s)
+            raise LLMError("stub timeout")
+
+        latency_ms = self._latency(rng)
+        if latency_ms > 0:
+            time.sleep(latency_ms / 1000.0)
+
+        if roll < self.timeout_rate + self.error_rate:
+            raise LLMError("stub error")
+
+        n_tokens = max(1, min(int(self._tokens(rng)), int(max_tokens or 1)))
+        last = (messages[-1].get("content") if messages else "") or ""
+        words = _STUB_WORDS_AR if any("؀" <= ch <= "ۿ" for ch in last) else _STUB_WORDS_EN
+        text = "[stub] " + " ".join(rng.choice(words) for _ in range(n_tokens))
+        return LLMReply(text, _approx_tokens(messages), n_tokens, latency_ms)
+
+
+class RecordReplayBackend(LLMBackend):
+    """
+    record: يمرّر إلى الخلفية الداخلية ويُلحق كل طلب/رد بملف JSONL.
+    replay: يقرأ الملف ويعيد الرد المسجل لنفس الطلب (مفتاح sha256 للرسائل والمعاملات).
+    """
+
+    def __init__(self, path: str, mode: str = "replay", inner: LLMBackend = None,
+                 replay_latency: bool = False):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"وضع غير معروف: {mode!r}")
+        if mode == "record" and inner is None:
+            raise ValueError("وضع record يحتاج خلفية داخلية.")
+        self.name = mode
+        self.path = path
+        self.mode = mode
+        self.inner = inner
+        self.replay_latency = replay_latency
+        self._lock = threading.Lock()
+        self._tape = {}
+        if mode == "replay":
+            self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(self.path)
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    rec = json.loads(line)
+                    self._tape[rec["key"]] = rec
+                except (ValueError, KeyError):
+                    continue
+
+    def complete(self, messages, max_tokens: int = 256, temperature=None) -> LLMReply:
+        key = _request_key(messages, max_tokens, temperature)
+
+        if self.mode == "replay":
+            rec = self._tape.get(key)
+            if rec is None:
+                raise LLMError("replay: لا يوجد رد مسجل لهذا الطلب")
+            if rec.get("error"):
+                raise LLMError(rec["error"])
+            if self.replay_latency and rec.get("latency_ms"):
+                time.sleep(rec["latency_ms"] / 1000.0)
+            return LLMReply(
+                rec.get("text", ""),
+                rec.get("prompt_tokens", 0),
+                rec.get("completion_tokens", 0),
+                rec.get("latency_ms", 0.0),
+            )
+
+        rec = {"key": key, "messages": messages, "max_tokens": max_tokens,
+               "temperature": temperature, "ts": time.time()}
+        t0 = time.perf_counter()
+        try:
+            reply = self.inner.complete(messages, max_tokens, temperature)
+            rec.update(reply._asdict())
+            return reply
+        except Exception as e:
+            rec["error"] = str(e)
+            rec["latency_ms"] = (time.perf_counter() - t0) * 1000.0
+            raise
+        finally:
+            line = json.dumps(rec, ensure_ascii=False)
+            with self._lock:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+
+
+def make_backend(kind: str, api_key: str = "", model: str = "gpt-4o-mini"):
+    """
+    إنشاء الخلفية حسب الإعداد. ترجع None في وضع none أو عند غياب مفتاح OpenAI.
+    """
+    kind = (kind or "").strip().lower()
+    timeout = float(_env("OPENAI_TIMEOUT", "0") or 0) or None
+
+    if kind in ("", "none", "off"):
+        return None
+
+    if kind == "stub":
+        return StubBackend(
+            latency_ms=_env("LLM_STUB_LATENCY_MS", "fixed:300"),
+            error_rate=float(_env("LLM_STUB_ERROR_RATE", "0")),
+            timeout_rate=float(_env("LLM_STUB_TIMEOUT_RATE", "0")),
+            timeout_s=float(_env("LLM_STUB_TIMEOUT_S", "30")),
+            tokens=_env("LLM_STUB_TOKENS", "uniform:40,160"),
+            seed=_env("LLM_STUB_SEED", "zomra"),
+            keyed=_env("LLM_STUB_KEYED", "false").lower() in {"1", "true", "yes"},
+        )
+
+    path = _env("LLM_RECORD_PATH", "llm_recordings.jsonl")
+    if kind == "replay":
+        return RecordReplayBackend(
+            path,
+            mode="replay",
+            replay_latency=_env("LLM_REPLAY_LATENCY", "false").lower() in {"1", "true", "yes"},
+        )
+
+    if kind in ("openai", "record"):
+        if not api_key:
+            return None
+        inner = OpenAIBackend(api_key, model, timeout=timeout)
+        if kind == "record":
+            return RecordReplayBackend(path, mode="record", inner=inner)
+        return inner
+
+    raise ValueError(f"LLM_BACKEND غير معروف: {kind!r}")
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+log_store.py - تخزين ردود البوت في logs مرة واحدة لكل نص، مضغوطة بقاموس zlib.
+
+أغلب bot_response تكرار لنفس إجابات KB والتذييل (FOOTER_AR/EN) وأزرار واتساب، لذلك:
+- responses(hash, codec, body): كل نص فريد يُخزَّن مرة واحدة بمفتاح بصمته (12 بايت)،
+  وlogs.response_hash يشير إليه بدل نسخ النص في كل صف.
+- النص الفريد يُضغط بـ zlib مع قاموس (zdict) مُدرَّب من الردود الأكثر تكراراً والنصوص
+  الثابتة؛ القواميس في response_dicts ولا تتغير بعد إنشائها، وcodec = رقم القاموس
+  (0 = نص خام حين لا يفيد الضغط).
+- القراءة شفافة: attach(conn) يسجّل الدالة inflate_response ويُنشئ العرض المؤقت
+  logs_v بنفس أعمدة logs، و bot_response فيه هو النص الكامل (القديم أو المفكوك).
+
+صفوف logs القديمة (bot_response نصاً) تبقى مقروءة كما هي؛ لنقلها وتقليص الملف:
+    python log_store.py compact [--vacuum]
+    python log_store.py retrain          # قاموس جديد من الردود الحالية (للصفوف الجديدة)
+"""
+
+import sys, time, zlib, hashlib, argparse, threading
+from collections import OrderedDict
+
+from db import Database
+
+ZDICT_MAX = 32 * 1024  # نافذة zlib: ما زاد عنها لا يُستخدم
+TRAIN_TOP = 400
+TRAIN_WINDOW = 50000  # آخر صفوف logs فقط: التدريب لا يمسح جدولاً بملايين الصفوف
+KNOWN_HASHES_MAX = 8192
+INFLATE_CACHE_MAX = 2048
+COMPACT_BATCH = 2000
+
+LOGS_COLUMNS = ("id", "timestamp", "raw_query", "corrected_query", "response_type", "kb_source")
+
+
+def response_hash(text: str) -> bytes:
+    return hashlib.sha1(text.encode("utf-8")).digest()[:12]
+
+
+def train_zdict(samples) -> bytes:
+    """
+    samples: [(text, weight)]. zlib يفضّل المطابقات الأقرب لنهاية القاموس، فالأثقل وزناً
+    يوضع آخراً، وما لا يتسع ضمن ZDICT_MAX يُسقط من البداية (الأقل وزناً).
+    """
+    seen, parts = set(), []
+    for text, _ in sorted(samples, key=lambda s: s[1]):
+        if text and text not in seen:
+            seen.add(text)
+            parts.append(text.encode("utf-8"))
+    return b"".join(parts)[-ZDICT_MAX:]
+
+
+class ResponseStore:
+    def __init__(self, samples=None):
+        """samples(): نصوص ثابتة معروفة مسبقاً (تذييل، فولباك، إجابات KB) لتدريب أول قاموس."""
+        self.samples = samples
+        self._dicts = {}
+        self._current = None
+        self._known = OrderedDict()
+        self._inflated = OrderedDict()
+        self._lock = threading.Lock()
+
+    # ---------- المخطط ----------
+    def init(self, conn):
+        cols = {r[1] for r in conn.execute("PRAGMA table_info(logs)")}
+        if "response_hash" not in cols:
+            conn.execute("ALTER TABLE logs ADD COLUMN response_hash BLOB")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses(
+                hash BLOB PRIMARY KEY,
+                codec INTEGER NOT NULL,
+                body BLOB NOT NULL
+            ) WITHOUT ROWID
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS response_dicts(
+                id INTEGER PRIMARY KEY,
+                created_at TEXT,
+                zdict BLOB NOT NULL
+            )
+            """
+        )
+        conn.commit()
+        self._load_dicts(conn)
+
+    def _load_dicts(self, conn):
+        latest = conn.execute("SELECT MAX(id) FROM response_dicts").fetchone()[0]
+        if latest is None or latest == self._current:
+            return
+        for did, zd in conn.execute(
+            "SELECT id, zdict FROM response_dicts WHERE id > ? ORDER BY id", (self._current or 0,)
+        ):
+            self._dicts[did] = bytes(zd)
+            self._current = did
+
+    def ensure_dict(self, conn):
+        """
+        أول قاموس يُدرَّب مرة واحدة، في معاملة خاصة به (warm_up عند الإقلاع، أو compact).
+        لا يُستدعى من put: التدريب يقرأ آخر TRAIN_WINDOW صفاً ولا مكان له داخل معاملة حفظ.
+        """
+        if self._current is None:
+            self._load_dicts(conn)
+            if self._current is None:
+                self.train(conn)
+
+    def train(self, conn, new_version: bool = False) -> int:
+        """تدريب قاموس من أكثر الردود تكراراً + samples(). يرجع رقم القاموس المعتمد."""
+        samples = [(t, 1) for t in (self.samples() if self.samples else [])]
+        rows = conn.execute(
+            """
+            SELECT response_hash, bot_response, COUNT(*) AS n FROM logs
+            WHERE id > (SELECT COALESCE(MAX(id), 0) FROM logs) - ?
+            GROUP BY response_hash, bot_response ORDER BY n DESC LIMIT ?
+            """,
+            (TRAIN_WINDOW, TRAIN_TOP),
+        ).fetchall()
+        for h, text, n in rows:
+            if text is None and h is not None:
+                text = self.get(conn, h)
+            if text:
+                samples.append((text, n + 1))
+        zd = train_zdict(samples)
+        did = (max(self._dicts) + 1) if (new_version and self._dicts) else 1
+        # INSERT OR IGNORE: إن درّب عامل آخر القاموس نفسه أولاً نعتمد نسخته من قاعدة البيانات
+        conn.execute(
+            "INSERT OR IGNORE INTO response_dicts(id, created_at, zdict) VALUES(?,?,?)",
+            (did, time.strftime("%Y-%m-%d %H:%M:%S"), zd),
+        )
+        self._load_dicts(conn)
+        return self._current
+
+    # ---------- الكتابة ----------
+    def put(self, conn, text: str, pending=None):
+        """
+        يرجع بصمة النص بعد التأكد من وجوده في responses (ضمن معاملة المستدعي).
+        البصمة لا تدخل ذاكرة _known هنا: قد تُلغى المعاملة فيختفي الصف وتبقى البصمة،
+        فتشير السجلات اللاحقة إلى رد غير موجود. تُضاف إلى pending (قائمة) ويستدعي
+        المستدعي publish(pending) بعد commit ناجح.
+        """
+        if not text:
+            return None
+        h = response_hash(text)
+        with self._lock:
+            if h in self._known:
+                self._known.move_to_end(h)
+                return h
+        if conn.execute("SELECT 1 FROM responses WHERE hash=?", (h,)).fetchone() is None:
+            if self._current is None:
+                self._load_dicts(conn)  # قراءة فقط: ربما درّبه عامل آخر
+            codec, body = self._compress(text)
+            conn.execute(
+                "INSERT OR IGNORE INTO responses(hash, codec, body) VALUES(?,?,?)", (h, codec, body)
+            )
+        if pending is not None:
+            pending.append(h)
+        return h
+
+    def publish(self, hashes):
+        """بعد commit: البصمات صارت في responses فعلاً، فيتخطى put فحصها لاحقاً."""
+        with self._lock:
+            for h in hashes:
+                self._known[h] = True
+                self._known.move_to_end(h)
+            while len(self._known) > KNOWN_HASHES_MAX:
+                self._known.popitem(last=False)
+
+    def _compress(self, text: str):
+        raw = text.encode("utf-8")
+        if self._current is None:
+            return 0, raw  # لا قاموس بعد: نص خام (يبقى مقروءاً دائماً)
+        comp = zlib.compressobj(9, zdict=self._dicts[self._current])
+        packed = comp.compress(raw) + comp.flush()
+        if len(packed) < len(raw):
+            return self._current, packed
+        return 0, raw
+
+    # ---------- القراءة ----------
+    def inflate(self, legacy, h, codec, body):
+        """نص الرد لصف في logs: النص القديم كما هو، أو المفكوك من responses (مع ذاكرة)."""
+        if legacy is not None or h is None or body is None:
+            return legacy
+        key = bytes(h)
+        with self._lock:
+            text = self._inflated.get(key)
+            if text is not None:
+                self._inflated.move_to_end(key)
+                return text
+        if codec == 0:
+            text = bytes(body).decode("utf-8")
+        else:
+            zd = self._dicts.get(codec)
+            if zd is None:
+                return None  # قاموس أحدث من هذه العملية: يُحمَّل في attach التالي
+            d = zlib.decompressobj(zdict=zd)
+            text = (d.decompress(bytes(body)) + d.flush()).decode("utf-8")
+        with self._lock:
+            self._inflated[key] = text
+            if len(self._inflated) > INFLATE_CACHE_MAX:
+                self._inflated.popitem(last=False)
+        return text
+
+    def get(self, conn, h):
+        row = conn.execute("SELECT codec, body FROM responses WHERE hash=?", (h,)).fetchone()
+        return self.inflate(None, h, *row) if row else None
+
+    def attach(self, conn):
+        """تجهيز اتصال للقراءة: inflate_response + العرض المؤقت logs_v."""
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name='response_dicts'").fetchone():
+            self._load_dicts(conn)
+        # ليست deterministic: قد ترجع NULL لقاموس لم يُحمَّل بعد ثم النص بعد تحميله
+        conn.create_function("inflate_response", 4, self.inflate)
+        cols = ", ".join("l." + c for c in LOGS_COLUMNS)
+        conn.execute(
+            f"""
+            CREATE TEMP VIEW IF NOT EXISTS logs_v AS
+            SELECT {cols},
+                   inflate_response(l.bot_response, l.response_hash, r.codec, r.body) AS bot_response
+            FROM logs l LEFT JOIN responses r ON r.hash = l.response_hash
+            """
+        )
+        return conn
+
+    # ---------- الصيانة ----------
+    def compact(self, conn, batch: int = COMPACT_BATCH) -> int:
+        """نقل bot_response النصي في الصفوف القديمة إلى responses (دفعات قصيرة)."""
+        with conn:
+            self.ensure_dict(conn)
+        moved, last = 0, 0
+        while True:
+            pending = []
+            with conn:
+                rows = conn.execute(
+                    """
+                    SELECT id, bot_response FROM logs
+                    WHERE id > ? AND bot_response IS NOT NULL ORDER BY id LIMIT ?
+                    """,
+                    (last, batch),
+                ).fetchall()
+                if not rows:
+                    return moved
+                conn.executemany(
+                    "UPDATE logs SET response_hash=?, bot_response=NULL WHERE id=?",
+                    [(self.put(conn, text, pending), rid) for rid, text in rows],
+                )
+            self.publish(pending)
+            moved += len(rows)
+            last = rows[-1][0]
+
+
+def stats(conn) -> dict:
+    n_logs = conn.execute("SELECT COUNT(*) FROM logs").fetchone()[0]
+    n_resp, body = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(LENGTH(body)), 0) FROM responses"
+    ).fetchone()
+    legacy = conn.execute("SELECT COUNT(*) FROM logs WHERE bot_response IS NOT NULL").fetchone()[0]
+    return {"logs": n_logs, "responses": n_resp, "response_bytes": body, "legacy_rows": legacy}
+
+
+def main(argv=None):
+    from chat_core import DB_NAME
+
+    ap = argparse.ArgumentParser(description="صيانة تخزين ردود البوت في logs")
+    ap.add_argument("cmd", choices=["compact", "retrain", "stats"])
+    ap.add_argument("--db", default=DB_NAME)
+    ap.add_argument("--vacuum", action="store_true", help="إعادة بناء الملف لاسترجاع المساحة")
+    args = ap.parse_args(argv)
+
+    db = Database(args.db, timeout_s=30)
+    conn = db.writer()
+    # بلا samples: القاموس يُدرَّب من الردود المحفوظة فعلاً (التطبيق يضيف النصوص الثابتة لأول قاموس)
+    store = ResponseStore()
+    store.init(conn)
+    t0 = time.time()
+    if args.cmd == "compact":
+        moved = store.compact(conn)
+        print(f"✅ نُقل {moved} رداً قديماً إلى responses.")
+        if args.vacuum:
+            conn.execute("VACUUM")
+            print("✅ VACUUM")
+    elif args.cmd == "retrain":
+        with conn:
+            did = store.train(conn, new_version=True)
+        print(f"✅ القاموس الحالي: {did} ({len(store._dicts[did])} بايت).")
+    print(stats(conn), f"({time.time() - t0:.1f} ث)")
+    db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+mailer.py - اتصال SMTP واحد مُعاد استخدامه لكل عملية.
+
+بدل فتح اتصال + STARTTLS + LOGIN لكل رسالة، يبقى الاتصال مفتوحاً ويُعاد استخدامه
+حتى idle_s ثانية من الخمول؛ عند انقطاعه يُعاد الاتصال ومحاولة الإرسال مرة واحدة.
+الإرسال متسلسل عبر قفل (اتصال SMTP لا يحتمل إرسالاً متوازياً).
+"""
+
+import os, time, smtplib, threading
+
+
+class PooledSMTP:
+    def __init__(self, host: str, port: int, user: str = "", password: str = "",
+                 use_tls: bool = True, idle_s: float = 60.0, timeout: float = 15.0):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.use_tls = use_tls
+        self.idle_s = idle_s
+        self.timeout = timeout
+        self._conn = None
+        self._pid = None
+        self._last_used = 0.0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.use_tls:
+            conn.starttls()
+        if self.user:
+            conn.login(self.user, self.password)
+        self._conn = conn
+        self._pid = os.getpid()
+        return conn
+
+    def _close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None and self._pid == os.getpid():
+            try:
+                conn.quit()
+            except Exception:
+                pass
+
+    def _get(self):
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = None  # اتصال موروث عبر fork لا يُستخدم
+            return self._connect()
+        if time.monotonic() - self._last_used > self.idle_s:
+            self._close()
+            return self._connect()
+        return self._conn
+
+    def send(self, msg):
+        with self._lock:
+            for attempt in (0, 1):
+                try:
+                    self._get().send_message(msg)
+                    self._last_used = time.monotonic()
+                    return
+                except (smtplib.SMTPServerDisconnected, smtplib.SMTPSenderRefused, OSError):
+                    # الخادم أغلق الاتصال الخامل: اتصال جديد ومحاولة أخيرة
+                    self._close()
+                    if attempt:
+                        raise
+
+    def close(self):
+        with self._lock:
+            self._close()
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+mine_questions.py - استخراج الأسئلة غير المُجابة من سجل المحادثات وتجميعها.
+
+كل صف في logs من نوع Fallback أو AI هو سؤال لم تُجب عليه القاعدة المعرفية.
+هذا السكربت يطبّع raw_query بـ text_norm (صفحة كاملة في كل استدعاء)، يقسمه إلى shingles حرفية،
+ويجمع الصيغ المتقاربة عبر MinHash + LSH. يعمل بشكل تزايدي: يحفظ آخر id تمت
+معالجته مع العناقيد في ملف حالة، ويعالج فقط الصفوف الجديدة في كل تشغيل.
+
+تشغيل:
+    python mine_questions.py                       # تحديث الحالة وطباعة أعلى 20 عنقوداً
+    python mine_questions.py --top 50 --out clusters.csv
+    python mine_questions.py --reset               # إعادة البناء من الصفر
+"""
+
+import os, sys, json, csv, argparse, time, zlib, random
+
+from chat_core import DB_NAME
+from db import Database
+from text_norm import normalize_many
+
+STATE_PATH = "unanswered_clusters.json"
+STATE_VERSION = 1
+
+NUM_PERM = 64
+BANDS = 16  # 16 × 4 ⇒ عتبة LSH تقريبية ≈ 0.5
+ROWS_PER_BAND = NUM_PERM // BANDS
+SIM_THRESHOLD = 0.6
+SHINGLE_SIZE = 3
+MAX_EXAMPLES = 20
+PAGE_SIZE = 5000
+
+_MERSENNE = (1 << 61) - 1
+_rng = random.Random(1337)  # بذرة ثابتة ⇒ تواقيع متوافقة بين التشغيلات
+_PERMS = [
+    (_rng.randrange(1, _MERSENNE), _rng.randrange(0, _MERSENNE)) for _ in range(NUM_PERM)
+]
+
+
+def shingles(text: str):
+    """shingles حرفية بطول 3 مع حشو بالمسافات (النصوص القصيرة تبقى shingle واحدة)."""
+    t = f" {text} "
+    if len(t) <= SHINGLE_SIZE:
+        return {zlib.crc32(t.encode("utf-8"))}
+    return {
+        zlib.crc32(t[i : i + SHINGLE_SIZE].encode("utf-8"))
+        for i in range(len(t) - SHINGLE_SIZE + 1)
+    }
+
+
+def minhash(hashes):
+    return [min((a * h + b) % _MERSENNE for h in hashes) for a, b in _PERMS]
+
+
+def band_keys(sig):
+    return [
+        hash((i, tuple(sig[i * ROWS_PER_BAND : (i + 1) * ROWS_PER_BAND])))
+        for i in range(BANDS)
+    ]
+
+
+def estimated_jaccard(s1, s2) -> float:
+    return sum(1 for x, y in zip(s1, s2) if x == y) / NUM_PERM
+
+
+class ClusterIndex:
+    """العناقيد + فهرس LSH + خريطة النص المطبّع → عنقود (للتكرارات الحرفية)."""
+
+    def __init__(self):
+        self.last_id = 0
+        self.clusters = []
+        self.exact = {}
+        self.buckets = {}
+
+    # ---------- حالة ----------
+    @classmethod
+    def load(cls, path: str):
+        idx = cls()
+        if not os.path.exists(path):
+            return idx
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != STATE_VERSION or data.get("num_perm") != NUM_PERM:
+            print("ℹ️ ملف الحالة بإصدار مختلف؛ سيتم إعادة البناء.")
+            return idx
+        idx.last_id = int(data.get("last_id") or 0)
+        idx.clusters = data.get("clusters") or []
+        idx.exact = data.get("exact") or {}
+        for cid, cl in enumerate(idx.clusters):
+            for key in band_keys(cl["sig"]):
+                idx.buckets.setdefault(key, []).append(cid)
+        return idx
+
+    def save(self, path: str):
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": STATE_VERSION,
+                    "num_perm": NUM_PERM,
+                    "last_id": self.last_id,
+                    "clusters": self.clusters,
+                    "exact": self.exact,
+                },
+                f,
+                ensure_ascii=False,
+            )
+        os.replace(tmp, path)
+
+    # ---------- إضافة ----------
+    def add(self, raw: str, norm: str, response_type: str, ts: str):
+        cid = self.exact.get(norm)
+        if cid is None:
+            sig = minhash(shingles(norm))
+            keys = band_keys(sig)
+            best, best_sim = None, SIM_THRESHOLD
+            seen = set()
+            for key in keys:
+                for cand in self.buckets.get(key, ()):
+                    if cand in seen:
+                        continue
+                    seen.add(cand)
+                    sim = estimated_jaccard(sig, self.clusters[cand]["sig"])
+                    if sim >= best_sim:
+                        best, best_sim = cand, sim
+            if best is None:
+                best = len(self.clusters)
+                self.clusters.append(
+                    {"sig": sig, "count": 0, "examples": {}, "types": {},
+                     "first_seen": ts, "last_seen": ts}
+                )
+                for key in keys:
+                    self.buckets.setdefault(key, []).append(best)
+            cid = best
+            self.exact[norm] = cid
+
+        cl = self.clusters[cid]
+        cl["count"] += 1
+        cl["types"][response_type] = cl["types"].get(response_type, 0) + 1
+        if ts and ts > (cl.get("last_seen") or ""):
+            cl["last_seen"] = ts
+        ex = cl["examples"]
+        if raw in ex or len(ex) < MAX_EXAMPLES:
+            ex[raw] = ex.get(raw, 0) + 1
+
+    def ranked(self, top: int, min_count: int = 1):
+        order = sorted(
+            (c for c in self.clusters if c["count"] >= min_count),
+            key=lambda c: c["count"],
+            reverse=True,
+        )
+        out = []
+        for c in order[:top]:
+            examples = sorted(c["examples"].items(), key=lambda kv: kv[1], reverse=True)
+            out.append(
+                {
+                    "count": c["count"],
+                    "types": c["types"],
+                    "first_seen": c["first_seen"],
+                    "last_seen": c["last_seen"],
+                    "examples": [{"text": t, "count": n} for t, n in examples[:5]],
+                }
+            )
+        return out
+
+
+def iter_unanswered(db_path: str, after_id: int):
+    """قراءة الصفوف الجديدة بصفحات قصيرة (keyset على id) من اتصال قراءة فقط."""
+    db = Database(db_path)
+    conn = db.reader()
+    try:
+        last = after_id
+        while True:
+            rows = conn.execute(
+                """
+                SELECT id, raw_query, response_type, timestamp FROM logs
+                WHERE id > ? AND response_type IN ('Fallback', 'AI')
+                ORDER BY id LIMIT ?
+                """,
+                (last, PAGE_SIZE),
+            ).fetchall()
+            if not rows:
+                return
+            yield rows
+            last = rows[-1][0]
+    finally:
+        db.close()
+
+
+def run(db_path: str, state_path: str, reset: bool = False):
+    idx = ClusterIndex() if reset else ClusterIndex.load(state_path)
+    t0 = time.perf_counter()
+    n = 0
+    for rows in iter_unanswered(db_path, idx.last_id):
+        raws = [(r[1] or "").strip() for r in rows]
+        for (row_id, _, rtype, ts), raw, norm in zip(rows, raws, normalize_many(raws)):
+            norm = norm.lower()
+            if norm:
+                idx.add(raw, norm, rtype, ts or "")
+            n += 1
+        idx.last_id = rows[-1][0]
+    idx.save(state_path)
+    dt = time.perf_counter() - t0
+    print(
+        f"✅ تمت معالجة {n} صفاً جديداً في {dt:.1f} ث؛ "
+        f"{len(idx.clusters)} عنقوداً، آخر id = {idx.last_id}."
+    )
+    return idx
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="تجميع الأسئلة غير المُجابة من logs")
+    ap.add_argument("--db", default=DB_NAME)
+    ap.add_argument("--state", default=STATE_PATH)
+    ap.add_argument("--reset", action="store_true", help="تجاهل الحالة السابقة")
+    ap.add_argument("--top", type=int, default=20)
+    ap.add_argument("--min-count", type=int, default=2)
+    ap.add_argument("--out", help="ملف الإخراج (.json أو .csv)؛ الافتراضي الطباعة")
+    args = ap.parse_args(argv)
+
+    idx = run(args.db, args.state, reset=args.reset)
+    ranked = idx.ranked(args.top, args.min_count)
+
+    if not args.out:
+        for i, c in enumerate(ranked, 1):
+            print(f"\n#{i}  ×{c['count']}  {c['types']}")
+            for ex in c["examples"]:
+                print(f"    - {ex['text']}  ({ex['count']})")
+    elif args.out.endswith(".csv"):
+        with open(args.out, "w", encoding="utf-8", newline="") as f:
+            w = csv.writer(f)
+            w.writerow(["rank", "count", "fallback", "ai", "last_seen", "examples"])
+            for i, c in enumerate(ranked, 1):
+                w.writerow([
+                    i, c["count"], c["types"].get("Fallback", 0), c["types"].get("AI", 0),
+                    c["last_seen"], " | ".join(ex["text"] for ex in c["examples"]),
+                ])
+    else:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(ranked, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+rate_limit.py - تحديد المعدل (token bucket) وحصص التوكنات اليومية لكل عميل.
+
+- الدلاء مشتركة بين كل عمال gunicorn عبر ملف SQLite مستقل (WAL) وتحديث ذري
+  داخل BEGIN IMMEDIATE.
+- بعد أول رفض يُحفظ وقت انتهاء الحظر في ذاكرة العملية، فتُرد الطلبات التالية
+  من نفس العميل بـ 429 + Retry-After دون أي I/O (ميكروثوانٍ).
+- استهلاك التوكنات اليومي لكل عميل يُجمع في جدول usage.
+
+وصف السياسة: "N/S" = سعة N طلباً تُعاد تعبئتها بمعدل N كل S ثانية.
+"""
+
+import time, sqlite3, threading
+from datetime import datetime
+
+from db import Database
+
+
+class RateLimited(Exception):
+    """تجاوز العميل الحد المسموح (retry_after بالثواني)."""
+
+    def __init__(self, bucket: str, retry_after: float, reason: str = "rate"):
+        super().__init__(f"{bucket}: retry after {retry_after:.1f}s")
+        self.bucket = bucket
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+def parse_policy(spec: str):
+    """"30/60" → (capacity=30, refill_per_sec=0.5)."""
+    n, _, s = (spec or "").partition("/")
+    capacity = float(n)
+    period = float(s or 1)
+    if capacity <= 0 or period <= 0:
+        raise ValueError(f"سياسة غير صالحة: {spec!r}")
+    return capacity, capacity / period
+
+
+BLOCKED_MAX = 10000
+
+
+class TokenBucketLimiter:
+    def __init__(self, db_path: str, policies: dict):
+        """policies: {bucket_name: (capacity, refill_per_sec)}"""
+        self.db_path = db_path
+        self.policies = policies
+        # autocommit: التحديث الذري يدير BEGIN IMMEDIATE / COMMIT بنفسه
+        self.db = Database(db_path, timeout_s=5, autocommit=True)
+        self._blocked = {}  # (client, bucket) → monotonic time حتى انتهاء الحظر
+        self._lock = threading.Lock()
+
+    # ---------- DB ----------
+    def _conn(self):
+        return self.db.writer()
+
+    def init_db(self):
+        conn = self._conn()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS buckets(
+                key TEXT PRIMARY KEY,
+                tokens REAL,
+                updated REAL
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS usage(
+                client TEXT,
+                day TEXT,
+                ai_calls INTEGER DEFAULT 0,
+                tokens INTEGER DEFAULT 0,
+                PRIMARY KEY(client, day)
+            )
+            """
+        )
+
+    # ---------- Buckets ----------
+    def take(self, client: str, bucket: str, cost: float = 1.0) -> float:
+        """
+        يسحب cost من دلو العميل. ترجع 0 عند السماح وإلا عدد الثواني للانتظار.
+        عند فشل قاعدة البيانات نسمح بالطلب (fail-open) حتى لا يتعطل الخدمة.
+        """
+        mono = time.monotonic()
+        until = self._blocked.get((client, bucket))
+        if until is not None:
+            if mono < until:
+                return until - mono
+            with self._lock:
+                self._blocked.pop((client, bucket), None)
+
+        capacity, rate = self.policies[bucket]
+        key = f"{bucket}:{client}"
+        now = time.time()
+        conn = self._conn()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT tokens, updated FROM buckets WHERE key=?", (key,)
+            ).fetchone()
+            if row is None:
+                tokens = capacity
+            else:
+                tokens = min(capacity, row[0] + max(0.0, now - row[1]) * rate)
+
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0.0
+            else:
+                wait = (cost - tokens) / rate
+
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets(key, tokens, updated) VALUES(?,?,?)",
+                (key, tokens, now),
+            )
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            try:
+                conn.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+            print("⚠️ rate limit DB:", e)
+            return 0.0
+
+        if wait > 0:
+            self._remember_block((client, bucket), mono + wait)
+        return wait
+
+    def _remember_block(self, key, until: float):
+        """الحظر في الذاكرة محدود الحجم: العملاء المنتهي حظرهم يُكنسون عند امتلائه."""
+        with self._lock:
+            self._blocked.pop(key, None)
+            self._blocked[key] = until
+            if len(self._blocked) <= BLOCKED_MAX:
+                return
+            mono = time.monotonic()
+            for k in [k for k, u in self._blocked.items() if u <= mono]:
+                del self._blocked[k]
+            # كلهم ما زالوا محظورين: يُسقط الأقدم (يُعاد فحصه من قاعدة البيانات فقط)
+            while len(self._blocked) > BLOCKED_MAX:
+                del self._blocked[next(iter(self._blocked))]
+
+    # ---------- Usage ----------
+    @staticmethod
+    def today() -> str:
+        return datetime.now().strftime("%Y-%m-%d")
+
+    def record_usage(self, client: str, tokens: int):
+        try:
+            self._conn().execute(
+                """
+                INSERT INTO usage(client, day, ai_calls, tokens) VALUES(?,?,1,?)
+                ON CONFLICT(client, day) DO UPDATE SET
+                    ai_calls = ai_calls + 1,
+                    tokens = tokens + excluded.tokens
+                """,
+                (client, self.today(), int(tokens or 0)),
+            )
+        except sqlite3.Error as e:
+            print("⚠️ usage DB:", e)
+
+    def tokens_today(self, client: str) -> int:
+        try:
+            row = self._conn().execute(
+                "SELECT tokens FROM usage WHERE client=? AND day=?",
+                (client, self.today()),
+            ).fetchone()
+        except sqlite3.Error:
+            return 0
+        return int(row[0]) if row else 0
+
+    def usage_report(self, day: str = None, limit: int = 100):
+        day = day or self.today()
+        rows = self.db.reader().execute(
+            """
+            SELECT client, ai_calls, tokens FROM usage WHERE day=?
+            ORDER BY tokens DESC LIMIT ?
+            """,
+            (day, limit),
+        ).fetchall()
+        return [{"client": c, "ai_calls": n, "tokens": t} for c, n, t in rows]
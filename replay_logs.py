@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+replay_logs.py - إعادة تشغيل أسئلة المستخدمين الحقيقية من logs على محرّك KB الحالي
+ومحرّك مرشّح، قبل تغيير طريقة المطابقة أو العتبة (KB_SIM_THRESHOLD).
+
+لكل سؤال يُعاد مسار القرار نفسه في answer_message: نية محلية ← حروف الرسالة ←
+بحث KB (المحرّك المقارَن للعربي، وفهرس الأسئلة الإنجليزية الحالي للإنجليزي) ←
+مقارنة الدرجة بالعتبة. الأسئلة المكررة تُجمع في SQL وتُشغَّل
+مرة واحدة، ويُوزَّع العمل على كل الأنوية (multiprocessing).
+
+التقرير:
+- توزيع زمن البحث لكل محرّك (p50/p90/p99/max) لكل سؤال فريد.
+- نسبة الإجابة من KB موزونة بعدد مرات ورود السؤال.
+- الأسئلة التي تغيّرت نتيجتها بين KB و AI/Fallback (الأكثر وروداً أولاً).
+
+تشغيل:
+    python replay_logs.py                                   # آخر 30 يوماً، العتبة الحالية
+    python replay_logs.py --candidate-threshold 80
+    python replay_logs.py --candidate my_matcher:search --out replay.json
+"""
+
+import os, sys, json, time, argparse, importlib, multiprocessing
+from datetime import datetime, timedelta
+
+from chat_core import (
+    DB_NAME,
+    INTENT_ROUTER,
+    KB_SIM_THRESHOLD,
+    search_knowledge_base,
+    search_knowledge_base_en,
+    text_script,
+)
+from db import Database
+
+REPLAYED_TYPES = ("KB", "AI", "Fallback")
+CHUNK_SIZE = 200
+
+_ENGINES = {}
+
+
+def load_engine(spec: str):
+    """"module:function" → دالة بنفس توقيع search_knowledge_base. فارغ = المحرّك الحالي."""
+    if not spec:
+        return search_knowledge_base
+    mod, _, fn = spec.partition(":")
+    return getattr(importlib.import_module(mod), fn or "search_knowledge_base")
+
+
+def _init_worker(current_spec: str, candidate_spec: str):
+    _ENGINES["current"] = load_engine(current_spec)
+    _ENGINES["candidate"] = load_engine(candidate_spec)
+
+
+def _outcome(search, query: str, threshold: int, lang: str, intent: bool):
+    t0 = time.perf_counter()
+    answer, _, score = search(query) if lang == "ar" else search_knowledge_base_en(query)
+    ms = (time.perf_counter() - t0) * 1000.0
+    if answer and score >= threshold:
+        return "KB", int(score), ms
+    # النوايا المحلية تُجيب بعد إخفاق KB فقط (كما في answer_message)
+    return ("Intent" if intent else "AI/Fallback"), int(score or 0), ms
+
+
+def _replay_chunk(args):
+    chunk, cur_threshold, cand_threshold = args
+    out = []
+    for query, count, logged in chunk:
+        intent = bool(INTENT_ROUTER.match(query))
+        lang = text_script(query)
+        cur = _outcome(_ENGINES["current"], query, cur_threshold, lang, intent)
+        cand = _outcome(_ENGINES["candidate"], query, cand_threshold, lang, intent)
+        out.append((query, count, logged) + cur + cand)
+    return out
+
+
+def read_queries(db_path: str, since: str, until: str):
+    """[(raw_query, count, {response_type: count})] — التكرار يُجمع داخل SQLite."""
+    db = Database(db_path)
+    try:
+        rows = db.reader().execute(
+            f"""
+            SELECT raw_query, response_type, COUNT(*) FROM logs
+            WHERE timestamp >= ? AND timestamp < ?
+              AND response_type IN ({",".join("?" * len(REPLAYED_TYPES))})
+              AND raw_query IS NOT NULL AND raw_query != ''
+            GROUP BY raw_query, response_type
+            """,
+            (since, until) + REPLAYED_TYPES,
+        ).fetchall()
+    finally:
+        db.close()  # قبل fork عمال إعادة التشغيل
+    queries = {}
+    for q, rtype, n in rows:
+        total, types = queries.get(q, (0, {}))
+        types[rtype] = types.get(rtype, 0) + n
+        queries[q] = (total + n, types)
+    return [(q, total, types) for q, (total, types) in queries.items()]
+
+
+def _percentiles(values):
+    if not values:
+        return {}
+    v = sorted(values)
+
+    def pct(p):
+        return round(v[min(len(v) - 1, int(p / 100.0 * len(v)))], 3)
+
+    return {"p50": pct(50), "p90": pct(90), "p99": pct(99), "max": round(v[-1], 3)}
+
+
+def replay(queries, current_spec="", candidate_spec="", cur_threshold=KB_SIM_THRESHOLD,
+           cand_threshold=KB_SIM_THRESHOLD, processes=None):
+    chunks = [
+        (queries[i : i + CHUNK_SIZE], cur_threshold, cand_threshold)
+        for i in range(0, len(queries), CHUNK_SIZE)
+    ]
+    method = "fork" if "fork" in multiprocessing.get_all_start_methods() else None
+    ctx = multiprocessing.get_context(method)
+    results = []
+    with ctx.Pool(
+        processes or os.cpu_count(),
+        initializer=_init_worker,
+        initargs=(current_spec, candidate_spec),
+    ) as pool:
+        for part in pool.imap_unordered(_replay_chunk, chunks):
+            results.extend(part)
+    return results
+
+
+def report(results, top: int = 30) -> dict:
+    total = sum(r[1] for r in results) or 1
+    cur_lat = [r[5] for r in results if r[3] != "Intent"]
+    cand_lat = [r[8] for r in results if r[6] != "Intent"]
+
+    def share(idx, label):
+        return round(100.0 * sum(r[1] for r in results if r[idx] == label) / total, 2)
+
+    logged_kb = round(100.0 * sum(r[2].get("KB", 0) for r in results) / total, 2)
+
+    flips = [
+        {
+            "query": q,
+            "count": n,
+            "current": co,
+            "current_score": cs,
+            "candidate": ko,
+            "candidate_score": ks,
+        }
+        for q, n, _, co, cs, _, ko, ks, _ in results
+        if co != ko
+    ]
+    flips.sort(key=lambda f: -f["count"])
+
+    return {
+        "queries": total,
+        "unique_queries": len(results),
+        "kb_hit_rate": {
+            "logged": logged_kb,
+            "current": share(3, "KB"),
+            "candidate": share(6, "KB"),
+        },
+        "intent_rate": share(3, "Intent"),
+        "latency_ms": {
+            "current": _percentiles(cur_lat),
+            "candidate": _percentiles(cand_lat),
+        },
+        "flips": {
+            "to_kb": sum(f["count"] for f in flips if f["candidate"] == "KB"),
+            "to_ai_fallback": sum(f["count"] for f in flips if f["current"] == "KB"),
+            "top": flips[:top],
+        },
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="مقارنة محرّكات KB على أسئلة logs الحقيقية")
+    ap.add_argument("--db", default=DB_NAME)
+    ap.add_argument("--days", type=int, default=30)
+    ap.add_argument("--since", help="YYYY-MM-DD (بدلاً من --days)")
+    ap.add_argument("--until", help="YYYY-MM-DD (افتراضياً الآن)")
+    ap.add_argument("--current", default="", help="module:function (الافتراضي المحرّك الحالي)")
+    ap.add_argument("--candidate", default="", help="module:function للمحرّك المرشّح")
+    ap.add_argument("--threshold", type=int, default=KB_SIM_THRESHOLD)
+    ap.add_argument("--candidate-threshold", type=int, default=None)
+    ap.add_argument("--processes", type=int, default=None)
+    ap.add_argument("--top", type=int, default=30)
+    ap.add_argument("--out", help="حفظ التقرير كاملاً بصيغة JSON")
+    args = ap.parse_args(argv)
+
+    until = args.until or (datetime.now() + timedelta(seconds=1)).strftime("%Y-%m-%d %H:%M:%S")
+    since = args.since or (datetime.now() - timedelta(days=args.days)).strftime("%Y-%m-%d %H:%M:%S")
+    cand_threshold = args.threshold if args.candidate_threshold is None else args.candidate_threshold
+
+    t0 = time.time()
+    queries = read_queries(args.db, since, until)
+    if not queries:
+        print("⚠️ لا توجد أسئلة في الفترة المحددة.")
+        return 1
+    print(f"ℹ️ {len(queries)} سؤالاً فريداً من {sum(q[1] for q in queries)} سجلاً ({since} → {until}).")
+
+    results = replay(
+        queries, args.current, args.candidate, args.threshold, cand_threshold, args.processes
+    )
+    rep = report(results, args.top)
+    rep["elapsed_s"] = round(time.time() - t0, 2)
+    rep["thresholds"] = {"current": args.threshold, "candidate": cand_threshold}
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(rep, f, ensure_ascii=False, indent=2)
+
+    hr = rep["kb_hit_rate"]
+    print(f"\nنسبة KB: المسجّلة {hr['logged']}% | الحالية {hr['current']}% | المرشّحة {hr['candidate']}%")
+    print(f"النوايا المحلية: {rep['intent_rate']}%")
+    for name, lat in rep["latency_ms"].items():
+        print(f"زمن البحث ({name}) ms: {lat}")
+    fl = rep["flips"]
+    print(f"\nتحوّل إلى KB: {fl['to_kb']} | تحوّل إلى AI/Fallback: {fl['to_ai_fallback']}")
+    for f in fl["top"]:
+        print(
+            f"  ×{f['count']}  {f['current']}({f['current_score']}) → "
+            f"{f['candidate']}({f['candidate_score']})  {f['query']}"
+        )
+    print(f"\n✅ انتهى خلال {rep['elapsed_s']} ثانية.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
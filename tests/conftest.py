@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# الوحدات في جذر المستودع (بلا حزمة): تُضاف إلى sys.path لتعمل الاختبارات من أي مجلد.
+import os, sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# app.py يقرأ ملفاته بمسارات نسبية (chat_logs.db، knowledge_base.json، static/...):
+# يُستورد مرة واحدة من مجلد مؤقت فيه روابط لملفات البيانات، بلا شبكة ولا بريد.
+APP_ENV = {
+    "LLM_BACKEND": "stub",
+    "LLM_STUB_LATENCY_MS": "fixed:1",
+    "LLM_STUB_ERROR_RATE": "0",
+    "OPENAI_API_KEY": "",
+    "AUDIO_TRANSCRIBER": "stub",
+    "URGENT_NEEDS_SHEET_CSV": "",
+    "SMTP_HOST": "",
+    "SENDGRID_API_KEY": "",
+    "DONOR_MATCH_POLL_S": "0",
+    "RATE_LIMIT_ENABLED": "false",
+    "TRACE_ENABLED": "false",
+    "ADMISSION_ENABLED": "false",
+    "ADMIN_API_TOKEN": "test-admin",
+}
+
+
+@pytest.fixture(scope="session")
+def app_module(tmp_path_factory):
+    work = tmp_path_factory.mktemp("app")
+    for name in ("knowledge_base.json", "static", "arabic_dictionary.txt"):
+        os.symlink(os.path.join(ROOT, name), work / name)
+    old_cwd, old_env = os.getcwd(), {k: os.environ.get(k) for k in APP_ENV}
+    os.environ.update(APP_ENV)
+    os.chdir(work)
+    try:
+        import app
+
+        yield app
+    finally:
+        os.chdir(old_cwd)
+        for k, v in old_env.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
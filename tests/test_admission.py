@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import admission
+from admission import DEGRADED, NORMAL, AdmissionController, AnswerCache, parse_request_start
+
+
+class Clock:
+    def __init__(self):
+        self.t = 1000.0
+
+    def __call__(self):
+        return self.t
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = Clock()
+    monkeypatch.setattr(admission.time, "monotonic", c)
+    return c
+
+
+def make(**kw):
+    args = dict(high_inflight=0, low_inflight=0, high_wait_ms=1000, low_wait_ms=200,
+                high_llm_ms=8000, low_llm_ms=3000, min_dwell_s=30, probe_s=10, llm_decay_s=60)
+    args.update(kw)
+    return AdmissionController(**args)
+
+
+def tick(ctl, clock, seconds, wait_s=None):
+    clock.t += seconds
+    ctl.enter(wait_s)
+    ctl.leave()
+
+
+def test_queue_wait_degrades_and_recovers_after_dwell(clock):
+    ctl = make(alpha=1.0)
+    ctl.enter(2.0)
+    ctl.leave()
+    assert ctl.mode == DEGRADED and ctl.reason == "queue_wait_ms"
+    # هادئ لكن قبل انقضاء min_dwell_s: يبقى degraded
+    tick(ctl, clock, 1, wait_s=0.05)
+    tick(ctl, clock, 20, wait_s=0.05)
+    assert ctl.mode == DEGRADED
+    tick(ctl, clock, 15, wait_s=0.05)
+    assert ctl.mode == NORMAL
+    assert ctl.transitions == 2
+
+
+def test_hysteresis_band_does_not_recover(clock):
+    ctl = make(alpha=1.0)
+    ctl.enter(2.0)
+    ctl.leave()
+    # بين الحدين (200 < 500 < 1000): لا عودة مهما طال الزمن
+    for _ in range(10):
+        tick(ctl, clock, 30, wait_s=0.5)
+    assert ctl.mode == DEGRADED
+
+
+def test_stale_llm_latency_decays_without_probes(clock):
+    ctl = make()
+    ctl.observe_llm(20000)
+    assert ctl.mode == DEGRADED
+    for _ in range(40):
+        tick(ctl, clock, 10)
+        if ctl.mode == NORMAL:
+            break
+    assert ctl.mode == NORMAL
+    assert ctl.llm_ms <= 3000
+
+
+def test_busy_threads_alone_do_not_degrade(clock):
+    ctl = make()
+    for _ in range(8):
+        ctl.enter()
+    assert ctl.mode == NORMAL
+
+
+def test_probe_allowed_once_per_interval(clock):
+    ctl = make()
+    ctl.observe_llm(20000)
+    assert not ctl.allow_ai()
+    clock.t += 10
+    assert ctl.allow_ai()
+    assert not ctl.allow_ai()
+
+
+def test_disabled_controller_never_degrades(clock):
+    ctl = make(enabled=False)
+    ctl.observe_llm(60000)
+    assert ctl.mode == NORMAL and ctl.allow_ai()
+
+
+def test_parse_request_start():
+    assert parse_request_start("t=1000.5", now=1001.0) == pytest.approx(0.5)
+    assert parse_request_start("1700000000500", now=1700000001.0) == pytest.approx(0.5)  # ms
+    assert parse_request_start("garbage") is None
+    assert parse_request_start("t=5000", now=1000.0) is None
+
+
+def test_answer_cache_lru():
+    cache = AnswerCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+    assert cache.get("b") is None and cache.get("a") == 1
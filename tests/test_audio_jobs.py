@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+import io, os, time
+
+import pytest
+
+import audio_jobs
+from audio_jobs import AudioJobQueue, StubTranscriber, UploadTooLarge, save_upload_stream
+from db import Database
+from rate_limit import RateLimited
+
+
+@pytest.fixture
+def db(tmp_path):
+    d = Database(str(tmp_path / "jobs.db"))
+    yield d
+    d.close()
+
+
+def make_queue(db):
+    q = AudioJobQueue(db, StubTranscriber(text="سؤال"), lambda text, lang, client: {"answer": text})
+    q.init_db()
+    return q
+
+
+def wait_done(q, job_id, timeout=5.0):
+    end = time.time() + timeout
+    while time.time() < end:
+        job = q.get(job_id)
+        if job["status"] not in ("queued", "running"):
+            return job
+        time.sleep(0.02)
+    raise AssertionError("المهمة لم تنتهِ")
+
+
+def test_save_upload_stream_limits_size(tmp_path):
+    dest = str(tmp_path / "a.wav")
+    assert save_upload_stream(io.BytesIO(b"x" * 100), dest, 100) == 100
+    with pytest.raises(UploadTooLarge):
+        save_upload_stream(io.BytesIO(b"x" * 101), dest, 100)
+    assert not os.path.exists(dest)
+
+
+def test_job_runs_to_done(db, tmp_path):
+    q = make_queue(db)
+    path = tmp_path / "a.wav"
+    path.write_bytes(b"x")
+    q.submit("j1", str(path), "ar")
+    job = wait_done(q, "j1")
+    assert job["status"] == "done"
+    assert job["result"] == {"answer": "سؤال", "transcribed_text": "سؤال"}
+    assert not path.exists()
+
+
+def insert_job(db, job_id, status, owner_pid, updated_at=None, path=None):
+    now = time.time() if updated_at is None else updated_at
+    conn = db.writer()
+    with conn:
+        conn.execute(
+            """
+            INSERT INTO audio_jobs(id, created_at, updated_at, status, lang, owner_pid, path)
+            VALUES(?,?,?,?,?,?,?)
+            """,
+            (job_id, now, now, status, "ar", owner_pid, path),
+        )
+
+
+def dead_pid():
+    pid = 999999
+    while audio_jobs._pid_alive(pid):
+        pid -= 1
+    return pid
+
+
+def test_startup_fails_jobs_of_dead_workers(db, tmp_path):
+    make_queue(db)
+    upload = tmp_path / "orphan.wav"
+    upload.write_bytes(b"x")
+    insert_job(db, "dead", "running", dead_pid(), path=str(upload))
+    insert_job(db, "live", "queued", os.getpid())
+    insert_job(db, "stale", "running", os.getpid(), updated_at=time.time() - audio_jobs.STALE_JOB_S - 1)
+
+    q = make_queue(db)  # إقلاع جديد
+    assert q.get("dead")["status"] == "failed"
+    assert q.get("stale")["status"] == "failed"
+    assert q.get("live")["status"] == "queued"
+    assert not upload.exists()
+
+
+def test_poll_detects_a_worker_that_died_after_startup(db):
+    q = make_queue(db)
+    insert_job(db, "j", "running", dead_pid())
+    assert q.get("j")["status"] == "failed"
+
+
+def test_rate_limited_handler_gets_its_own_status(db, tmp_path):
+    def handler(text, lang, client):
+        raise RateLimited("ai", 12.2)
+
+    q = AudioJobQueue(db, StubTranscriber(text="سؤال"), handler)
+    q.init_db()
+    path = tmp_path / "a.wav"
+    path.write_bytes(b"x")
+    q.submit("j", str(path), "ar")
+    job = wait_done(q, "j")
+    assert job["status"] == "rate_limited" and job["retry_after"] == 13
+    assert job["result"] is None and "13" in job["error"]
+    assert not path.exists()
+
+
+def test_init_db_adds_retry_after_to_old_tables(db):
+    conn = db.writer()
+    with conn:
+        conn.execute(
+            "CREATE TABLE audio_jobs(id TEXT PRIMARY KEY, created_at REAL, updated_at REAL,"
+            " status TEXT, lang TEXT, result TEXT, error TEXT)"
+        )
+    q = make_queue(db)
+    insert_job(db, "old", "done", os.getpid())
+    assert q.get("old")["retry_after"] is None
+
+
+def upload(client, data=b"RIFF....", name="a.wav"):
+    return client.post(
+        "/api/upload_audio",
+        data={"audio_file": (io.BytesIO(data), name), "lang": "ar"},
+        content_type="multipart/form-data",
+    )
+
+
+def test_endpoint_reports_rate_limited_job_with_retry_after(client, app_module, monkeypatch):
+    def handler(text, lang, client):
+        raise RateLimited("ai", 4.5, reason="quota")
+
+    monkeypatch.setattr(app_module.AUDIO_QUEUE, "handler", handler)
+    r = upload(client)
+    assert r.status_code == 202
+    job = client.get(r.get_json()["poll_url"] + "?wait=5")
+    body = job.get_json()
+    assert body["status"] == "rate_limited" and body["retry_after"] == 5
+    assert job.headers["Retry-After"] == "5"
+
+
+def test_endpoint_rejects_oversized_uploads(client, app_module, monkeypatch):
+    # الطلب كله أكبر من MAX_CONTENT_LENGTH: يرفضه werkzeug قبل المسار
+    monkeypatch.setitem(app_module.app.config, "MAX_CONTENT_LENGTH", 1024)
+    assert upload(client, b"x" * 4096).status_code == 413
+    monkeypatch.setitem(app_module.app.config, "MAX_CONTENT_LENGTH", 1024 * 1024)
+    # الطلب مقبول لكن الملف نفسه أكبر من AUDIO_MAX_BYTES
+    monkeypatch.setattr(app_module, "AUDIO_MAX_BYTES", 100)
+    r = upload(client, b"x" * 101)
+    assert r.status_code == 413 and "error" in r.get_json()
+    assert not [p for p in os.listdir(app_module.AUDIO_UPLOAD_DIR) if p.endswith(".wav")]
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+KB_Q = "ما هي شروط التبرع بالدم؟"
+TYPO = "وش الشروت عشان اتبرغ"  # تحت عتبة KB كما كُتبت
+OFF_TOPIC = "سؤال خارج القاعدة تماماً عن شي غريب"
+
+
+@pytest.fixture
+def spy(app_module, monkeypatch):
+    """يعدّ استدعاءات التصحيح والإجابة وخصم دلو ai واستدعاءات LLM للإجابة."""
+    calls = {"correct": [], "answer": [], "charge": 0, "llm": 0}
+    real_answer, real_llm = app_module.answer_message, app_module.llm_complete
+
+    def answer(*a, **k):
+        calls["answer"].append((a[0], k.get("autocorrect", False)))
+        return real_answer(*a, **k)
+
+    def llm_complete(*a, **k):
+        calls["llm"] += 1
+        return real_llm(*a, **k)
+
+    def charge():
+        calls["charge"] += 1
+
+    monkeypatch.setattr(app_module, "answer_message", answer)
+    monkeypatch.setattr(app_module, "llm_complete", llm_complete)
+    monkeypatch.setattr(app_module, "charge_ai", charge)
+    monkeypatch.setattr(app_module, "ai_degraded", lambda: False)
+    calls["set_corrector"] = lambda fn: monkeypatch.setattr(
+        app_module, "spell_correct_ar_en", lambda t: calls["correct"].append(t) or fn(t)
+    )
+    return calls
+
+
+def chat(client, message):
+    r = client.post("/api/chat", json={"message": message, "autocorrect": True})
+    assert r.status_code == 200
+    return r.get_json()
+
+
+def test_kb_hit_skips_the_corrector(client, spy):
+    spy["set_corrector"](lambda t: t + " مصحح")
+    body = chat(client, KB_Q)
+    assert body["source_type"] == "KB" and body["corrected_message"] == KB_Q
+    assert spy["correct"] == [] and spy["charge"] == 0
+
+
+def test_corrected_kb_hit_is_charged_once(client, spy):
+    spy["set_corrector"](lambda t: KB_Q)
+    body = chat(client, TYPO)
+    assert body["source_type"] == "KB" and body["corrected_message"] == KB_Q
+    assert spy["correct"] == [TYPO]
+    assert spy["answer"] == [(TYPO, True), (KB_Q, False)]  # إعادة الاستدعاء مرة واحدة بلا تصحيح
+    assert spy["charge"] == 1 and spy["llm"] == 0
+
+
+def test_recursion_runs_once_even_if_the_corrected_text_misses(client, spy):
+    # مصحّح "يغيّر دائماً": لو مُرِّر autocorrect للاستدعاء الداخلي لتكرر بلا نهاية
+    spy["set_corrector"](lambda t: t + " !")
+    body = chat(client, OFF_TOPIC)
+    assert body["source_type"] == "AI" and body["corrected_message"] == OFF_TOPIC + " !"
+    assert spy["correct"] == [OFF_TOPIC]
+    assert spy["answer"] == [(OFF_TOPIC, True), (OFF_TOPIC + " !", False)]
+    # خصم واحد لكل استدعاء LLM: التصحيح + الإجابة، لا خصم ثالث من إعادة الاستدعاء
+    assert spy["charge"] == 2 and spy["llm"] == 1
+
+
+def test_unchanged_correction_does_not_recurse(client, spy):
+    spy["set_corrector"](lambda t: t)
+    body = chat(client, OFF_TOPIC + " 2")
+    assert body["source_type"] == "AI"
+    assert spy["answer"] == [(OFF_TOPIC + " 2", True)]
+    assert spy["charge"] == 2 and spy["llm"] == 1
+
+
+def test_log_keeps_the_raw_message(client, app_module, spy):
+    spy["set_corrector"](lambda t: KB_Q)
+    chat(client, TYPO + " للسجل")
+    raw, corrected, rtype = app_module.DB.reader().execute(
+        "SELECT raw_query, corrected_query, response_type FROM logs ORDER BY id DESC LIMIT 1"
+    ).fetchone()
+    assert (raw, corrected, rtype) == (TYPO + " للسجل", KB_Q, "KB")
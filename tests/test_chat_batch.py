@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from rate_limit import RateLimited
+
+KB_Q = "ما هي شروط التبرع بالدم؟"
+AI_Q1 = "سؤال خارج القاعدة عن موضوع غريب جداً رقم واحد"
+AI_Q2 = "سؤال خارج القاعدة عن موضوع غريب جداً رقم اثنين"
+
+
+def logs_count(app_module):
+    return app_module.DB.reader().execute("SELECT COUNT(*) FROM logs").fetchone()[0]
+
+
+def test_batch_answers_in_order_and_dedups(client, app_module, monkeypatch):
+    searched = []
+    real = app_module.search_knowledge_base_many
+    monkeypatch.setattr(
+        app_module, "search_knowledge_base_many", lambda qs: searched.append(list(qs)) or real(searched[-1])
+    )
+    before = logs_count(app_module)
+    r = client.post("/api/chat/batch", json={"messages": [
+        KB_Q, "ما هيَ شروط التبرّع بالدم؟", {"message": KB_Q, "lang": "en"}, KB_Q, "",
+    ]})
+    body = r.get_json()
+    assert r.status_code == 200 and body["ok"]
+    assert body["count"] == 5 and body["unique"] == 3  # التشكيل لا يغيّر المفتاح؛ اللغة تغيّره
+    res = body["results"]
+    assert [x["source_type"] for x in res[:4]] == ["KB"] * 4
+    assert res[0] == res[1] == res[3]
+    assert res[2]["answer"] != res[0]["answer"]
+    assert res[4]["source_type"] == "Error"
+    assert len(searched) == 1 and len(searched[0]) == 3  # بحث KB واحد للدفعة، لكل نص فريد
+    assert logs_count(app_module) - before == 4  # كل رسالة مُجابة تُسجَّل حتى المكررة
+
+
+@pytest.mark.parametrize("payload", [{}, {"messages": []}, {"messages": "نص"}])
+def test_batch_rejects_bad_payloads(client, payload):
+    r = client.post("/api/chat/batch", json=payload)
+    assert r.status_code == 400 and not r.get_json()["ok"]
+
+
+def test_batch_size_limit(client, app_module):
+    r = client.post("/api/chat/batch", json={"messages": ["x"] * (app_module.CHAT_BATCH_MAX + 1)})
+    assert r.status_code == 413
+
+
+def test_rate_limited_item_does_not_fail_the_batch(client, app_module, monkeypatch):
+    charged = []
+
+    def charge_ai():
+        charged.append(1)
+        if len(charged) > 1:
+            raise RateLimited("ai", 2.5)
+
+    monkeypatch.setattr(app_module, "charge_ai", charge_ai)
+    monkeypatch.setattr(app_module, "ai_degraded", lambda: False)
+    r = client.post("/api/chat/batch", json={"messages": [AI_Q1, KB_Q, AI_Q2]})
+    res = r.get_json()["results"]
+    assert r.status_code == 200
+    assert res[1]["source_type"] == "KB"
+    limited = [x for x in (res[0], res[2]) if x.get("error") == "rate_limited"]
+    answered = [x for x in (res[0], res[2]) if x.get("source_type") == "AI"]
+    assert len(limited) == 1 and len(answered) == 1
+    assert limited[0] == {"ok": False, "error": "rate_limited", "retry_after": 3}
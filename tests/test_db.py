@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import os, sqlite3, threading, importlib.util
+
+import pytest
+
+import db as db_module
+from db import Database
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def db(tmp_path):
+    d = Database(str(tmp_path / "t.db"))
+    conn = d.writer()
+    with conn:
+        conn.execute("CREATE TABLE t(x INTEGER)")
+    yield d
+    d.close()
+
+
+def load_gunicorn_conf():
+    spec = importlib.util.spec_from_file_location("gunicorn_conf", os.path.join(ROOT, "gunicorn.conf.py"))
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def test_connections_are_reused_per_thread_and_isolated_between_threads(db):
+    assert db.writer() is db.writer()
+    assert db.reader() is db.reader()
+    assert db.reader() is not db.writer()
+    other = {}
+
+    def work():
+        other["writer"], other["reader"] = db.writer(), db.reader()
+        with other["writer"]:
+            other["writer"].execute("INSERT INTO t VALUES(1)")
+
+    t = threading.Thread(target=work)
+    t.start()
+    t.join()
+    assert other["writer"] is not db.writer()
+    assert other["reader"] is not db.reader()
+    assert db.reader().execute("SELECT COUNT(*) FROM t").fetchone()[0] == 1
+
+
+def test_reader_is_read_only_and_configured(db):
+    with pytest.raises(sqlite3.OperationalError, match="readonly"):
+        db.reader().execute("INSERT INTO t VALUES(1)")
+    assert db.writer().execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert db.reader().execute("PRAGMA busy_timeout").fetchone()[0] == int(db.timeout_s * 1000)
+
+
+def test_new_process_opens_its_own_connections(db, monkeypatch):
+    parent = db.writer()
+    monkeypatch.setattr(db_module.os, "getpid", lambda: -1)
+    child = db.writer()
+    assert child is not parent
+    db.close()  # يغلق اتصالات "العملية" الحالية فقط
+    parent.execute("SELECT 1")  # الموروث يُترك لعمليته
+    with pytest.raises(sqlite3.ProgrammingError):
+        child.execute("SELECT 1")
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="fork غير متاح")
+def test_forked_child_does_not_reuse_parent_connection(db):
+    parent = db.writer()
+    pid = os.fork()
+    if pid == 0:
+        ok = False
+        try:
+            conn = db.writer()
+            with conn:
+                conn.execute("INSERT INTO t VALUES(2)")
+            ok = conn is not parent
+        finally:
+            os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(status) == 0
+    parent.execute("SELECT 1")
+    assert db.reader().execute("SELECT x FROM t").fetchall() == [(2,)]
+
+
+def test_gunicorn_hooks_close_all_connections(db, tmp_path):
+    conf = load_gunicorn_conf()
+    other = Database(str(tmp_path / "other.db"), autocommit=True)
+    conns = [db.writer(), db.reader(), other.writer()]
+    for hook in (conf.pre_fork, conf.worker_exit):
+        hook(None, None)
+        for conn in conns:
+            with pytest.raises(sqlite3.ProgrammingError):
+                conn.execute("SELECT 1")
+        assert db.writer() is not conns[0]  # يُفتح اتصال جديد عند الحاجة
+        conns = [db.writer(), db.reader(), other.writer()]
+    assert conf.preload_app is True
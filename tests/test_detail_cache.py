@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import detail_cache
+from db import Database
+from detail_cache import DetailCache
+
+
+class Clock:
+    def __init__(self, t=1000.0):
+        self.t = t
+
+    def __call__(self):
+        return self.t
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = Clock()
+    monkeypatch.setattr(detail_cache.time, "time", c)
+    return c
+
+
+@pytest.fixture
+def db(tmp_path):
+    d = Database(str(tmp_path / "details.db"))
+    yield d
+    d.close()
+
+
+def make(db=None, **kw):
+    cache = DetailCache(db, **kw)
+    cache.init_db()
+    return cache
+
+
+def test_lru_evicts_least_recently_used(clock):
+    cache = make(max_items=2)
+    a = cache.put("A", "KB", "kb")
+    b = cache.put("B", "KB", "kb")
+    assert cache.get(a)["answer"] == "A"  # a صار الأحدث استخداماً
+    c = cache.put("C", "AI", "ai")
+    assert cache.get(b) is None
+    assert cache.get(a)["answer"] == "A" and cache.get(c)["source_type"] == "AI"
+    assert cache.stats == {"hits": 3, "shared_hits": 0, "misses": 1}
+
+
+def test_entries_expire_in_memory_and_sqlite(clock, db):
+    cache = make(db, ttl_s=60)
+    aid = cache.put("النص الكامل", "KB", "القاعدة المعرفية")
+    clock.t += 59
+    assert cache.get(aid)["answer"] == "النص الكامل"
+    clock.t += 2
+    assert cache.get(aid) is None
+    assert make(db, ttl_s=60).get(aid) is None  # ولا من SQLite
+
+
+def test_expired_rows_are_purged_on_write(clock, db, monkeypatch):
+    monkeypatch.setattr(detail_cache, "PURGE_EVERY", 3)
+    cache = make(db, ttl_s=10)
+    cache.put("قديم", "KB", "kb")
+    clock.t += 11
+    cache.put("جديد 1", "KB", "kb")
+    assert db.reader().execute("SELECT COUNT(*) FROM answer_details").fetchone()[0] == 2
+    cache.put("جديد 2", "KB", "kb")
+    assert db.reader().execute("SELECT COUNT(*) FROM answer_details").fetchone()[0] == 2
+
+
+def test_shared_between_workers_through_sqlite(clock, tmp_path):
+    # عاملان = ذاكرتان منفصلتان واتصالان منفصلان بنفس الملف
+    w1 = make(Database(str(tmp_path / "shared.db")))
+    w2 = make(Database(str(tmp_path / "shared.db")))
+    aid = w1.put("تفاصيل طويلة", "AI", "OpenAI")
+    assert w2.get(aid) == {"answer": "تفاصيل طويلة", "source_type": "AI", "source_text": "OpenAI"}
+    assert w2.stats["shared_hits"] == 1
+    assert w2.get("غير-موجود") is None and w2.stats["misses"] == 1
+
+
+def test_ids_are_unique_and_empty_id_misses(clock):
+    cache = make()
+    assert len({cache.put("x", "KB", "kb") for _ in range(50)}) == 50
+    assert cache.get("") is None and cache.get(None) is None
+
+
+# ---------- /api/chat: "تفاصيل أكثر" ----------
+
+KB_Q = "ما هي شروط التبرع بالدم؟"
+AI_Q = "سؤال خارج القاعدة عن موضوع غريب جداً للتفاصيل"
+
+
+@pytest.fixture
+def ai_calls(app_module, monkeypatch):
+    calls = []
+    monkeypatch.setattr(app_module, "charge_ai", lambda: calls.append(1))
+    monkeypatch.setattr(app_module, "ai_degraded", lambda: False)
+    return calls
+
+
+def test_more_details_returns_the_cached_full_text(client, ai_calls):
+    first = client.post("/api/chat", json={"message": AI_Q}).get_json()
+    aid = first.get("answer_id")
+    assert first["source_type"] == "AI" and aid
+    assert len(ai_calls) == 1
+    more = client.post("/api/chat", json={"message": "تفاصيل أكثر", "detail": True, "answer_id": aid})
+    body = more.get_json()
+    assert more.status_code == 200 and body["source_type"] == "AI"
+    assert len(body["answer"]) > len(first["answer"]) and "answer_id" not in body
+    assert len(ai_calls) == 1  # بلا استدعاء OpenAI جديد
+
+
+@pytest.mark.parametrize("aid", ["غير-موجود", "", None])
+def test_unknown_answer_id_falls_back_to_a_fresh_answer(client, aid):
+    r = client.post("/api/chat", json={"message": KB_Q, "detail": True, "answer_id": aid})
+    body = r.get_json()
+    assert r.status_code == 200 and body["source_type"] == "KB" and "answer_id" not in body
+
+
+def test_expired_answer_id_falls_back_to_a_fresh_answer(client, app_module, ai_calls, monkeypatch):
+    aid = client.post("/api/chat", json={"message": AI_Q + " 2"}).get_json()["answer_id"]
+    real = detail_cache.time.time
+    monkeypatch.setattr(detail_cache.time, "time", lambda: real() + app_module.DETAIL_CACHE.ttl_s + 1)
+    r = client.post("/api/chat", json={"message": AI_Q + " 2", "detail": True, "answer_id": aid})
+    assert r.status_code == 200 and r.get_json()["source_type"] == "AI"
+    assert len(ai_calls) == 2  # لا نص محفوظ: يُعاد الحساب
+    assert app_module.DETAIL_CACHE.get(aid) is None
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+import time
+
+import pytest
+
+import donor_match
+from db import Database
+from donor_match import DonorMatcher, compatible_donors, donor_location_fields, migrate
+from urgent_feed import UrgentFeed
+
+JEDDAH = (21.54, 39.17)
+NEED = {"hospital": "مستشفى شرق جدة", "blood_types": ["O+"], "component": "whole_blood",
+        "lat": JEDDAH[0], "lng": JEDDAH[1]}
+
+
+@pytest.fixture
+def db(tmp_path):
+    d = Database(str(tmp_path / "donors.db"))
+    conn = d.writer()
+    conn.execute(
+        """
+        CREATE TABLE reminders(
+            id INTEGER PRIMARY KEY AUTOINCREMENT, created_at TEXT, user_hint TEXT,
+            email TEXT, next_date TEXT, note TEXT
+        )
+        """
+    )
+    conn.commit()
+    migrate(conn)
+    migrate(conn)  # آمن للتكرار
+    yield d
+    d.close()
+
+
+def add_donor(db, email, blood_type, lat=None, lng=None, next_date="2000-01-01", opt_in=1):
+    lat, lng, cell = donor_location_fields(lat, lng)
+    conn = db.writer()
+    with conn:
+        conn.execute(
+            """
+            INSERT INTO reminders(email, user_hint, next_date, blood_type, lat, lng, geo_cell, notify_opt_in)
+            VALUES(?,?,?,?,?,?,?,?)
+            """,
+            (email, email.split("@")[0], next_date, blood_type, lat, lng, cell, opt_in),
+        )
+
+
+class Outbox:
+    def __init__(self, ok=True):
+        self.ok = ok
+        self.sent = []
+
+    def __call__(self, to, subject, body):
+        self.sent.append(to)
+        return (True, "ok") if self.ok else (False, "smtp down")
+
+
+def matcher(db, outbox, **kw):
+    kw.setdefault("cooldown_days", 0)
+    return DonorMatcher(db, outbox, lambda need, bt, hint: ("s", "b"), **kw)
+
+
+def statuses(db):
+    return db.reader().execute(
+        "SELECT status, attempts FROM donor_notifications ORDER BY id"
+    ).fetchall()
+
+
+def test_compatibility_rules():
+    assert compatible_donors("O-", "whole_blood") == ("O-",)
+    assert set(compatible_donors("A+", "red_cells")) == {"O-", "O+", "A-", "A+"}
+    assert compatible_donors("A+", "platelets") == ("A+",)
+    assert compatible_donors("X", "platelets") == ()
+
+
+def test_matches_compatible_eligible_donors_within_radius(db):
+    add_donor(db, "near@x", "O-", 21.55, 39.18)
+    add_donor(db, "far@x", "O-", 24.71, 46.67)  # الرياض
+    add_donor(db, "wrong@x", "AB+", 21.55, 39.18)
+    add_donor(db, "later@x", "O+", 21.55, 39.18, next_date="2999-01-01")
+    add_donor(db, "out@x", "O+", 21.55, 39.18, opt_in=0)
+    m = matcher(db, Outbox(), radius_km=30)
+    assert [r[1] for r in m.match_need(NEED, "O+")] == ["near@x"]
+
+
+def test_each_donor_notified_once_per_need(db):
+    add_donor(db, "a@x", "O+", *JEDDAH)
+    outbox = Outbox()
+    m = matcher(db, outbox)
+    m.process([NEED])
+    m.process([NEED])
+    assert outbox.sent == ["a@x"]
+    assert statuses(db) == [("sent", 1)]
+
+
+def test_same_hospital_notifies_again_after_need_ttl(db):
+    add_donor(db, "a@x", "O+", *JEDDAH)
+    outbox = Outbox()
+    m = matcher(db, outbox, need_ttl_days=14)
+    m.process([NEED])
+    conn = db.writer()
+    with conn:
+        conn.execute("UPDATE donor_notifications SET created_at = created_at - 15 * 86400")
+        conn.execute("UPDATE reminders SET last_notified_at = '2000-01-01 00:00:00'")
+    m.process([NEED])
+    assert outbox.sent == ["a@x", "a@x"]
+
+
+def test_cooldown_between_notifications(db):
+    add_donor(db, "a@x", "O+", *JEDDAH)
+    outbox = Outbox()
+    m = matcher(db, outbox, cooldown_days=7)
+    m.process([NEED])
+    m.process([dict(NEED, hospital="مستشفى آخر")])
+    assert outbox.sent == ["a@x"]
+
+
+def test_stale_queued_notifications_give_up_after_max_attempts(db, monkeypatch):
+    add_donor(db, "a@x", "O+", *JEDDAH)
+    m = matcher(db, Outbox())
+    claimed = []
+    # العامل "يتوقف" قبل كل إرسال: التنبيه يبقى queued
+    monkeypatch.setattr(m, "_deliver", lambda conn, nid, *a: claimed.append(nid))
+    m.process([NEED])
+    conn = db.writer()
+    for _ in range(donor_match.MAX_ATTEMPTS + 2):
+        with conn:
+            conn.execute(
+                "UPDATE donor_notifications SET created_at=?",
+                (time.time() - donor_match.STALE_QUEUED_S - 1,),
+            )
+        m.process([])
+    status, attempts = statuses(db)[0]
+    assert status == "failed" and attempts == donor_match.MAX_ATTEMPTS
+    assert len(claimed) == donor_match.MAX_ATTEMPTS
+
+
+def test_max_per_need_caps_notifications(db):
+    for i in range(5):
+        add_donor(db, f"d{i}@x", "O+", *JEDDAH)
+    outbox = Outbox()
+    m = matcher(db, outbox, max_per_need=3)
+    m.process([NEED])
+    m.process([NEED])
+    assert len(outbox.sent) == 3
+
+
+def test_fresh_feed_matches_needs_posted_while_worker_was_down(db):
+    add_donor(db, "a@x", "O+", *JEDDAH)
+    outbox = Outbox()
+    m = matcher(db, outbox)
+    feed = UrgentFeed(lambda: [NEED])
+    feed.listeners.append(m.on_diff)
+    feed.refresh()  # أول لقطة في عملية جديدة
+    m._executor().shutdown(wait=True)
+    assert statuses(db) == [("sent", 1)]
+    assert outbox.sent == ["a@x"]
+
+
+def test_polling_matches_without_subscribers_or_requests(db):
+    add_donor(db, "a@x", "O+", *JEDDAH)
+    outbox = Outbox()
+    m = matcher(db, outbox)
+    fetched = []
+    feed = UrgentFeed(lambda: fetched.append(1) or [NEED])
+    feed.listeners.append(m.on_diff)
+    feed.start_polling(0.01)
+    deadline = time.time() + 5
+    while (len(fetched) < 3 or not outbox.sent) and time.time() < deadline:
+        time.sleep(0.01)
+    feed.poll_s = None  # يتوقف الخيط بعد الدورة الحالية
+    assert len(fetched) >= 3 and feed.subscriber_count() == 0
+    assert outbox.sent == ["a@x"]
+
+
+def test_need_without_location_notifies_nobody(db):
+    add_donor(db, "a@x", "O+", *JEDDAH)
+    outbox = Outbox()
+    m = matcher(db, outbox)
+    nowhere = {k: v for k, v in NEED.items() if k not in ("lat", "lng")}
+    assert m.match_need(nowhere, "O+") == []
+    m.process([nowhere])
+    m.on_diff({"added": [dict(nowhere, lat=None, lng=None)]})
+    assert m._pool is None  # لم تُجدول أي مطابقة
+    assert outbox.sent == [] and statuses(db) == []
+
+
+def test_one_notification_per_email_across_reminder_rows(db):
+    add_donor(db, "Donor@X", "O+", *JEDDAH)
+    add_donor(db, " donor@x ", "O-", 21.60, 39.20)
+    add_donor(db, "other@x", "O+", *JEDDAH)
+    outbox = Outbox()
+    m = matcher(db, outbox)
+    assert [r[1] for r in m.match_need(NEED, "O+")] == ["Donor@X", "other@x"]  # الأقرب لكل بريد
+    m.process([NEED])
+    add_donor(db, "DONOR@x", "O+", *JEDDAH)  # تذكير جديد لنفس المتبرع بعد التنبيه
+    m.process([NEED])
+    assert sorted(outbox.sent) == ["Donor@X", "other@x"]
+
+
+def test_cooldown_is_per_email_not_per_row(db):
+    add_donor(db, "a@x", "O+", *JEDDAH)
+    outbox = Outbox()
+    m = matcher(db, outbox, cooldown_days=7)
+    m.process([NEED])
+    add_donor(db, "A@x", "O+", *JEDDAH)
+    m.process([dict(NEED, hospital="مستشفى آخر")])
+    assert outbox.sent == ["a@x"]
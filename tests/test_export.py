@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import csv, gzip, io, json
+
+import pytest
+
+ADMIN = {"Authorization": "Bearer test-admin"}
+TRICKY = [
+    "سؤال عادي بالعربية",
+    'فاصلة, و"علامات تنصيص" داخل النص',
+    "سطر أول\nسطر ثانٍ\r\nسطر ثالث",
+    "مختلط English, عربي 🩸",
+    "",
+    "آخر سؤال",
+    "سؤال سابع",
+]
+
+
+@pytest.fixture
+def seeded(app_module, monkeypatch):
+    """سجلات جديدة فقط (after_id = آخر id قبلها)، وصفحات صغيرة لاختبار حدود الصفحات."""
+    monkeypatch.setattr(app_module, "EXPORT_PAGE_SIZE", 2)
+    conn = app_module.DB.reader()
+    start = conn.execute("SELECT COALESCE(MAX(id), 0) FROM logs").fetchone()[0]
+    app_module.save_logs([(q, q, "KB", "kb", f"رد، على: {q}") for q in TRICKY])
+    return start
+
+
+def export(client, name="logs", **args):
+    return client.get(f"/api/export/{name}", query_string=args, headers=ADMIN)
+
+
+def test_csv_round_trips_arabic_commas_quotes_and_newlines(client, seeded):
+    r = export(client, after_id=seeded)
+    assert r.status_code == 200 and r.mimetype == "text/csv"
+    rows = list(csv.reader(io.StringIO(r.get_data(as_text=True), newline="")))
+    header, body = rows[0], rows[1:]
+    assert header[:3] == ["id", "timestamp", "raw_query"]
+    assert [row[2] for row in body] == TRICKY
+    assert [row[6] for row in body] == [f"رد، على: {q}" for q in TRICKY]  # bot_response من logs_v
+
+
+def test_keyset_pages_cover_every_row_once(client, seeded):
+    ids = [json.loads(line)["id"] for line in export(client, format="jsonl", after_id=seeded).data.splitlines()]
+    assert len(ids) == len(TRICKY) and ids == sorted(set(ids))  # 7 صفوف عبر 4 صفحات بحجم 2
+
+    # الاستكمال من منتصف صفحة، والحد عبر حدود الصفحات
+    resumed = [json.loads(l)["id"] for l in export(client, format="jsonl", after_id=ids[2]).data.splitlines()]
+    assert resumed == ids[3:]
+    limited = [json.loads(l)["id"] for l in export(client, format="jsonl", after_id=seeded, limit=5).data.splitlines()]
+    assert limited == ids[:5]
+    assert export(client, format="jsonl", after_id=ids[-1]).data == b""
+
+
+def test_time_filters(client, seeded):
+    assert export(client, format="jsonl", after_id=seeded, since="2000-01-01").data.count(b"\n") == len(TRICKY)
+    assert export(client, format="jsonl", after_id=seeded, until="2000-01-01T00:00:00Z").data == b""
+
+
+def test_response_streams_page_by_page(client, app_module, seeded, monkeypatch):
+    fetched = []
+    real = app_module._iter_export_pages
+
+    def spy(*a, **k):
+        for rows in real(*a, **k):
+            fetched.append(len(rows))
+            yield rows
+
+    monkeypatch.setattr(app_module, "_iter_export_pages", spy)
+    r = client.get("/api/export/logs", query_string={"after_id": seeded}, headers=ADMIN, buffered=False)
+    assert r.is_streamed and "Content-Length" not in r.headers
+    chunks = iter(r.response)
+    first = next(chunks)
+    assert fetched == [2]  # أول قطعة تُرسل بعد أول صفحة فقط
+    assert first.count(b"\n") == 3  # الترويسة + صفان
+    rest = b"".join(chunks)
+    assert fetched == [2, 2, 2, 1] and rest
+    r.close()
+
+
+def test_gzip_stream_matches_plain_output(client, seeded):
+    plain = export(client, after_id=seeded).data
+    r = export(client, after_id=seeded, gzip=1)
+    assert r.mimetype == "application/gzip" and r.headers["Content-Disposition"].endswith('.csv.gz"')
+    assert gzip.decompress(r.data) == plain
+
+
+@pytest.mark.parametrize(
+    "path, args, headers, status",
+    [
+        ("/api/export/logs", {}, {}, 401),
+        ("/api/export/secrets", {}, ADMIN, 404),
+        ("/api/export/logs", {"format": "xml"}, ADMIN, 400),
+        ("/api/export/logs", {"after_id": "x"}, ADMIN, 400),
+        ("/api/export/logs", {"since": "أمس"}, ADMIN, 400),
+    ],
+)
+def test_export_rejects_bad_requests(client, path, args, headers, status):
+    assert client.get(path, query_string=args, headers=headers).status_code == status
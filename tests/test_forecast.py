@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+from datetime import date, datetime, timedelta
+
+import pytest
+
+# أيام بعيدة في المستقبل لا يلمسها أي اختبار آخر؛ 2091-01-01 يوم اثنين
+BASE = date(2091, 1, 1)
+
+
+def bump(app_module, *days):
+    conn = app_module.DB.writer()
+    with conn:
+        for d, n in days:
+            app_module.bump_eligibility(conn, d.isoformat(), n)
+
+
+def forecast(client, **args):
+    r = client.get("/api/forecast", query_string=args)
+    return r.status_code, r.get_json()
+
+
+def test_days_rolling_window_and_week_buckets(client, app_module):
+    assert BASE.weekday() == 0
+    bump(
+        app_module,
+        (BASE - timedelta(days=3), 5),  # قبل from: داخل نافذة أول يوم فقط
+        (BASE - timedelta(days=7), 100),  # خارج النافذة (7 أيام) تماماً
+        (BASE, 1),
+        (BASE + timedelta(days=6), 2),  # الأحد: آخر يوم في الأسبوع الأول
+        (BASE + timedelta(days=7), 4),  # الاثنين: أول يوم في الأسبوع الثاني
+        (BASE + timedelta(days=13), 8),  # آخر يوم في المدى (to شامل)
+        (BASE + timedelta(days=14), 16),  # بعد to
+    )
+    bump(app_module, (BASE, 1))  # التحديث التراكمي لنفس اليوم
+    status, body = forecast(client, **{"from": BASE.isoformat(), "to": (BASE + timedelta(days=13)).isoformat(), "window": 7})
+    assert status == 200
+    days = {d["date"]: d for d in body["days"]}
+    assert len(days) == 14 and body["total"] == 2 + 2 + 4 + 8
+    first = days[BASE.isoformat()]
+    assert (first["eligible"], first["rolling"]) == (2, 7)  # 2 + الخمسة من قبل ثلاثة أيام
+    assert days[(BASE + timedelta(days=3)).isoformat()]["rolling"] == 7  # آخر يوم تبقى فيه الخمسة
+    assert days[(BASE + timedelta(days=4)).isoformat()]["rolling"] == 2  # خرجت بعد window يوماً
+    assert days[(BASE + timedelta(days=6)).isoformat()]["rolling"] == 4
+    assert days[(BASE + timedelta(days=7)).isoformat()]["rolling"] == 6  # خرج يوم BASE
+    assert body["weeks"] == [
+        {"week_start": BASE.isoformat(), "eligible": 4},
+        {"week_start": (BASE + timedelta(days=7)).isoformat(), "eligible": 12},
+    ]
+
+
+def test_partial_week_is_keyed_by_its_monday(client, app_module):
+    wed = BASE + timedelta(days=30)  # أربعاء
+    bump(app_module, (wed, 3))
+    _, body = forecast(client, **{"from": wed.isoformat(), "to": wed.isoformat(), "window": 1})
+    monday = wed - timedelta(days=wed.weekday())
+    assert body["weeks"] == [{"week_start": monday.isoformat(), "eligible": 3}]
+    assert body["days"] == [{"date": wed.isoformat(), "eligible": 3, "rolling": 3}]
+
+
+def test_reminder_bumps_the_day_90_days_out(client, app_module):
+    eligible = datetime.now().date() + timedelta(days=90)
+    q = {"from": (eligible - timedelta(days=1)).isoformat(), "to": eligible.isoformat(), "window": 1}
+    _, before = forecast(client, **q)
+    r = client.post("/api/reminder", json={"user_hint": "اختبار"})
+    assert r.status_code == 200 and r.get_json()["next_date"] == eligible.isoformat()
+    _, after = forecast(client, **q)
+    assert after["days"][0]["eligible"] == before["days"][0]["eligible"]  # اليوم 89: لم يصبح مؤهلاً بعد
+    assert after["days"][1]["eligible"] == before["days"][1]["eligible"] + 1
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        {"from": "2091-02-01", "to": "2091-01-01"},
+        {"from": "2091-01-01", "to": "2093-12-31"},
+        {"from": "غداً"},
+        {"window": "week"},
+    ],
+)
+def test_bad_ranges_are_rejected(client, args):
+    assert forecast(client, **args)[0] == 400
+
+
+def test_range_limit_boundary(client, app_module):
+    last = BASE + timedelta(days=app_module.FORECAST_MAX_DAYS - 1)
+    status, body = forecast(client, **{"from": BASE.isoformat(), "to": last.isoformat()})
+    assert status == 200 and len(body["days"]) == app_module.FORECAST_MAX_DAYS
+    assert forecast(client, **{"from": BASE.isoformat(), "to": (last + timedelta(days=1)).isoformat()})[0] == 400
+
+
+def test_window_is_clamped(client):
+    d = (BASE + timedelta(days=60)).isoformat()
+    assert forecast(client, **{"from": d, "to": d, "window": 0})[1]["window"] == 1
+    assert forecast(client, **{"from": d, "to": d, "window": 500})[1]["window"] == 90
+
+
+def test_histogram_backfills_existing_reminders_once(app_module):
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE reminders(id INTEGER PRIMARY KEY, next_date TEXT)")
+    conn.executemany(
+        "INSERT INTO reminders(next_date) VALUES(?)",
+        [("2091-03-01",), ("2091-03-01",), ("2091-03-02",), (None,)],
+    )
+    app_module.init_eligibility_histogram(conn)
+    app_module.init_eligibility_histogram(conn)  # لا يُعاد البناء ولا يتضاعف العدد
+    assert conn.execute("SELECT day, donors FROM eligibility_histogram ORDER BY day").fetchall() == [
+        ("2091-03-01", 2), ("2091-03-02", 1),
+    ]
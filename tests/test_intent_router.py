@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from chat_core import INTENT_ROUTER, INTENT_TABLE
+from intent_router import IntentRouter
+from text_norm import normalize_arabic
+
+
+@pytest.mark.parametrize(
+    "text, intent",
+    [
+        ("خدمة العملاء", "support"),
+        ("أبي أتواصل معكم", "support"),
+        ("contact us", "support"),
+        ("وين أتبرع", "centers"),
+        ("where can I donate?", "centers"),
+        ("الاحتياجات العاجلة", "urgent_needs"),
+        ("حملات التبرع", "campaigns"),
+        ("هل أنا مؤهل", "eligibility"),
+    ],
+)
+def test_routes_short_on_topic_messages(text, intent):
+    assert INTENT_ROUTER.match(text) == intent
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        # أسئلة محددة تذكر كلمة النية: تذهب إلى KB/AI لا إلى المعالج العام
+        "هل يحق لي التبرع وأنا آخذ مضاد حيوي",
+        "هل التبرع بالدم في الحملات آمن",
+        "I want to contact a hospital about platelets",
+        "كيف أتواصل مع بنك الدم بخصوص التبرع بالصفائح",
+        # جزء من كلمة أطول
+        "الخدمات التواصلية",
+        "contacting",
+        "",
+    ],
+)
+def test_does_not_route_specific_questions(text):
+    assert INTENT_ROUTER.match(text) is None
+
+
+def test_priority_wins_when_several_intents_match():
+    # support قبل campaigns في الجدول
+    assert INTENT_ROUTER.match("تواصل حملات") == "support"
+
+
+def test_proclitics_attach_to_arabic_keywords():
+    router = IntentRouter([("support", ["دعم"])], normalize_arabic)
+    assert router.match("والدعم") == "support"
+    assert router.match("وبالدعم") == "support"
+    assert router.match("الدعمية") is None
+
+
+def test_max_extra_tokens():
+    router = IntentRouter([("support", ["support"])], normalize_arabic, max_extra=1)
+    assert router.match("support now") == "support"
+    assert router.match("support right now") is None
+
+
+def test_intents_listed_in_table_order():
+    assert INTENT_ROUTER.intents == [name for name, _ in INTENT_TABLE]
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+import itertools, json, random
+
+import pytest
+
+import kb_build
+from kb_store import CompiledKB, KBFormatError, compile_kb, open_compiled, write_compiled
+from kb_validate import grams, similarity_join, validate_entries
+from llm_backends import StubBackend
+from text_norm import normalize_arabic
+
+ENTRIES = [
+    {"questions": ["ما هي شروط التبرع بالدم؟", "شروط التبرع"], "answer": "العمر 18-65 والوزن 50 كجم."},
+    {"questions": ["هل التبرع بالدم مؤلم؟"], "answer": "وخزة خفيفة فقط."},
+    {"questions": ["كم المدة بين كل تبرعين؟"], "answer": "90 يوماً على الأقل."},
+]
+
+
+def brute_force(texts, threshold):
+    sets = [grams(t) for t in texts]
+    out = set()
+    for i, j in itertools.combinations(range(len(texts)), 2):
+        sim = len(sets[i] & sets[j]) / len(sets[i] | sets[j])
+        if sim >= threshold:
+            out.add((i, j))
+    return out
+
+
+@pytest.mark.parametrize("threshold", [0.5, 0.6, 0.7, 0.8])
+def test_similarity_join_matches_brute_force(threshold):
+    rng = random.Random(7)
+    base = ["شروط التبرع بالدم", "التبرع بالصفائح", "مدة الانتظار بين التبرعات", "donate blood"]
+    texts = set()
+    while len(texts) < 120:
+        t = list(rng.choice(base))
+        for _ in range(rng.randint(0, 4)):
+            t.insert(rng.randrange(len(t) + 1), rng.choice("ابتثجحخدس "))
+        texts.add("".join(t))
+    texts = sorted(texts)
+    got = {(min(i, j), max(i, j)) for i, j, _ in similarity_join(texts, threshold)}
+    assert got == brute_force(texts, threshold)
+
+
+@pytest.mark.parametrize("threshold", [0.5, 0.6, 0.7, 0.75, 0.8, 0.9])
+def test_similarity_join_keeps_pairs_exactly_at_the_threshold(threshold):
+    # 34 حرفاً مختلفاً ⇒ 34 gram؛ البادئات تشترك في m-1 منها واتحادها 35
+    letters = "ابتثجحخدذرزسشصضطظعغفقكلمنهوي0123456789"[:34]
+    texts = [letters] + [letters[:m] for m in range(2, 34)]
+    got = {(min(i, j), max(i, j)) for i, j, _ in similarity_join(texts, threshold)}
+    assert got == brute_force(texts, threshold)
+    assert (0, 29) in got or threshold > 0.8  # 28 / 35 = 0.8 بالضبط
+
+
+def test_validate_reports_conflicts_duplicates_and_ambiguity():
+    entries = ENTRIES + [
+        {"questions": ["شروط  التبرع"], "answer": "إجابة مختلفة"},  # نفس السؤال بعد التطبيع
+        {"questions": ["هل التبرع بالدم مؤلم"], "answer": "وخزة خفيفة فقط."},
+        {"questions": ["هل التبرع بالدم مؤلم جدا؟"], "answer": "لا."},
+        {"questions": [""], "answer": ""},
+    ]
+    rep = validate_entries(entries, normalize_arabic, 0.7)
+    types = [e["type"] for e in rep["errors"]]
+    assert types.count("conflict") == 1
+    assert "empty_answer" in types and "empty_question" in types
+    assert any(w["type"] == "ambiguous" for w in rep["warnings"])
+
+
+def test_compiled_kb_round_trip(tmp_path):
+    kb = {
+        "سؤال أ": {"answer": "إجابة مشتركة", "source": "القاعدة المعرفية"},
+        "سؤال ب": {"answer": "إجابة مشتركة", "source": "القاعدة المعرفية"},
+        "question c": {"answer": "other", "source": "وزارة الصحة"},
+    }
+    data = compile_kb(kb, normalize_arabic, b"d" * 20)
+    path = str(tmp_path / "kb.kbc")
+    write_compiled(path, data)
+    ckb = open_compiled(path)
+    assert len(ckb) == 3 and ckb.n_answers == 2 and ckb.n_sources == 2
+    assert ckb.source_digest == b"d" * 20
+    got = {ckb.question(i): (ckb.answer(i), ckb.source(i)) for i in range(len(ckb))}
+    assert got == {q: (v["answer"], v["source"]) for q, v in kb.items()}
+    choices = ckb.normalized_items()
+    assert choices is ckb.normalized_items()  # يُفك مرة واحدة فقط
+    assert set(choices.values()) == {normalize_arabic(q) for q in kb}
+
+
+def test_compiled_kb_rejects_garbage():
+    with pytest.raises(KBFormatError):
+        CompiledKB(b"ZKB0" + b"\0" * 64)
+
+
+def write_entries(tmp_path, entries):
+    path = tmp_path / "knowledge_base.json"
+    path.write_text(json.dumps(entries, ensure_ascii=False), encoding="utf-8")
+    return str(path)
+
+
+def test_compile_command(tmp_path):
+    kb_path = write_entries(tmp_path, ENTRIES)
+    out = str(tmp_path / "kb.kbc")
+    assert kb_build.main(["compile", "--kb", kb_path, "--out", out]) == 0
+    assert len(open_compiled(out)) == 4
+
+
+def test_compile_refuses_conflicts(tmp_path):
+    kb_path = write_entries(tmp_path, ENTRIES + [{"questions": ["شروط التبرع"], "answer": "أخرى"}])
+    out = tmp_path / "kb.kbc"
+    assert kb_build.main(["compile", "--kb", kb_path, "--out", str(out)]) == 1
+    assert not out.exists()
+    assert kb_build.main(["compile", "--kb", kb_path, "--out", str(out), "--skip-validate"]) == 0
+
+
+def test_i18n_build_is_incremental(tmp_path):
+    kb_path = write_entries(tmp_path, ENTRIES)
+    out = str(tmp_path / "kb.i18n.json")
+    llm = StubBackend(latency_ms="0", tokens="fixed:5", keyed=True)
+    calls = []
+    real = llm.complete
+    llm.complete = lambda *a, **k: calls.append(1) or real(*a, **k)
+
+    assert kb_build.build_i18n(kb_path, out, llm=llm) == 0
+    data = json.loads(open(out, encoding="utf-8").read())
+    assert len(data["answers"]) == 3
+    item = next(iter(data["answers"].values()))
+    assert item["en"]["full"] and item["en"]["questions"] and item["ar"]["full"]
+
+    n = len(calls)
+    assert kb_build.build_i18n(kb_path, out, llm=llm) == 0
+    assert len(calls) == n  # لا شيء تغيّر ⇒ لا ترجمة
+
+
+def test_i18n_does_not_store_untranslated_text(tmp_path):
+    class Down(StubBackend):
+        def complete(self, messages, max_tokens=256, temperature=None):
+            raise RuntimeError("down")
+
+    kb_path = write_entries(tmp_path, ENTRIES)
+    out = str(tmp_path / "kb.i18n.json")
+    assert kb_build.build_i18n(kb_path, out, llm=Down()) == 1
+    assert json.loads(open(out, encoding="utf-8").read())["answers"] == {}
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import chat_core
+from chat_core import KBState, kb_answer_key, search_kb, set_kb_state, text_script
+from kb_store import CompiledKB, compile_kb
+from text_norm import normalize_arabic
+
+AR_KB = {
+    "ما هي شروط التبرع بالدم؟": {"answer": "العمر 18-60 والوزن 50 كجم فأكثر.", "source": "KB"},
+    "شروط التبرع": {"answer": "العمر 18-60 والوزن 50 كجم فأكثر.", "source": "KB"},
+    "هل التبرع مؤلم؟": {"answer": "وخزة خفيفة فقط.", "source": "وزارة الصحة"},
+}
+I18N = {
+    kb_answer_key("العمر 18-60 والوزن 50 كجم فأكثر."): {
+        "en": {"questions": ["What are the requirements to donate blood?", "Who can donate blood?"]}
+    },
+    kb_answer_key("وخزة خفيفة فقط."): {"en": {"questions": ["Does donating blood hurt?"]}},
+    kb_answer_key("إجابة حُذفت من القاعدة"): {"en": {"questions": ["Orphan question?"]}},
+}
+
+
+@pytest.fixture
+def state():
+    old = chat_core._STATE
+    st = KBState(CompiledKB(compile_kb(AR_KB, normalize_arabic)), I18N)
+    set_kb_state(st)
+    yield st
+    chat_core._STATE = old
+
+
+@pytest.mark.parametrize(
+    "text, script",
+    [
+        ("What are the requirements?", "en"),
+        ("ما هي الشروط", "ar"),
+        ("هل O+ يقدر يتبرع؟", "ar"),  # أحرف لاتينية قليلة داخل جملة عربية
+        ("Can I donate بالدم after covid", "en"),
+        ("ﻻ أعرف", "ar"),  # أشكال العرض العربية
+        ("123 ?!", "ar"),
+        ("", "ar"),
+    ],
+)
+def test_text_script(text, script):
+    assert text_script(text) == script
+
+
+def test_english_index_points_at_the_arabic_answer(state):
+    assert len(state.en_owners) == 3  # سؤال الإجابة المحذوفة لا يُفهرس
+    assert {state.kb.answer(i) for i in state.en_owners} == {
+        "العمر 18-60 والوزن 50 كجم فأكثر.", "وخزة خفيفة فقط.",
+    }
+
+
+def test_english_hit_above_threshold(state):
+    answer, source, score = search_kb("what are the REQUIREMENTS to donate blood")
+    assert answer == "العمر 18-60 والوزن 50 كجم فأكثر." and source == "KB"
+    assert score >= chat_core.KB_SIM_THRESHOLD
+    answer, source, score = search_kb("does donating blood hurt?")
+    assert (answer, source) == ("وخزة خفيفة فقط.", "وزارة الصحة") and score >= chat_core.KB_SIM_THRESHOLD
+
+
+def test_english_miss_falls_through(state):
+    _, _, score = search_kb("how do I reset my password")
+    assert score < chat_core.KB_SIM_THRESHOLD
+
+
+def test_mixed_script_routes_by_dominant_script(state):
+    # جملة عربية فيها "O+": تُبحث في الأسئلة العربية
+    answer, _, score = search_kb("ما هي شروط التبرع بالدم O+")
+    assert answer == "العمر 18-60 والوزن 50 كجم فأكثر." and score >= chat_core.KB_SIM_THRESHOLD
+    # جملة إنجليزية فيها كلمة عربية: تُبحث في الأسئلة الإنجليزية
+    answer, _, score = search_kb("does donating blood hurt الدم")
+    assert answer == "وخزة خفيفة فقط." and score >= chat_core.KB_SIM_THRESHOLD
+
+
+def test_english_without_i18n_never_matches_arabic_questions():
+    old = chat_core._STATE
+    try:
+        set_kb_state(KBState(CompiledKB(compile_kb(AR_KB, normalize_arabic)), {}))
+        assert search_kb("What are the requirements to donate blood?") == (None, None, 0)
+    finally:
+        chat_core._STATE = old
+
+
+def test_english_miss_in_chat_falls_through_to_ai(client):
+    body = client.post("/api/chat", json={"message": "how do I reset my password", "lang": "en"}).get_json()
+    assert body["source_type"] in ("AI", "Fallback")
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import json, struct
+
+import pytest
+
+import chat_core
+import kb_store
+from kb_store import CompiledKB, KBFormatError, compile_kb, file_digest, open_compiled, write_compiled
+from text_norm import normalize_arabic
+
+KB_JSON = [
+    {"questions": ["ما هي شروط التبرع بالدم؟", "شروط التبرع"], "answer": "العمر 18-60 والوزن ≥50 كجم."},
+    {"questions": ["هل التبرع مؤلم؟"], "answer": "وخزة خفيفة.", "source_type": "وزارة الصحة"},
+    {"questions": ["What are the requirements?"], "answer": "Age 18-60."},
+]
+
+
+@pytest.fixture
+def kb_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with open(chat_core.KB_PATH, "w", encoding="utf-8") as f:
+        json.dump(KB_JSON, f, ensure_ascii=False)
+    return tmp_path
+
+
+def as_dict(kb):
+    return {kb.question(i): kb.entry(i) for i in range(len(kb))}
+
+
+def compile_to_disk():
+    kb = chat_core.load_knowledge_base(chat_core.KB_PATH)
+    write_compiled(
+        chat_core.KB_COMPILED_PATH, compile_kb(kb, normalize_arabic, file_digest(chat_core.KB_PATH))
+    )
+    return kb
+
+
+def test_compile_then_open_round_trips_the_json_kb(kb_dir):
+    kb = compile_to_disk()
+    compiled = open_compiled(chat_core.KB_COMPILED_PATH)
+    assert len(compiled) == len(kb) == 4
+    assert as_dict(compiled) == kb
+    assert compiled.source_digest == file_digest(chat_core.KB_PATH)
+    assert compiled.n_answers == 3  # الإجابة المشتركة بين سؤالين تُخزَّن مرة واحدة
+    items = compiled.normalized_items()
+    assert items == {i: normalize_arabic(compiled.question(i)) for i in range(len(compiled))}
+    assert compiled.normalized_items() is items  # يُفك مرة واحدة لكل عملية
+
+
+def test_load_kb_store_prefers_the_matching_compiled_file(kb_dir):
+    compile_to_disk()
+    store = chat_core.load_kb_store()
+    assert store.path == chat_core.KB_COMPILED_PATH
+
+
+def test_stale_compiled_file_falls_back_to_json(kb_dir):
+    compile_to_disk()
+    data = KB_JSON + [{"questions": ["سؤال جديد"], "answer": "إجابة جديدة"}]
+    with open(chat_core.KB_PATH, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    store = chat_core.load_kb_store()
+    assert store.path is None and "سؤال جديد" in as_dict(store)
+
+
+@pytest.mark.parametrize(
+    "corrupt",
+    [
+        lambda d: d[:10],  # header مقطوع
+        lambda d: d[:-3],  # blob مقطوع
+        lambda d: b"XKB1" + d[4:],  # magic
+        lambda d: d[:4] + struct.pack("<I", kb_store.FORMAT_VERSION + 1) + d[8:],  # إصدار
+        lambda d: d[:8] + struct.pack("<I", 999) + d[12:],  # عدد أسئلة لا يطابق الجداول
+    ],
+)
+def test_corrupt_or_mismatched_file_fails_loudly_and_falls_back(kb_dir, corrupt):
+    kb = compile_to_disk()
+    with open(chat_core.KB_COMPILED_PATH, "rb") as f:
+        data = corrupt(f.read())
+    with pytest.raises(KBFormatError):
+        CompiledKB(data)
+    with open(chat_core.KB_COMPILED_PATH, "wb") as f:
+        f.write(data)
+    store = chat_core.load_kb_store()
+    assert store.path is None and as_dict(store) == kb
+
+
+def test_empty_kb_compiles():
+    compiled = CompiledKB(compile_kb({}, normalize_arabic))
+    assert len(compiled) == 0 and compiled.normalized_items() == {}
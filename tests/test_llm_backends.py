@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import random
+
+import pytest
+
+from llm_backends import LLMBackend, LLMError, RecordReplayBackend, StubBackend, parse_distribution
+
+MSG = [{"role": "user", "content": "هل التبرع آمن؟"}]
+
+
+def outcomes(backend, n=40):
+    out = []
+    for _ in range(n):
+        try:
+            out.append(round(backend.complete(MSG).latency_ms, 6))
+        except LLMError:
+            out.append("error")
+    return out
+
+
+def test_repeated_prompt_draws_new_latency_and_errors():
+    got = outcomes(StubBackend(latency_ms="uniform:0,1", error_rate=0.3))
+    assert "error" in got and len(set(got)) > 10
+
+
+def test_stub_is_reproducible_for_the_same_seed():
+    a = outcomes(StubBackend(latency_ms="uniform:0,1", error_rate=0.3, seed="s"))
+    b = outcomes(StubBackend(latency_ms="uniform:0,1", error_rate=0.3, seed="s"))
+    assert a == b
+
+
+def test_keyed_stub_replays_per_prompt():
+    stub = StubBackend(latency_ms="uniform:0,1", keyed=True)
+    first = stub.complete(MSG)
+    assert all(stub.complete(MSG) == first for _ in range(5))
+
+
+def test_base_backend_is_abstract():
+    with pytest.raises(TypeError):
+        LLMBackend()
+
+
+@pytest.mark.parametrize("spec", ["300", "fixed:300", "uniform:1,2", "normal:5,1",
+                                  "lognormal:1,0.5", "pareto:2,1.5"])
+def test_parse_distribution(spec):
+    assert parse_distribution(spec)(random.Random(1)) >= 0
+
+
+def test_parse_distribution_rejects_unknown():
+    with pytest.raises(ValueError):
+        parse_distribution("zipf:1")
+
+
+def test_record_then_replay(tmp_path):
+    path = str(tmp_path / "tape.jsonl")
+    rec = RecordReplayBackend(path, mode="record", inner=StubBackend(latency_ms="0"))
+    reply = rec.complete(MSG)
+    replay = RecordReplayBackend(path, mode="replay")
+    assert replay.complete(MSG).text == reply.text
+    with pytest.raises(LLMError):
+        replay.complete([{"role": "user", "content": "غير مسجل"}])
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import log_store
+from db import Database
+from log_store import ResponseStore, response_hash, train_zdict
+
+FOOTER = "مُولَّد آليًا • قد يحتوي على أخطاء طفيفة\nمع تحياتي فريق زمرة 🩸"
+
+
+@pytest.fixture
+def db(tmp_path):
+    d = Database(str(tmp_path / "logs.db"))
+    conn = d.writer()
+    conn.execute(
+        """
+        CREATE TABLE logs(
+            id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT, raw_query TEXT,
+            corrected_query TEXT, response_type TEXT, kb_source TEXT, bot_response TEXT
+        )
+        """
+    )
+    conn.commit()
+    yield d
+    d.close()
+
+
+def save(conn, store, text, legacy=False):
+    pending = []
+    with conn:
+        if legacy:
+            conn.execute("INSERT INTO logs(timestamp, bot_response) VALUES('t', ?)", (text,))
+        else:
+            conn.execute(
+                "INSERT INTO logs(timestamp, response_hash) VALUES('t', ?)",
+                (store.put(conn, text, pending),),
+            )
+    store.publish(pending)
+
+
+def read_all(d, store):
+    conn = store.attach(d.reader())
+    return [r[0] for r in conn.execute("SELECT bot_response FROM logs_v ORDER BY id")]
+
+
+def test_round_trip_with_dictionary(db):
+    store = ResponseStore(samples=lambda: [FOOTER])
+    conn = db.writer()
+    store.init(conn)
+    with conn:
+        store.ensure_dict(conn)
+    texts = [f"إجابة رقم {i}\n\n{FOOTER}" for i in range(5)] + ["", "short"]
+    for t in texts:
+        save(conn, store, t)
+    assert read_all(db, store) == [t or None for t in texts]
+    codecs = {c for (c,) in conn.execute("SELECT codec FROM responses")}
+    assert 1 in codecs  # النصوص الطويلة مضغوطة بالقاموس
+
+
+def test_identical_responses_stored_once(db):
+    store = ResponseStore()
+    conn = db.writer()
+    store.init(conn)
+    for _ in range(3):
+        save(conn, store, FOOTER)
+    assert conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0] == 1
+    assert conn.execute("SELECT COUNT(DISTINCT response_hash) FROM logs").fetchone()[0] == 1
+
+
+def test_rolled_back_response_is_stored_again(db):
+    store = ResponseStore()
+    conn = db.writer()
+    store.init(conn)
+    pending = []
+    with pytest.raises(RuntimeError):
+        with conn:
+            store.put(conn, FOOTER, pending)
+            raise RuntimeError("SQLITE_BUSY عند commit مثلاً")
+    assert conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0] == 0
+    assert response_hash(FOOTER) not in store._known
+    save(conn, store, FOOTER)
+    assert conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0] == 1
+    assert read_all(db, store) == [FOOTER]
+    assert response_hash(FOOTER) in store._known
+
+
+def test_put_never_trains_inside_the_callers_transaction(db, monkeypatch):
+    store = ResponseStore(samples=lambda: [FOOTER])
+    conn = db.writer()
+    store.init(conn)
+    monkeypatch.setattr(store, "train", lambda *a, **k: pytest.fail("train من داخل put"))
+    save(conn, store, FOOTER)
+    assert conn.execute("SELECT codec FROM responses").fetchone()[0] == 0
+    assert read_all(db, store) == [FOOTER]
+
+
+def test_legacy_rows_and_compact(db):
+    store = ResponseStore(samples=lambda: [FOOTER])
+    conn = db.writer()
+    store.init(conn)
+    old = [f"رد قديم {i}\n{FOOTER}" for i in range(5)]
+    for t in old:
+        save(conn, store, t, legacy=True)
+    assert read_all(db, store) == old
+    assert store.compact(conn, batch=2) == 5
+    assert conn.execute("SELECT COUNT(*) FROM logs WHERE bot_response IS NOT NULL").fetchone()[0] == 0
+    assert read_all(db, ResponseStore()) == old  # عملية جديدة تحمّل القواميس من قاعدة البيانات
+
+
+def test_retrain_keeps_old_rows_readable(db):
+    store = ResponseStore(samples=lambda: [FOOTER])
+    conn = db.writer()
+    store.init(conn)
+    with conn:
+        store.ensure_dict(conn)
+    save(conn, store, "أول رد " + FOOTER)
+    with conn:
+        assert store.train(conn, new_version=True) == 2
+    save(conn, store, "ثاني رد " + FOOTER)
+    assert read_all(db, ResponseStore()) == ["أول رد " + FOOTER, "ثاني رد " + FOOTER]
+
+
+def test_train_zdict_keeps_heaviest_last_and_bounded(monkeypatch):
+    monkeypatch.setattr(log_store, "ZDICT_MAX", 8)
+    zd = train_zdict([("heavy", 10), ("light", 1), ("heavy", 10)])
+    assert zd.endswith(b"heavy") and len(zd) <= 8
+
+
+def test_response_hash_is_stable():
+    assert response_hash("abc") == response_hash("abc")
+    assert len(response_hash("abc")) == 12
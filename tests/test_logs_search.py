@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+
+import pytest
+
+ADMIN = {"X-Admin-Token": "test-admin"}
+
+
+def counts(app_module):
+    conn = app_module.DB.reader()
+    return (
+        conn.execute("SELECT COUNT(*) FROM logs").fetchone()[0],
+        conn.execute("SELECT COUNT(*) FROM logs_fts").fetchone()[0],
+    )
+
+
+def search(client, **args):
+    return client.get("/api/logs/search", query_string=args, headers=ADMIN)
+
+
+def test_fts_normalize_and_query(app_module):
+    norm = app_module.fts_normalize
+    assert norm("بالصفائح") == norm("الصفائح") == norm("صفائح") == "صفايح"
+    assert norm("وَالبَلازما") == "بلازما"
+    assert norm("Platelets NEEDED") == "platelets needed"
+    assert norm("ال") == "ال"  # أداة تعريف بلا كلمة بعدها تبقى
+    q = app_module.fts_query
+    assert q('بالصفائح "O+"') == '"صفايح" "o"'
+    assert q("صفا", field="raw_query", prefix=True) == 'raw_query : ("صفا"*)'
+    assert q("  !!  ") == ""
+
+
+def test_search_matches_normalized_forms_with_filters_and_paging(client, app_module):
+    tag = "زمرةاختباربحث"
+    app_module.save_logs([
+        (f"{tag} هل يمكن التبرع بالصفائح؟", None, "AI", "OpenAI", "نعم، التبرع بالصفائح ممكن."),
+        (f"{tag} ما هي الصفائح", None, "KB", "القاعدة المعرفية", "الصفائح مكوّن من الدم."),
+        (f"{tag} سؤال آخر", None, "Fallback", None, "لا أعرف."),
+    ])
+    r = search(client, q=f"{tag} صفائح")
+    body = r.get_json()
+    assert r.status_code == 200 and body["count"] == 2
+    assert body["results"][0]["id"] > body["results"][1]["id"]  # الأحدث أولاً
+    assert body["results"][0]["bot_response"] == "الصفائح مكوّن من الدم."  # النص الكامل من logs_v
+
+    assert [x["response_type"] for x in search(client, q=f"{tag} صفائح", type="AI").get_json()["results"]] == ["AI"]
+    assert search(client, q="بالصفائح ممكن", **{"in": "query"}).get_json()["count"] == 0
+    assert search(client, q="بالصفائح ممكن", **{"in": "response"}).get_json()["count"] >= 1
+    assert search(client, q=tag[:6], prefix=1).get_json()["count"] >= 3
+
+    page1 = search(client, q=tag, limit=2).get_json()
+    assert page1["count"] == 2 and page1["next_before_id"] == page1["results"][-1]["id"]
+    page2 = search(client, q=tag, limit=2, before_id=page1["next_before_id"]).get_json()
+    assert page2["count"] == 1 and page2["next_before_id"] is None
+    ids = [x["id"] for x in page1["results"] + page2["results"]]
+    assert ids == sorted(ids, reverse=True) and len(set(ids)) == 3
+
+
+@pytest.mark.parametrize(
+    "headers, args, status",
+    [
+        ({}, {"q": "x"}, 401),
+        ({"X-Admin-Token": "wrong"}, {"q": "x"}, 401),
+        (ADMIN, {"q": "!!"}, 400),
+        (ADMIN, {"q": "x", "in": "body"}, 400),
+        (ADMIN, {"q": "x", "limit": "many"}, 400),
+    ],
+)
+def test_search_rejects_bad_requests(client, headers, args, status):
+    assert client.get("/api/logs/search", query_string=args, headers=headers).status_code == status
+
+
+def test_log_row_and_fts_row_are_written_atomically(app_module, monkeypatch):
+    before = counts(app_module)
+    real = app_module.fts_normalize
+
+    def failing(text):
+        if "يفشل الفهرس" in (text or ""):
+            raise sqlite3.OperationalError("fts insert failed")
+        return real(text)
+
+    monkeypatch.setattr(app_module, "fts_normalize", failing)
+    app_module.save_logs([
+        ("سجل سليم", None, "KB", "kb", "رد"),
+        ("يفشل الفهرس", None, "KB", "kb", "رد فريد لا يُحفظ"),
+    ])
+    assert counts(app_module) == before  # لا سجل بلا فهرسه، ولا نصف دفعة
+    monkeypatch.setattr(app_module, "fts_normalize", real)
+    app_module.save_logs([("بعد الفشل", None, "KB", "kb", "رد فريد لا يُحفظ")])
+    assert counts(app_module) == (before[0] + 1, before[1] + 1)
+    row = app_module.LOG_STORE.attach(app_module.DB.reader()).execute(
+        "SELECT bot_response FROM logs_v ORDER BY id DESC LIMIT 1"
+    ).fetchone()
+    assert row == ("رد فريد لا يُحفظ",)
+
+
+class NoFTS:
+    def execute(self, sql, *a):
+        raise sqlite3.OperationalError("no such module: fts5")
+
+
+def test_without_fts5_logs_are_saved_and_search_is_unavailable(client, app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "LOGS_FTS_READY", True)
+    app_module.init_logs_fts(NoFTS())
+    assert app_module.LOGS_FTS_READY is False
+    before = counts(app_module)
+    app_module.save_logs([("بلا فهرس", None, "KB", "kb", "رد")])
+    assert counts(app_module) == (before[0] + 1, before[1])
+    r = search(client, q="فهرس")
+    assert r.status_code == 503 and not r.get_json()["ok"]
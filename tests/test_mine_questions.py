@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import os, subprocess, sys
+
+import pytest
+
+import mine_questions as mq
+from db import Database
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b)
+
+
+def test_minhash_estimates_jaccard():
+    a = mq.shingles("ما هي شروط التبرع بالدم للنساء")
+    b = mq.shingles("ما هي شروط التبرع بالدم للرجال")
+    est = mq.estimated_jaccard(mq.minhash(a), mq.minhash(b))
+    assert abs(est - jaccard(a, b)) < 0.2
+    assert mq.estimated_jaccard(mq.minhash(a), mq.minhash(a)) == 1.0
+
+
+def test_similar_questions_share_a_band():
+    s1 = mq.minhash(mq.shingles("هل يمكنني التبرع بعد الحجامة"))
+    s2 = mq.minhash(mq.shingles("هل يمكنني التبرع بعد الحجامه"))
+    assert set(mq.band_keys(s1)) & set(mq.band_keys(s2))
+
+
+def test_cluster_index_groups_variants_and_persists(tmp_path):
+    idx = mq.ClusterIndex()
+    for raw in ["هل يمكنني التبرع بعد الحجامة", "هل يمكنني التبرع بعد الحجامه",
+                "هل يمكنني التبرع بعد الحجامة", "متى تفتح بنوك الدم في رمضان"]:
+        idx.add(raw, raw, "Fallback", "2026-01-01 10:00:00")
+    assert len(idx.clusters) == 2
+    top = idx.ranked(1)[0]
+    assert top["count"] == 3 and top["examples"][0] == {"text": "هل يمكنني التبرع بعد الحجامة", "count": 2}
+
+    path = str(tmp_path / "state.json")
+    idx.save(path)
+    again = mq.ClusterIndex.load(path)
+    again.add("هل يمكنني التبرع بعد الحجامة؟", "هل يمكنني التبرع بعد الحجامة؟", "AI", "2026-01-02")
+    assert len(again.clusters) == 2
+
+
+@pytest.fixture
+def logs_db(tmp_path):
+    path = str(tmp_path / "chat_logs.db")
+    db = Database(path)
+    conn = db.writer()
+    conn.execute(
+        "CREATE TABLE logs(id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT, raw_query TEXT, response_type TEXT)"
+    )
+    conn.commit()
+    yield path, db
+    db.close()
+
+
+def insert(db, rows):
+    conn = db.writer()
+    with conn:
+        conn.executemany(
+            "INSERT INTO logs(timestamp, raw_query, response_type) VALUES('2026-01-01', ?, ?)", rows
+        )
+
+
+def test_run_is_incremental(logs_db, tmp_path):
+    path, db = logs_db
+    state = str(tmp_path / "state.json")
+    insert(db, [("هل يمكنني التبرع بعد الحجامة", "Fallback"), ("شروط التبرع", "KB")])
+    idx = mq.run(path, state)
+    assert idx.last_id == 1 and sum(c["count"] for c in idx.clusters) == 1  # KB ليس غير مُجاب
+
+    insert(db, [("هل يمكنني التبرع بعد الحجامه", "AI")])
+    idx = mq.run(path, state)
+    assert idx.last_id == 3 and len(idx.clusters) == 1 and idx.clusters[0]["count"] == 2
+
+
+def test_maintenance_scripts_import_without_booting_the_app(tmp_path):
+    # لا قاعدة بيانات ولا ratelimit.db ولا uploads عند الاستيراد (تُشغَّل أثناء البناء)
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    subprocess.run(
+        [sys.executable, "-c", "import kb_build, replay_logs, mine_questions, log_store, chat_core"],
+        cwd=tmp_path, env=env, check=True, capture_output=True,
+    )
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import rate_limit
+from rate_limit import TokenBucketLimiter, parse_policy
+
+
+@pytest.fixture
+def limiter(tmp_path):
+    lim = TokenBucketLimiter(str(tmp_path / "rl.db"), {"ai": parse_policy("2/600")})
+    lim.init_db()
+    yield lim
+    lim.db.close()
+
+
+def test_parse_policy():
+    assert parse_policy("30/60") == (30.0, 0.5)
+    with pytest.raises(ValueError):
+        parse_policy("0/60")
+
+
+def test_bucket_allows_capacity_then_blocks(limiter):
+    assert limiter.take("c1", "ai") == 0
+    assert limiter.take("c1", "ai") == 0
+    wait = limiter.take("c1", "ai")
+    assert 0 < wait <= 300
+    # عميل آخر له دلوه الخاص
+    assert limiter.take("c2", "ai") == 0
+
+
+def test_block_served_from_memory(limiter, monkeypatch):
+    for _ in range(3):
+        limiter.take("c1", "ai")
+    assert ("c1", "ai") in limiter._blocked
+
+    def no_db():
+        raise AssertionError("الحظر يجب أن يُرد من الذاكرة")
+
+    monkeypatch.setattr(limiter, "_conn", no_db)
+    assert limiter.take("c1", "ai") > 0
+
+
+def test_bucket_refills(limiter, monkeypatch):
+    limiter.take("c1", "ai")
+    limiter.take("c1", "ai")
+    t = rate_limit.time.time()
+    m = rate_limit.time.monotonic()
+    monkeypatch.setattr(rate_limit.time, "time", lambda: t + 301)
+    monkeypatch.setattr(rate_limit.time, "monotonic", lambda: m + 301)
+    assert limiter.take("c1", "ai") == 0
+
+
+def test_blocked_cache_is_bounded(limiter, monkeypatch):
+    monkeypatch.setattr(rate_limit, "BLOCKED_MAX", 50)
+    for i in range(200):
+        limiter._remember_block((f"c{i}", "ai"), rate_limit.time.monotonic() + 60)
+    assert len(limiter._blocked) == 50
+    # الأحدث يبقى
+    assert ("c199", "ai") in limiter._blocked
+
+
+def test_usage_accumulates(limiter):
+    limiter.record_usage("c1", 100)
+    limiter.record_usage("c1", 50)
+    assert limiter.tokens_today("c1") == 150
+    assert limiter.usage_report()[0] == {"client": "c1", "ai_calls": 2, "tokens": 150}
+
+
+def test_usage_endpoint_reports_resolved_day(client, app_module, limiter, monkeypatch):
+    monkeypatch.setattr(app_module, "RATE_LIMITER", limiter)
+    limiter.record_usage("c1", 7)
+    h = {"X-Admin-Token": "test-admin"}
+    body = client.get("/api/usage", headers=h).get_json()
+    assert body["day"] == limiter.today() and body["clients"][0]["tokens"] == 7
+    body = client.get("/api/usage?day=2000-01-01", headers=h).get_json()
+    assert body == {"ok": True, "day": "2000-01-01", "clients": []}
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import random, re, unicodedata
+
+import pytest
+
+from text_norm import normalize_arabic, normalize_arabic_cached, normalize_many
+
+_DIACRITICS_RE = re.compile(r"[\u0617-\u061A\u064B-\u0652\u0670\u0653-\u065F\u06D6-\u06ED]")
+
+
+def reference(text):
+    """التطبيع متعدد المرور (المرجع الذي يجب أن يطابقه الجدول الواحد حرفاً بحرف)."""
+    if not text:
+        return ""
+    t = _DIACRITICS_RE.sub("", text)
+    for a, b in (("أ", "ا"), ("إ", "ا"), ("آ", "ا"), ("ؤ", "و"), ("ئ", "ي"), ("ة", "ه"), ("ـ", "")):
+        t = t.replace(a, b)
+    t = unicodedata.normalize("NFKC", t)
+    return re.sub(r"\s+", " ", t).strip()
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("مَا هِيَ شُرُوطُ التَّبَرُّعِ؟", "ما هي شروط التبرع؟"),
+        ("أإآ ؤ ئ ة", "ااا و ي ه"),
+        ("التـــبرع", "التبرع"),
+        ("ﻷ", "لأ"),  # أشكال العرض تُفك بعد التوحيد (كالترتيب القديم)
+        ("  Blood\tdonation \n", "Blood donation"),
+        ("", ""),
+    ],
+)
+def test_examples(text, expected):
+    assert normalize_arabic(text) == expected
+
+
+def test_matches_reference_on_random_text():
+    rng = random.Random(3)
+    alphabet = "ابتةأإآؤئـ \t\nًِٰﻷﻻ؟Ab1"
+    for _ in range(2000):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 20)))
+        assert normalize_arabic(text) == reference(text), repr(text)
+
+
+def test_cached_and_batch_agree():
+    texts = ["شُرُوط", "شروط", "  التبرع ", "شُرُوط"]
+    expected = [normalize_arabic(t) for t in texts]
+    assert normalize_many(texts) == expected
+    assert [normalize_arabic_cached(t) for t in texts] == expected
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+import contextvars
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import tracing
+from tracing import Tracer, span
+
+
+def lines(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "traces.jsonl")
+
+
+def test_unsampled_fast_trace_writes_nothing(path):
+    tracer = Tracer(path, sample_rate=0, slow_ms=10_000)
+    trace, token = tracer.start("GET /x")
+    with span("kb_search"):
+        pass
+    assert tracer.finish(trace, token) is False
+    assert tracing.current_trace() is None
+    assert not os.path.exists(path)
+
+
+def test_sampled_trace_is_written_with_spans(path):
+    tracer = Tracer(path, sample_rate=0, slow_ms=10_000)
+    trace, token = tracer.start("POST /api/chat", trace_id="abcdef12", force=True)
+    with span("kb_search", q_len=3) as sp:
+        sp.set(score=90)
+    with pytest.raises(KeyError):
+        with span("llm"):
+            raise KeyError("x")
+    assert tracer.finish(trace, token, status=200) is True
+    (row,) = lines(path)
+    assert row["trace_id"] == "abcdef12" and row["sampled"] and row["attrs"] == {"status": 200}
+    assert [(s["name"], s.get("score"), s.get("error")) for s in row["spans"]] == [
+        ("kb_search", 90, None), ("llm", None, "KeyError"),
+    ]
+
+
+def test_slow_trace_is_always_kept(path):
+    tracer = Tracer(path, sample_rate=0, slow_ms=50)
+    trace, token = tracer.start("POST /api/chat")
+    assert not trace.sampled
+    trace.t0 -= 0.2  # كأن الطلب استغرق 200ms
+    assert tracer.finish(trace, token) is True
+    (row,) = lines(path)
+    assert row["attrs"]["slow"] is True and row["sampled"] is False
+    assert row["duration_ms"] >= 200
+
+
+def test_disabled_tracer_and_span_outside_a_trace(path):
+    tracer = Tracer(path, enabled=False)
+    assert tracer.start("GET /x", force=True) == (None, None)
+    assert tracer.finish(None) is False
+    assert span("anything") is tracing._NO_SPAN
+
+
+def test_clean_id():
+    assert Tracer.clean_id(" abcdef12 ") == "abcdef12"
+    assert Tracer.clean_id("short") is None
+    assert Tracer.clean_id("abcdefgh-xyz") is None  # أحرف خارج الست عشري
+    assert Tracer.clean_id("a" * 65) is None
+
+
+def test_rotation_keeps_one_old_file_and_find_reads_both(path):
+    tracer = Tracer(path, sample_rate=1, slow_ms=0, max_bytes=600)
+    ids = [f"{i:08x}" for i in range(12)]
+    for tid in ids:
+        trace, token = tracer.start("GET /x", trace_id=tid)
+        trace.attrs["pad"] = "ز" * 40
+        tracer.finish(trace, token)
+    assert os.path.getsize(path) <= 600
+    assert os.path.exists(path + ".1")
+    current, rotated = lines(path), lines(path + ".1")
+    assert current[-1]["trace_id"] == ids[-1]
+    assert tracer.find(current[0]["trace_id"])["trace_id"] == current[0]["trace_id"]
+    assert tracer.find(rotated[0]["trace_id"]) is not None
+    assert tracer.find("ffffffff") is None
+
+
+def test_concurrent_appends_never_interleave(path):
+    tracer = Tracer(path, sample_rate=1, slow_ms=0, max_bytes=0)
+
+    def work(n):
+        for i in range(25):
+            trace, token = tracer.start("GET /x", trace_id=f"{n:04x}{i:04x}")
+            trace.attrs["pad"] = "د" * 500
+            tracer.finish(trace, token)
+
+    threads = [threading.Thread(target=work, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    rows = lines(path)  # كل سطر JSON كامل
+    assert len({r["trace_id"] for r in rows}) == 200
+
+
+def test_pool_spans_attach_only_through_copy_context(path):
+    tracer = Tracer(path, sample_rate=1)
+    trace, token = tracer.start("POST /api/chat/batch")
+
+    def item(name):
+        with span(name):
+            return tracing.current_trace()
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        seen = [pool.submit(contextvars.copy_context().run, item, f"item{i}").result() for i in range(3)]
+        lost = pool.submit(item, "no_ctx").result()
+    tracer.finish(trace, token)
+    assert seen == [trace] * 3 and lost is None
+    assert sorted(s[0] for s in trace.spans) == ["item0", "item1", "item2"]
+
+
+def test_batch_endpoint_records_pool_thread_spans(client, app_module, path, monkeypatch):
+    monkeypatch.setattr(app_module, "TRACER", Tracer(path, sample_rate=0, slow_ms=0))
+    msgs = [f"سؤال تتبّع خارج القاعدة عن موضوع بعيد رقم {w}" for w in ("واحد", "اثنين")]
+    r = client.post("/api/chat/batch", json={"messages": msgs}, headers={"X-Trace-Sample": "1"})
+    assert r.status_code == 200
+    tid = r.headers["X-Trace-Id"]
+    row = app_module.TRACER.find(tid)
+    names = [s["name"] for s in row["spans"]]
+    assert names.count("llm") == 2  # من خيوط المجمّع، داخل trace الطلب نفسه
+    assert "kb_search" in names and row["attrs"]["status"] == 200
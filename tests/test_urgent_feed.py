@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+import time
+
+from urgent_feed import UrgentFeed, diff_snapshots
+
+A = {"hospital": "أ", "status": "عاجل", "details": "O+"}
+B = {"hospital": "ب", "status": "عاجل", "details": "A-"}
+
+
+class Source:
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return list(self.rows)
+
+
+def wait_for(cond, timeout=5.0):
+    deadline = time.time() + timeout
+    while not cond() and time.time() < deadline:
+        time.sleep(0.005)
+    return cond()
+
+
+def test_diff_snapshots():
+    old = {"أ": A, "ب": B}
+    new = {"أ": dict(A, status="مكتمل"), "ج": {"hospital": "ج"}}
+    d = diff_snapshots(old, new)
+    assert d == {"added": [{"hospital": "ج"}], "removed": ["ب"], "changed": [new["أ"]]}
+    assert diff_snapshots(old, old) == {"added": [], "removed": [], "changed": []}
+
+
+def test_etag_depends_on_content_only():
+    src = Source([A, B])
+    feed = UrgentFeed(src)
+    _, etag1, _ = feed.snapshot()
+    feed.refresh()
+    assert feed.snapshot()[1] == etag1
+    src.rows = [A]
+    feed.refresh()
+    assert feed.snapshot()[1] != etag1
+
+
+def test_snapshot_is_cached_for_max_age():
+    src = Source([A])
+    feed = UrgentFeed(src, refresh_s=60)
+    feed.snapshot()
+    feed.snapshot()
+    assert src.calls == 1
+    feed.snapshot(max_age=0)
+    assert src.calls == 2
+
+
+def test_subscribers_get_diffs_not_the_first_snapshot():
+    src = Source([A])
+    feed = UrgentFeed(src, refresh_s=60)
+    q = feed.subscribe()
+    feed.refresh()  # أول لقطة: المشترك يقرأها بنفسه عند الاتصال
+    assert q.empty()
+    src.rows = [dict(A, status="مكتمل"), B]
+    feed.refresh()
+    diff = q.get_nowait()
+    assert [r["hospital"] for r in diff["added"]] == ["ب"]
+    assert [r["status"] for r in diff["changed"]] == ["مكتمل"]
+    assert diff["etag"] == feed.snapshot()[1]
+    feed.refresh()  # بلا تغيير: لا فرق
+    assert q.empty()
+    feed.unsubscribe(q)
+
+
+def test_subscriber_limit_and_cleanup():
+    feed = UrgentFeed(Source([A]), refresh_s=60, max_clients=2)
+    q1, q2 = feed.subscribe(), feed.subscribe()
+    assert q1 and q2 and feed.subscribe() is None
+    feed.unsubscribe(q1)
+    assert feed.subscriber_count() == 1
+    q3 = feed.subscribe()
+    assert q3 is not None
+    feed.unsubscribe(q2)
+    feed.unsubscribe(q3)
+    feed.unsubscribe(q3)  # آمن للتكرار
+    assert feed.subscriber_count() == 0
+
+
+def test_background_thread_runs_only_while_subscribed():
+    src = Source([A])
+    feed = UrgentFeed(src, refresh_s=0.01)
+    feed.snapshot()
+    time.sleep(0.05)
+    assert feed._thread is None and src.calls == 1  # بلا مشتركين لا جلب في الخلفية
+    q = feed.subscribe()
+    assert wait_for(lambda: src.calls >= 3)
+    feed.unsubscribe(q)
+    assert wait_for(lambda: feed._thread is None)
+    calls = src.calls
+    time.sleep(0.05)
+    assert src.calls == calls
+    q = feed.subscribe()  # يُعاد تشغيل الخيط مع أول اشتراك جديد
+    assert feed._thread is not None and wait_for(lambda: src.calls > calls)
+    feed.unsubscribe(q)
+
+
+def test_failed_fetch_keeps_the_last_snapshot():
+    def boom():
+        raise OSError("sheet down")
+
+    src = Source([A])
+    feed = UrgentFeed(src)
+    rows, etag, _ = feed.snapshot()
+    feed.fetch_rows = boom
+    feed.refresh()
+    assert feed.snapshot(max_age=3600)[:2] == (rows, etag)
+
+
+# ---------- /api/urgent_needs و SSE ----------
+
+
+def test_urgent_needs_etag_and_304(client):
+    r = client.get("/api/urgent_needs")
+    assert r.status_code == 200 and r.get_json()["needs"]
+    etag = r.headers["ETag"]
+    r2 = client.get("/api/urgent_needs", headers={"If-None-Match": etag})
+    assert r2.status_code == 304 and r2.headers["ETag"] == etag and not r2.data
+    r3 = client.get("/api/urgent_needs?lang=en", headers={"If-None-Match": etag})
+    assert r3.status_code == 200 and r3.headers["ETag"] != etag  # الوسم يشمل اللغة
+
+
+def test_sse_stream_sends_snapshot_then_diffs_and_unsubscribes(client, app_module, monkeypatch):
+    feed = app_module.URGENT_FEED
+    monkeypatch.setattr(feed, "refresh_s", 3600)
+    base = feed.snapshot()[0]
+    r = client.get("/api/urgent_needs/stream", buffered=False)
+    assert r.status_code == 200 and r.mimetype == "text/event-stream"
+    chunks = iter(r.response)
+    assert next(chunks).startswith(b"retry:")
+    assert next(chunks).startswith(b"event: snapshot\n")
+    assert feed.subscriber_count() == 1
+
+    new = dict(base[0], hospital="مستشفى اختبار SSE")
+    monkeypatch.setattr(feed, "fetch_rows", lambda: base + [new])
+    feed.refresh()
+    diff = next(chunks).decode("utf-8")
+    assert diff.startswith("event: diff\n") and "مستشفى اختبار SSE" in diff
+
+    r.close()  # انقطاع العميل ⇒ GeneratorExit ⇒ finally
+    assert feed.subscriber_count() == 0
+    monkeypatch.setattr(feed, "fetch_rows", lambda: base)
+    feed.refresh()
+
+
+def test_sse_rejects_when_full(client, app_module, monkeypatch):
+    feed = app_module.URGENT_FEED
+    monkeypatch.setattr(feed, "max_clients", 0)
+    r = client.get("/api/urgent_needs/stream")
+    assert r.status_code == 503 and r.headers["Retry-After"]
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+import random
+
+import pytest
+from fuzzywuzzy import fuzz
+
+from text_norm import normalize_arabic
+from urgent_index import (
+    CenterLocator, UrgentIndex, geo_cell, geo_cells_within, haversine_km,
+    parse_blood_types, parse_component, parse_need, parse_urgency,
+)
+
+CENTERS = [
+    {"name": "مستشفى الملك فهد العام بجدة", "lat": 21.6148, "lng": 39.1558},
+    {"name": "مستشفى شرق جدة", "lat": 21.5300, "lng": 39.2500},
+    {"name": "مركز بلا إحداثيات", "lat": "", "lng": None},
+]
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("نحتاج +O و B-", ["O+", "B-"]),
+        ("فصيلة O سالب عاجل", ["O-"]),
+        ("A موجب", ["A+"]),
+        ("AB+ ثم AB-", ["AB+", "AB-"]),
+        ("O+ O+ مكرر", ["O+"]),
+        ("need A positive and o negative", ["A+", "O-"]),
+        ("A platelets donor needed", []),  # "A" بلا إشارة ليس فصيلة
+        ("ABO+ غير صالحة", []),
+        ("", []),
+    ],
+)
+def test_parse_blood_types(text, expected):
+    assert parse_blood_types(text) == expected
+
+
+def test_parse_component_and_urgency():
+    assert parse_component("نحتاج صفائح دموية") == "platelets"
+    assert parse_component("Plasma donors") == "plasma"
+    assert parse_component("كريات حمراء مركزة") == "red_cells"
+    assert parse_component("PRBC units") == "red_cells"
+    assert parse_component("O+") == "whole_blood"
+    assert parse_urgency("عاجل جداً") == "critical"
+    assert parse_urgency("مرتفع") == "high"
+    assert parse_urgency("High") == "high"
+    assert parse_urgency("مكتمل") == "normal"
+
+
+def test_center_locator_exact_fuzzy_and_miss():
+    loc = CenterLocator(CENTERS, normalize_arabic, score_fn=fuzz.token_set_ratio)
+    assert loc.locate("مستشفى شرق جدة") == (21.53, 39.25)
+    assert loc.locate("مستشفي الملك فهد العام - جدة") == (21.6148, 39.1558)
+    assert loc.locate("مستوصف في الرياض") is None
+    assert loc.locate("مركز بلا إحداثيات") is None  # بلا إحداثيات صالحة لا يُفهرس
+    assert loc.locate("") is None
+    exact = CenterLocator(CENTERS, normalize_arabic)  # بلا score_fn: تطابق الاسم المطبّع فقط
+    assert exact.locate("مُسْتَشْفَى شرق  جدة") == (21.53, 39.25)
+    assert exact.locate("مستشفى شرق جده الجديد") is None
+
+
+def test_parse_need_prefers_row_coordinates_over_locator():
+    loc = CenterLocator(CENTERS, normalize_arabic)
+    need = parse_need({"hospital": "مستشفى شرق جدة", "details": "O سالب صفائح", "status": "عاجل"}, loc)
+    assert (need["blood_types"], need["component"], need["urgency"], need["urgency_level"]) == (
+        ["O-"], "platelets", "critical", 3,
+    )
+    assert (need["lat"], need["lng"]) == (21.53, 39.25)
+    own = parse_need({"hospital": "مستشفى شرق جدة", "lat": "21.1", "lng": "39.9"}, loc)
+    assert (own["lat"], own["lng"]) == (21.1, 39.9)
+    assert parse_need({"hospital": "؟", "lat": "nan", "lng": "x"})["lat"] is None
+
+
+def test_haversine_known_distance():
+    # جدة → الرياض ≈ 850 كم
+    assert 840 < haversine_km(21.54, 39.17, 24.71, 46.67) < 860
+    assert haversine_km(21.5, 39.2, 21.5, 39.2) == 0
+
+
+def _needs(rng, n):
+    out = []
+    for i in range(n):
+        lat, lng = rng.uniform(16, 32), rng.uniform(35, 55)
+        out.append({
+            "hospital": f"h{i}", "lat": lat, "lng": lng,
+            "blood_types": rng.sample(["O-", "O+", "A+", "B-", "AB+"], rng.randint(0, 2)),
+            "urgency_level": rng.randint(1, 3),
+        })
+    out.append({"hospital": "بلا موقع", "lat": None, "lng": None, "blood_types": ["O-"], "urgency_level": 3})
+    return out
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_grid_radius_query_matches_brute_force(seed):
+    rng = random.Random(seed)
+    needs = _needs(rng, 600)
+    index = UrgentIndex(needs)
+    for _ in range(40):
+        lat, lng = rng.uniform(16, 32), rng.uniform(35, 55)
+        radius = rng.choice([1, 10, 25, 120, 500])
+        bt = rng.choice([None, "O-", "A+"])
+        got = [(n["hospital"], round(d, 9)) for n, d in index.query(blood_type=bt, near=(lat, lng), radius_km=radius)]
+        want = sorted(
+            (
+                (n["hospital"], round(haversine_km(lat, lng, n["lat"], n["lng"]), 9))
+                for n in needs
+                if n["lat"] is not None
+                and haversine_km(lat, lng, n["lat"], n["lng"]) <= radius
+                and (bt is None or bt in n["blood_types"])
+            ),
+            key=lambda x: x[1],
+        )
+        assert got == want
+
+
+def test_query_without_location_orders_by_urgency():
+    needs = _needs(random.Random(9), 50)
+    index = UrgentIndex(needs)
+    hits = index.query(blood_type="O-", min_urgency=2, limit=5)
+    levels = [n["urgency_level"] for n, d in hits]
+    assert levels == sorted(levels, reverse=True) and min(levels) >= 2 and len(hits) <= 5
+    assert all("O-" in n["blood_types"] and d is None for n, d in hits)
+    assert len(index.query()) == len(needs)
+
+
+def test_geo_cells_within_contains_every_point_in_radius():
+    rng = random.Random(3)
+    for _ in range(300):
+        lat, lng = rng.uniform(16, 32), rng.uniform(35, 55)
+        radius = rng.choice([5, 30, 100])
+        cells = set(geo_cells_within(lat, lng, radius))
+        # نقطة على حافة نصف القطر تقريباً في اتجاه عشوائي
+        plat = lat + rng.uniform(-1, 1) * radius / 111.2
+        plng = lng + rng.uniform(-1, 1) * radius / 100.0
+        if haversine_km(lat, lng, plat, plng) <= radius:
+            assert geo_cell(plat, plng) in cells
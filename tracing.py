@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+tracing.py - تتبّع خفيف لكل طلب (trace id + spans) مع حفظ عيّنة في ملف JSONL.
+
+- كل طلب يأخذ trace id (أو يستخدم X-Trace-Id الوارد إن كان صالحاً).
+- span(name, **attrs) يسجّل زمن كل مرحلة في قائمة داخل الذاكرة (perf_counter + append)؛
+  خارج أي طلب (مهام الخلفية بلا trace) يرجع سياقاً فارغاً مشتركاً دون أي تكلفة تُذكر.
+- عند نهاية الطلب: يُكتب الـ trace فقط إن وقع في العيّنة (sample_rate) أو كان أبطأ من
+  slow_ms، فالطلب العادي غير المختار لا يكلّف أي I/O.
+- الكتابة إلحاقية (سطر JSON لكل trace) مع تدوير الملف عند تجاوز max_bytes.
+"""
+
+import os, json, time, uuid, random, threading, contextvars
+
+_CURRENT = contextvars.ContextVar("zomra_trace", default=None)
+
+_TRACE_ID_OK = frozenset("0123456789abcdefABCDEF-")
+
+
+class Trace:
+    __slots__ = ("trace_id", "name", "sampled", "t0", "wall", "spans", "attrs")
+
+    def __init__(self, trace_id: str, name: str, sampled: bool):
+        self.trace_id = trace_id
+        self.name = name
+        self.sampled = sampled
+        self.t0 = time.perf_counter()
+        self.wall = time.time()
+        self.spans = []  # (name, start_ms, dur_ms, attrs) — append آمن بين الخيوط
+        self.attrs = {}
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.t0) * 1000.0
+
+    def to_dict(self, duration_ms: float) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "ts": self.wall,
+            "duration_ms": round(duration_ms, 2),
+            "sampled": self.sampled,
+            "attrs": self.attrs,
+            "spans": [
+                {"name": n, "start_ms": round(s, 2), "dur_ms": round(d, 2), **(a or {})}
+                for n, s, d, a in self.spans
+            ],
+        }
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _Span:
+    __slots__ = ("trace", "name", "attrs", "t")
+
+    def __init__(self, trace: Trace, name: str, attrs: dict):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.t = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self.trace.spans.append(
+            (
+                self.name,
+                (self.t - self.trace.t0) * 1000.0,
+                (end - self.t) * 1000.0,
+                self.attrs,
+            )
+        )
+        return False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+def span(name: str, **attrs):
+    """with span("kb_search", q_len=12) as sp: ...; sp.set(score=90)"""
+    trace = _CURRENT.get()
+    if trace is None:
+        return _NO_SPAN
+    return _Span(trace, name, attrs)
+
+
+def traced(name: str):
+    """مزخرف: يلف الدالة كلها في span باسم name."""
+
+    def deco(fn):
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+
+        wrapper.__name__ = fn.__name__
+        wrapper.__doc__ = fn.__doc__
+        wrapper.__wrapped__ = fn
+        return wrapper
+
+    return deco
+
+
+def current_trace():
+    return _CURRENT.get()
+
+
+class Tracer:
+    def __init__(self, path: str, sample_rate: float = 0.01, slow_ms: float = 2000.0,
+                 max_bytes: int = 50 * 1024 * 1024, enabled: bool = True):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def clean_id(raw: str):
+        raw = (raw or "").strip()
+        if 8 <= len(raw) <= 64 and all(c in _TRACE_ID_OK for c in raw):
+            return raw
+        return None
+
+    def start(self, name: str, trace_id: str = None, force: bool = False):
+        """يبدأ trace للسياق الحالي ويرجع (trace, token) لإنهائه بـ finish."""
+        if not self.enabled:
+            return None, None
+        sampled = force or (self.sample_rate > 0 and random.random() < self.sample_rate)
+        trace = Trace(trace_id or uuid.uuid4().hex[:16], name, sampled)
+        return trace, _CURRENT.set(trace)
+
+    def finish(self, trace: Trace, token=None, **attrs):
+        """يُنهي الـ trace ويكتبه إن كان ضمن العيّنة أو بطيئاً. ترجع True إن كُتب."""
+        if token is not None:
+            try:
+                _CURRENT.reset(token)
+            except ValueError:
+                _CURRENT.set(None)
+        if trace is None:
+            return False
+        duration = trace.elapsed_ms()
+        slow = self.slow_ms > 0 and duration >= self.slow_ms
+        if not (trace.sampled or slow):
+            return False
+        trace.attrs.update(attrs)
+        if slow:
+            trace.attrs["slow"] = True
+        self._write(json.dumps(trace.to_dict(duration), ensure_ascii=False) + "\n")
+        return True
+
+    def _write(self, line: str):
+        data = line.encode("utf-8")
+        with self._lock:
+            try:
+                if self.max_bytes and os.path.exists(self.path) \
+                        and os.path.getsize(self.path) + len(data) > self.max_bytes:
+                    os.replace(self.path, self.path + ".1")
+                # O_APPEND: كتابة سطر كامل بنداء واحد، آمنة بين عمال gunicorn
+                fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, data)
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                print("⚠️ trace:", e)
+
+    def find(self, trace_id: str):
+        """بحث خطي عن trace في الملف الحالي والمُدوَّر (لأدوات الإدارة فقط)."""
+        for path in (self.path, self.path + ".1"):
+            if not os.path.exists(path):
+                continue
+            needle = f'"trace_id": "{trace_id}"'
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if needle in line:
+                        return json.loads(line)
+        return None
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+urgent_feed.py - لقطة مشتركة للاحتياج العاجل + بث الفروقات (SSE).
+
+- خيط واحد لكل عامل يعيد جلب المصدر كل refresh_s ثانية (فقط ما دام هناك مشتركون)،
+  ويقارن اللقطة الجديدة بالسابقة حسب اسم المستشفى: added / removed / changed.
+- كل مشترك له queue خاص؛ المشترك الخامل لا يكلف سوى انتظار على queue.
+- /api/urgent_needs يقرأ من نفس اللقطة (مع TTL) بدل جلب الـ Sheet في كل طلب.
+- listeners: دوال تُستدعى مع كل فرق (مثلاً لمطابقة الاحتياجات الجديدة مع المتبرعين)؛
+  أول لقطة في العملية تصلها كاملة كـ added، فالاحتياج المنشور أثناء توقف العامل لا يضيع.
+- start_polling(interval_s): يُبقي الخيط يعمل بلا مشتركين كي لا تعتمد المستمعات على الزيارات.
+- build_index (اختياري): يُبنى فهرس جديد مع كل لقطة متغيّرة (انظر urgent_index.py).
+"""
+
+import os, json, time, queue, hashlib, threading
+
+
+def _row_key(row: dict) -> str:
+    return row.get("hospital") or ""
+
+
+def diff_snapshots(old: dict, new: dict) -> dict:
+    """old/new: {hospital: row}. ترجع {"added": [...], "removed": [...], "changed": [...]}."""
+    added = [new[k] for k in new if k not in old]
+    removed = [k for k in old if k not in new]
+    changed = [new[k] for k in new if k in old and new[k] != old[k]]
+    return {"added": added, "removed": removed, "changed": changed}
+
+
+class UrgentFeed:
+    def __init__(self, fetch_rows, refresh_s: float = 30.0, max_clients: int = 2,
+                 build_index=None):
+        """fetch_rows() -> list[dict] بصيغة موحدة (hospital, status, details, location_url)."""
+        self.fetch_rows = fetch_rows
+        self.build_index = build_index
+        self.refresh_s = refresh_s
+        self.max_clients = max_clients
+        self.listeners = []
+        self._rows = {}
+        self._index = None
+        self._etag = None
+        self._fetched_at = 0.0
+        self._subs = set()
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.poll_s = None
+        self._wake = threading.Event()
+
+    # ---------- Snapshot ----------
+    def snapshot(self, max_age: float = None):
+        """ترجع (rows, etag, fetched_at) وتعيد الجلب إن كانت اللقطة أقدم من max_age."""
+        max_age = self.refresh_s if max_age is None else max_age
+        if not self._etag or time.time() - self._fetched_at > max_age:
+            self.refresh()
+        with self._lock:
+            return list(self._rows.values()), self._etag, self._fetched_at
+
+    def index(self, max_age: float = None):
+        """ترجع (index, etag) للقطة الحالية (None إن لم يُمرَّر build_index)."""
+        self.snapshot(max_age)
+        with self._lock:
+            return self._index, self._etag
+
+    def refresh(self):
+        # جلب واحد في كل مرة حتى لو طلبه عدة خيوط معاً
+        if not self._refresh_lock.acquire(blocking=False):
+            with self._refresh_lock:
+                return
+        try:
+            try:
+                rows = self.fetch_rows() or []
+            except Exception as e:
+                print("⚠️ urgent feed:", e)
+                return
+            new = {}
+            for r in rows:
+                k = _row_key(r)
+                if k:
+                    new[k] = r
+            etag = hashlib.sha1(
+                json.dumps(list(new.values()), ensure_ascii=False, sort_keys=True).encode("utf-8")
+            ).hexdigest()[:16]
+
+            index = None
+            if self.build_index is not None and etag != self._etag:
+                try:
+                    index = self.build_index(list(new.values()))
+                except Exception as e:
+                    print("⚠️ urgent index:", e)
+
+            with self._lock:
+                old, first = self._rows, self._etag is None
+                changed = etag != self._etag
+                if changed:
+                    self._index = index
+                self._rows, self._etag, self._fetched_at = new, etag, time.time()
+                subs = list(self._subs)
+
+            if changed:
+                diff = diff_snapshots(old, new)
+                diff["etag"] = etag
+                # المشترك يستلم اللقطة الأولى كاملة عند الاتصال (event: snapshot)
+                for q in subs if not first else ():
+                    try:
+                        q.put_nowait(diff)
+                    except queue.Full:
+                        pass
+                for fn in self.listeners:
+                    try:
+                        fn(diff)
+                    except Exception as e:
+                        print("⚠️ urgent listener:", e)
+        finally:
+            self._refresh_lock.release()
+
+    # ---------- Subscribers ----------
+    def subscribe(self):
+        """ترجع queue جديداً أو None إن امتلأ عدد المشتركين في هذا العامل."""
+        q = queue.Queue(maxsize=100)
+        with self._lock:
+            if len(self._subs) >= self.max_clients:
+                return None
+            self._subs.add(q)
+        self._ensure_thread()
+        if self.poll_s:
+            self._wake.set()  # لا ينتظر المشترك نهاية فترة استطلاع طويلة
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subs.discard(q)
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len(self._subs)
+
+    def start_polling(self, interval_s: float):
+        """جلب دوري كل interval_s ثانية حتى بلا مشتركين (يُستدعى بعد fork في كل عامل)."""
+        self.poll_s = interval_s
+        self._ensure_thread()
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._loop, name="urgent-feed", daemon=True
+            )
+            self._thread.start()
+
+    def _loop(self):
+        # يتوقف الخيط عند عدم وجود مشتركين ولا استطلاع دوري، ويُعاد تشغيله مع أول اشتراك جديد
+        if self.poll_s and self._etag is None:
+            self.refresh()  # اللقطة الأولى فوراً بعد الإقلاع، لا بعد أول فترة
+        while True:
+            wait = self.refresh_s if self.subscriber_count() or not self.poll_s else self.poll_s
+            self._wake.wait(wait)
+            self._wake.clear()
+            with self._lock:
+                if not self._subs and not self.poll_s:
+                    self._thread = None
+                    return
+            self.refresh()
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+urgent_index.py - تحويل صفوف الاحتياج العاجل إلى حقول منظّمة + فهارس في الذاكرة.
+
+- parse_need(row): يستخرج مرة واحدة عند الجلب فصائل الدم ("+O" / "B-" / "O سالب")،
+  ونوع المكوّن (صفائح/بلازما/كريات حمراء/دم كامل)، ودرجة الإلحاح من الحالة.
+- CenterLocator: يربط اسم المستشفى بإحداثيات (من centers_jeddah.json أو من أعمدة
+  lat/lng في المصدر) مع ذاكرة للأسماء التي سبق ربطها.
+- UrgentIndex: فهرس فصيلة → احتياجات، وشبكة جغرافية (خلايا بحجم ثابت بالدرجات)
+  فيُجاب على ?blood_type=O-&near=lat,lng بقراءة خلايا قليلة بدل المرور على القائمة كلها.
+"""
+
+import math, re
+
+BLOOD_TYPES = ("O-", "O+", "A-", "A+", "B-", "B+", "AB-", "AB+")
+
+# "+O" و"O+" و"AB-" و"O سالب" و"A موجب"
+_BLOOD_RE = re.compile(
+    r"(?<![A-Za-z])([+-]?)\s?(AB|A|B|O)\s?([+-]|\s?(?:موجب|سالب|pos(?:itive)?|neg(?:ative)?))?(?![A-Za-z])",
+    re.IGNORECASE,
+)
+
+_COMPONENTS = (
+    ("platelets", re.compile(r"صفائح|صفيحات|platelet", re.IGNORECASE)),
+    ("plasma", re.compile(r"بلازما|plasma", re.IGNORECASE)),
+    ("red_cells", re.compile(r"كريات|خلايا حمراء|red\s*cell|rbc|prbc", re.IGNORECASE)),
+)
+
+# نفس تصنيف الواجهة (urgent-card: critical / high / normal)
+URGENCY_LEVELS = {"critical": 3, "high": 2, "normal": 1}
+_CRITICAL_RE = re.compile(r"عاجل|طارئ|مرتفع جداً|مرتفع جدا|critical|urgent", re.IGNORECASE)
+_HIGH_RE = re.compile(r"مرتفع|متوسط|high", re.IGNORECASE)
+
+GRID_CELL_DEG = 0.1  # ≈ 11 كم عند خطوط عرض المملكة
+EARTH_KM = 6371.0
+
+
+def parse_blood_types(text: str):
+    out = []
+    for pre, letters, post in _BLOOD_RE.findall(text or ""):
+        post = (post or "").strip().lower()
+        if post in ("سالب",) or post.startswith("neg"):
+            post = "-"
+        elif post in ("موجب",) or post.startswith("pos"):
+            post = "+"
+        sign = post or pre
+        if not sign:
+            continue  # حرف منفرد بلا إشارة (مثل "A" في نص إنجليزي) ليس فصيلة
+        bt = letters.upper() + sign
+        if bt not in out:
+            out.append(bt)
+    return out
+
+
+def parse_component(text: str) -> str:
+    for name, rx in _COMPONENTS:
+        if rx.search(text or ""):
+            return name
+    return "whole_blood"
+
+
+def parse_urgency(status: str) -> str:
+    if _CRITICAL_RE.search(status or ""):
+        return "critical"
+    if _HIGH_RE.search(status or ""):
+        return "high"
+    return "normal"
+
+
+def _float(v):
+    try:
+        f = float(v)
+    except (TypeError, ValueError):
+        return None
+    return f if math.isfinite(f) else None
+
+
+class CenterLocator:
+    """اسم المستشفى → (lat, lng) من قائمة المراكز، بمطابقة تقريبية على الاسم المطبّع."""
+
+    def __init__(self, centers, normalize, score_fn=None, threshold: int = 80):
+        self.normalize = normalize
+        self.score_fn = score_fn
+        self.threshold = threshold
+        self._centers = []
+        for c in centers or []:
+            lat, lng = _float(c.get("lat")), _float(c.get("lng"))
+            if c.get("name") and lat is not None and lng is not None:
+                self._centers.append((normalize(c["name"]), lat, lng))
+        self._memo = {}
+
+    def locate(self, name: str):
+        if not name:
+            return None
+        if name in self._memo:
+            return self._memo[name]
+        key = self.normalize(name)
+        best, best_score = None, -1
+        for cname, lat, lng in self._centers:
+            if cname == key:
+                best, best_score = (lat, lng), 100
+                break
+            if self.score_fn is not None:
+                s = self.score_fn(key, cname)
+                if s > best_score:
+                    best, best_score = (lat, lng), s
+        hit = best if best_score >= self.threshold else None
+        if len(self._memo) > 4096:
+            self._memo.clear()
+        self._memo[name] = hit
+        return hit
+
+
+def parse_need(row: dict, locator: CenterLocator = None) -> dict:
+    """يضيف للصف الحقول المنظّمة: blood_types, component, urgency, urgency_level, lat, lng."""
+    text = f"{row.get('details', '')} {row.get('status', '')}"
+    urgency = parse_urgency(row.get("status", ""))
+    lat, lng = _float(row.get("lat")), _float(row.get("lng"))
+    if (lat is None or lng is None) and locator is not None:
+        hit = locator.locate(row.get("hospital", ""))
+        if hit:
+            lat, lng = hit
+    return dict(
+        row,
+        blood_types=parse_blood_types(text),
+        component=parse_component(text),
+        urgency=urgency,
+        urgency_level=URGENCY_LEVELS[urgency],
+        lat=lat,
+        lng=lng,
+    )
+
+
+def haversine_km(lat1, lng1, lat2, lng2) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lng2 - lng1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_KM * math.asin(math.sqrt(a))
+
+
+def _cell(lat: float, lng: float):
+    return (math.floor(lat / GRID_CELL_DEG), math.floor(lng / GRID_CELL_DEG))
+
+
+def cell_range(lat: float, lng: float, radius_km: float):
+    """كل خلايا الشبكة التي قد تحوي نقاطاً ضمن radius_km من (lat, lng)."""
+    dlat = radius_km / 111.0
+    dlng = radius_km / (111.0 * max(0.01, math.cos(math.radians(lat))))
+    c0 = _cell(lat - dlat, lng - dlng)
+    c1 = _cell(lat + dlat, lng + dlng)
+    return [
+        (ci, cj)
+        for ci in range(c0[0], c1[0] + 1)
+        for cj in range(c0[1], c1[1] + 1)
+    ]
+
+
+def geo_cell(lat: float, lng: float) -> str:
+    """مفتاح الخلية كنص ("i:j") للتخزين والفهرسة في SQLite."""
+    ci, cj = _cell(lat, lng)
+    return f"{ci}:{cj}"
+
+
+def geo_cells_within(lat: float, lng: float, radius_km: float):
+    return [f"{ci}:{cj}" for ci, cj in cell_range(lat, lng, radius_km)]
+
+
+class UrgentIndex:
+    """فهرس ثابت (يُبنى مرة لكل لقطة ويُستبدل كاملاً عند التغيير)."""
+
+    def __init__(self, needs):
+        self.needs = list(needs)
+        self.by_type = {}
+        self.grid = {}
+        for i, n in enumerate(self.needs):
+            for bt in n.get("blood_types") or ():
+                self.by_type.setdefault(bt, []).append(i)
+            if n.get("lat") is not None and n.get("lng") is not None:
+                self.grid.setdefault(_cell(n["lat"], n["lng"]), []).append(i)
+
+    def __len__(self):
+        return len(self.needs)
+
+    def _near_ids(self, lat: float, lng: float, radius_km: float):
+        # عدد الخلايا المقروءة يعتمد على نصف القطر فقط، لا على عدد المستشفيات
+        out = {}
+        for cell in cell_range(lat, lng, radius_km):
+            for i in self.grid.get(cell, ()):
+                n = self.needs[i]
+                d = haversine_km(lat, lng, n["lat"], n["lng"])
+                if d <= radius_km:
+                    out[i] = d
+        return out
+
+    def query(self, blood_type: str = None, near=None, radius_km: float = 25.0,
+              min_urgency: int = 0, limit: int = None):
+        """
+        ترجع [(need, distance_km|None)]: الأقرب أولاً عند near، وإلا الأعلى إلحاحاً.
+        """
+        ids = None
+        if blood_type:
+            ids = set(self.by_type.get(blood_type, ()))
+        dist = {}
+        if near is not None:
+            dist = self._near_ids(near[0], near[1], radius_km)
+            ids = set(dist) if ids is None else ids & set(dist)
+        if ids is None:
+            ids = range(len(self.needs))
+
+        hits = [i for i in ids if self.needs[i].get("urgency_level", 0) >= min_urgency]
+        if near is not None:
+            hits.sort(key=lambda i: dist[i])
+        else:
+            hits.sort(key=lambda i: (-self.needs[i].get("urgency_level", 0), i))
+        if limit:
+            hits = hits[:limit]
+        return [(self.needs[i], dist.get(i)) for i in hits]